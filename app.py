@@ -1,42 +1,108 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, make_response
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, make_response, g, abort
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timedelta
 from dateutil import parser
 import calendar
 from passlib.hash import pbkdf2_sha256
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, set_access_cookies, unset_jwt_cookies, verify_jwt_in_request
-from sqlalchemy import or_
+from sqlalchemy import and_, case, extract, func, literal, or_, update
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.pool import QueuePool
 from flask_wtf.csrf import CSRFProtect, CSRFError
 import os
 from dotenv import load_dotenv
 import logging
-import pymysql
+import threading
+import time
+from functools import wraps
+from collections import OrderedDict, namedtuple
+from itertools import islice
+import heapq
+from calendar_index import CalendarIndex
+from search_index import SearchIndex, normalize as normalize_search_text
+from compression import init_compression
+from db_routing import RoutingSession, replica_reads, router as replica_router
+from caching import ByteLRUCache, SingleFlight
+from fragment_cache import FragmentCacheExtension, LazySequence
+from json_provider import FastJSONProvider, stream_json
+from profiling import init_profiling
+from read_models import BirthdayRow, find_upcoming, load_upcoming, occurrences_between, upcoming_birthday
+from sqlite_profile import engine_options as sqlite_engine_options, init_sqlite, is_sqlite
+from cooperative import is_cooperative, run_in_thread
 
-# Set up PyMySQL to work with SQLAlchemy
-pymysql.install_as_MySQLdb()
+try:
+    import pymysql
+except ImportError:
+    # Only needed for MySQL, SQLite installs can do without
+    pymysql = None
+else:
+    # Set up PyMySQL to work with SQLAlchemy
+    pymysql.install_as_MySQLdb()
 
 # Load environment variables from .env file
 load_dotenv()
 
 app = Flask(__name__)
+logger = logging.getLogger('app')
+
+# orjson when installed, dates serialized as YYYY-MM-DD
+app.json = FastJSONProvider(app)
 
 # Configuration
 # Use environment variables for sensitive settings with fallbacks
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
 
-# MySQL Database Configuration
+# Database Configuration: MySQL, or an embedded SQLite database with a sqlite:// URI (see sqlite_profile.py)
 # Construct the SQLAlchemy URI directly with the actual values
 db_uri = os.environ.get('DATABASE_SERVICE_URI')
 app.config['SQLALCHEMY_DATABASE_URI'] = db_uri
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-    'pool_recycle': 280,
-    'connect_args': {
-        'connect_timeout': 10,
-        'read_timeout': 10,
-        'write_timeout': 10
+
+# SQLite tuning: pooled connections (one per thread), page cache per connection on top of the shared mmap
+app.config['SQLITE_POOL_SIZE'] = int(os.environ.get('SQLITE_POOL_SIZE', 8))
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+app.config['SQLITE_CACHE_SIZE_KB'] = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 16 * 1024))
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+
+# Connections kept per engine and worker, extra ones opened under load, and how long a request waits for one.
+# Sync workers need one per thread; gevent workers share them between their greenlets, see gunicorn_config.py
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+
+def engine_options_for(uri):
+    """
+    SQLAlchemy engine options for a database URI, shared by the primary and the replicas
+    """
+    if is_sqlite(uri):
+        return sqlite_engine_options(uri, app.config['SQLITE_POOL_SIZE'], app.config['SQLITE_BUSY_TIMEOUT_MS'], is_cooperative())
+    # Pre-ping checks each connection on checkout, so one dropped by the server or a failover is replaced
+    options = {
+        'pool_recycle': 280,
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() != 'false',
+        'pool_size': app.config['DB_POOL_SIZE'],
+        'max_overflow': app.config['DB_MAX_OVERFLOW'],
+        'pool_timeout': app.config['DB_POOL_TIMEOUT']
     }
-}
+    if uri and uri.startswith('mysql'):
+        options['connect_args'] = {
+            'connect_timeout': 10,
+            'read_timeout': 10,
+            'write_timeout': 10
+        }
+    return options
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options_for(db_uri)
+
+# Optional read replicas (comma-separated URIs) for read-only endpoints and bulk scans
+app.config['DATABASE_REPLICA_URIS'] = [uri.strip() for uri in os.environ.get('DATABASE_REPLICA_URIS', '').split(',') if uri.strip()]
+app.config['REPLICA_EJECT_SECONDS'] = int(os.environ.get('REPLICA_EJECT_SECONDS', 30))
+# Extra attempts of a read-only view after a disconnect, and the pause before each
+app.config['DB_READ_RETRIES'] = int(os.environ.get('DB_READ_RETRIES', 1))
+app.config['DB_RETRY_DELAY'] = float(os.environ.get('DB_RETRY_DELAY', 0.1))
+# How long a client reads from the primary after a write, so it sees its own changes despite replica lag
+app.config['READ_YOUR_WRITES_SECONDS'] = int(os.environ.get('READ_YOUR_WRITES_SECONDS', 10))
 
 # CSRF Configuration
 app.config['WTF_CSRF_CHECK_DEFAULT'] = False
@@ -53,6 +119,12 @@ jwt = JWTManager(app)
 # Enable CSRF protection globally but with our configuration
 csrf = CSRFProtect(app)
 
+# Response compression, registered first so it runs after the other after_request hooks
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+app.config['COMPRESS_CACHE_BYTES'] = int(os.environ.get('COMPRESS_CACHE_BYTES', 16 * 1024 * 1024))
+init_compression(app)
+
 # Security headers
 @app.after_request
 def add_security_headers(response):
@@ -66,7 +138,104 @@ def add_security_headers(response):
     response.headers['Content-Security-Policy'] = "default-src 'self'; script-src 'self' https://cdn.jsdelivr.net; style-src 'self' https://cdn.jsdelivr.net https://fonts.googleapis.com; font-src 'self' https://fonts.gstatic.com https://cdn.jsdelivr.net; img-src 'self' https://images.unsplash.com data:;"
     return response
 
-db = SQLAlchemy(app)
+# Arrays with at least this many items are streamed in chunks instead of built as one body (0 disables).
+# Streamed responses get no ETag nor app-level compression, leave that to nginx when enabling it.
+app.config['JSON_STREAM_MIN_ITEMS'] = int(os.environ.get('JSON_STREAM_MIN_ITEMS', 0))
+app.config['JSON_STREAM_CHUNK_SIZE'] = int(os.environ.get('JSON_STREAM_CHUNK_SIZE', 1000))
+
+def should_stream(count):
+    return 0 < app.config['JSON_STREAM_MIN_ITEMS'] <= count
+
+# ETags for JSON API reads, so unchanged responses become 304s and compressed bodies can be cached
+@app.after_request
+def add_api_etag(response):
+    if (request.method == 'GET' and request.path.startswith('/api/') and not response.is_streamed
+            and response.status_code == 200 and response.mimetype == 'application/json'):
+        response.add_etag()
+        response.make_conditional(request)
+    return response
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+replica_router.configure(
+    app.config['DATABASE_REPLICA_URIS'],
+    engine_options=engine_options_for,
+    eject_seconds=app.config['REPLICA_EJECT_SECONDS']
+)
+init_sqlite(app, lambda: [db.engine] + replica_router.engines)
+
+# Opt-in request profiling, see profiling.py; nothing is registered while every trigger is off
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_ROUTES'] = [route.strip() for route in os.environ.get('PROFILE_ROUTES', '').split(',') if route.strip()]
+app.config['PROFILE_SECRET'] = os.environ.get('PROFILE_SECRET')
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', 'profiles')
+app.config['PROFILE_MAX_FILES'] = int(os.environ.get('PROFILE_MAX_FILES', 100))
+init_profiling(app, lambda: [db.engine] + replica_router.engines)
+
+# Cookie holding the time until which a client that just wrote reads from the primary
+PRIMARY_UNTIL_COOKIE = 'read_primary_until'
+
+def read_only(view):
+    """
+    Let a read-only view query the replicas, unless the client wrote recently
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            primary_until = float(request.cookies.get(PRIMARY_UNTIL_COOKIE, 0))
+        except ValueError:
+            primary_until = 0
+        use_replicas = primary_until < time.time() and bool(replica_router.engines)
+        retries = app.config['DB_READ_RETRIES']
+        while True:
+            try:
+                with replica_reads(use_replicas):
+                    return view(*args, **kwargs)
+            except DBAPIError as e:
+                # A failing replica has been ejected, a dead connection invalidated: read-only views are
+                # safe to run again, on the next healthy replica or a fresh connection
+                if retries <= 0 or not (e.connection_invalidated or use_replicas and isinstance(e, OperationalError)):
+                    raise
+                retries -= 1
+                logger.warning(f"Retrying {request.path} after database error: {e.orig}")
+                db.session.rollback()
+                time.sleep(app.config['DB_RETRY_DELAY'])
+    return wrapper
+
+def reset_pools_after_fork(warm_connections=0):
+    """
+    Drop the connections inherited from the parent process and open warm_connections new ones
+    per engine, for gunicorn's post_fork with preload_app (or post_worker_init without it)
+    """
+    with app.app_context():
+        engines = [db.engine] + replica_router.engines
+        for engine in engines:
+            # close=False leaves the parent's sockets alone, the parent still owns them
+            engine.dispose(close=False)
+        for engine in engines:
+            # Connections beyond pool_size are closed on checkin, so there's no point opening more
+            count = min(warm_connections, engine.pool.size()) if isinstance(engine.pool, QueuePool) else warm_connections
+            connections = []
+            try:
+                for _ in range(count):
+                    connections.append(engine.connect())
+            except DBAPIError as e:
+                logger.warning(f"Could not pre-open connections to {engine.url.render_as_string(hide_password=True)}: {e.orig}")
+            finally:
+                for connection in connections:
+                    connection.close()
+
+def stick_to_primary():
+    """
+    Make the current client read from the primary for READ_YOUR_WRITES_SECONDS
+    """
+    g.stick_to_primary = True
+
+@app.after_request
+def set_primary_cookie(response):
+    if g.get('stick_to_primary') and replica_router.engines:
+        seconds = app.config['READ_YOUR_WRITES_SECONDS']
+        response.set_cookie(PRIMARY_UNTIL_COOKIE, str(time.time() + seconds), max_age=seconds, httponly=True, samesite='Lax')
+    return response
 
 # Custom error handler for CSRF errors
 @app.errorhandler(CSRFError)
@@ -83,13 +252,20 @@ class User(db.Model):
     birthdays = db.relationship('Birthday', backref='user', lazy=True)
     notifications = db.relationship('BirthdayNotification', backref='user', lazy=True)
     
+    # Hashing takes tens of milliseconds of CPU, off the event loop under gevent
     def set_password(self, password):
-        self.password_hash = pbkdf2_sha256.hash(password)
+        self.password_hash = run_in_thread(pbkdf2_sha256.hash, password)
         
     def check_password(self, password):
-        return pbkdf2_sha256.verify(password, self.password_hash)
+        return run_in_thread(pbkdf2_sha256.verify, password, self.password_hash)
 
 class Birthday(db.Model):
+    # Per-user lookups in date order, see query_user_birthday_rows, and by name prefix, see search_birthdays
+    __table_args__ = (
+        db.Index('ix_birthday_user_id_date', 'user_id', 'date'),
+        db.Index('ix_birthday_user_id_name', 'user_id', 'name'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     date = db.Column(db.Date, nullable=False)
@@ -102,6 +278,14 @@ class Birthday(db.Model):
         return f'<Birthday {self.name}>'
 
 class BirthdayNotification(db.Model):
+    # Retention archives and deletes whole years, oldest first. The foreign key columns are indexed
+    # explicitly (MySQL would create them implicitly, SQLite not), user_id for the notifier's dedupe
+    __table_args__ = (
+        db.Index('ix_birthday_notification_year_notified', 'year_notified', 'id'),
+        db.Index('ix_birthday_notification_user_id_year', 'user_id', 'year_notified'),
+        db.Index('ix_birthday_notification_birthday_id', 'birthday_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     birthday_id = db.Column(db.Integer, db.ForeignKey('birthday.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -112,66 +296,449 @@ class BirthdayNotification(db.Model):
     def __repr__(self):
         return f'<BirthdayNotification for {self.birthday_id} sent on {self.notification_date}>'
 
+class BirthdayNotificationArchive(db.Model):
+    """Cold copy of BirthdayNotification rows moved out of the hot table by retention.py"""
+    __tablename__ = 'birthday_notification_archive'
+    __table_args__ = (db.Index('ix_birthday_notification_archive_user_year', 'user_id', 'year_notified'),)
+
+    # Same ids as in birthday_notification, without foreign keys since birthdays and users may be deleted later
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    birthday_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    notification_date = db.Column(db.Date, nullable=False)
+    year_notified = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class NotifierRunState(db.Model):
+    """High-water mark of the last date processed by the notifier for a shard and window"""
+    __table_args__ = (db.UniqueConstraint('shard', 'shard_count', 'window_days', name='uq_notifier_run_state'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    shard = db.Column(db.Integer, nullable=False, default=0)
+    shard_count = db.Column(db.Integer, nullable=False, default=1)
+    window_days = db.Column(db.Integer, nullable=False)
+    last_processed_date = db.Column(db.Date, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<NotifierRunState shard {self.shard}/{self.shard_count} window {self.window_days} at {self.last_processed_date}>'
+
+class NotificationPreference(db.Model):
+    """A user's reminder cadence, users without a row get daily reminders"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, autoincrement=False)
+    cadence = db.Column(db.String(10), nullable=False, default='daily')  # One of NOTIFICATION_CADENCES
+    digest_weekday = db.Column(db.Integer, nullable=False, default=0)  # Day of the weekly digest, 0 is Monday
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_json(self):
+        return {'cadence': self.cadence, 'digest_weekday': self.digest_weekday}
+
+# daily: a reminder for the birthdays of the next days, every day
+# weekly: one digest of the 7 days starting on digest_weekday
+# monthly: one preview of the whole month, on its 1st
+NOTIFICATION_CADENCES = ('daily', 'weekly', 'monthly')
+
+class NotificationRun(db.Model):
+    """Telemetry of one notifier run, see notification_runs.py"""
+    __table_args__ = (db.Index('ix_notification_run_started_at', 'started_at'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    status = db.Column(db.String(20), nullable=False, default='running')  # running, success, failed, error, up_to_date, dry_run
+    run_date = db.Column(db.Date, nullable=False)
+    shard = db.Column(db.Integer, nullable=False, default=0)
+    shard_count = db.Column(db.Integer, nullable=False, default=1)
+    # Counts
+    users_scanned = db.Column(db.Integer, nullable=False, default=0)
+    reminders_found = db.Column(db.Integer, nullable=False, default=0)
+    reminders_skipped = db.Column(db.Integer, nullable=False, default=0)  # Already notified
+    emails_sent = db.Column(db.Integer, nullable=False, default=0)
+    emails_failed = db.Column(db.Integer, nullable=False, default=0)
+    emails_spooled = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Counted in emails_sent too
+    email_bytes_sent = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')  # Request bodies sent to the email API
+    # Seconds spent per stage, summed over the stage's worker threads
+    candidate_seconds = db.Column(db.Float, nullable=False, default=0)
+    dedupe_seconds = db.Column(db.Float, nullable=False, default=0)
+    render_seconds = db.Column(db.Float, nullable=False, default=0)
+    send_seconds = db.Column(db.Float, nullable=False, default=0)
+    record_seconds = db.Column(db.Float, nullable=False, default=0)
+    # Latency distribution of the email API calls, in milliseconds
+    email_latency_p50_ms = db.Column(db.Float)
+    email_latency_p95_ms = db.Column(db.Float)
+    email_latency_p99_ms = db.Column(db.Float)
+    email_latency_max_ms = db.Column(db.Float)
+
+    def __repr__(self):
+        return f'<NotificationRun {self.id} {self.run_date} {self.status}>'
+
+class MigrationCheckpoint(db.Model):
+    """Progress of a chunked data migration, see migrations.py"""
+    name = db.Column(db.String(100), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)  # Last primary key value done
+    rows_changed = db.Column(db.Integer, nullable=False, default=0)
+    completed_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class UserDataVersion(db.Model):
+    """Counter bumped whenever a user's birthdays change, used to validate per-user caches"""
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # LEGACY_DATA_VERSION_KEY for birthdays without a user_id
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+# Data version key of the birthdays without a user_id, which every user sees
+LEGACY_DATA_VERSION_KEY = 0
+
+class BirthdayChange(db.Model):
+    """
+    Change feed entry: a birthday added, updated or deleted by a user, under the user's data
+    version it was written with. Written in the same transaction as the change, see log_birthday_changes
+    """
+    __table_args__ = (
+        db.Index('ix_birthday_change_user_id_version', 'user_id', 'version'),
+        db.Index('ix_birthday_change_created_at', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # No foreign keys, entries outlive deleted birthdays until compact_changes.py removes them
+    user_id = db.Column(db.Integer, nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)  # One of BIRTHDAY_CHANGE_OPS
+    birthday_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+BIRTHDAY_CHANGE_OPS = ('add', 'update', 'delete')
+
+class UserActivity(db.Model):
+    """When a user last logged in, to know whose upcoming birthdays are worth precomputing"""
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    last_login_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    __table_args__ = (db.Index('ix_user_activity_last_login_at', 'last_login_at'),)
+
+class UpcomingSnapshot(db.Model):
+    """A user's upcoming birthdays on a day, precomputed by precompute_upcoming.py (see read_models.dump_upcoming)"""
+    day = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    # The data versions the birthdays were read at, the snapshot is stale once they changed
+    user_version = db.Column(db.Integer, nullable=False)
+    legacy_version = db.Column(db.Integer, nullable=False)
+    birthdays = db.Column(db.Text, nullable=False)
+
+class UpcomingPublication(db.Model):
+    """The snapshots of a day are only read once its publication row is committed, all at once"""
+    day = db.Column(db.Date, primary_key=True)
+    window_days = db.Column(db.Integer, nullable=False)
+    users = db.Column(db.Integer, nullable=False)
+    published_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
 # Create tables if they don't exist
 with app.app_context():
     db.create_all()
 
+def get_data_version(user_id):
+    """
+    Return the (user version, legacy version) pair for a user's visible birthdays
+    """
+    versions = dict(db.session.query(UserDataVersion.user_id, UserDataVersion.version).filter(
+        UserDataVersion.user_id.in_([user_id, LEGACY_DATA_VERSION_KEY])
+    ).all())
+    return (versions.get(user_id, 0), versions.get(LEGACY_DATA_VERSION_KEY, 0))
+
+def bump_data_version(user_id):
+    """
+    Increment a data version in the current transaction, returning its row; the caller commits
+    """
+    row = db.session.get(UserDataVersion, user_id)
+    if row is None:
+        row = UserDataVersion(user_id=user_id, version=1)
+        db.session.add(row)
+    else:
+        row.version = UserDataVersion.version + 1
+    return row
+
+def log_birthday_changes(user_id, changes):
+    """
+    Bump a user's data version and record changes, (op, birthday id) pairs, in the change feed under
+    the new version, in the current transaction; the caller commits. Returns the new version.
+    """
+    # The version row stays locked until the commit, so a user's versions are committed in order
+    row = bump_data_version(user_id)
+    db.session.flush()
+    version = row.version
+    now = datetime.utcnow()
+    db.session.execute(BirthdayChange.__table__.insert(), [
+        {'user_id': user_id, 'version': version, 'op': op, 'birthday_id': birthday_id, 'created_at': now}
+        for op, birthday_id in changes
+    ])
+    return version
+
+# Birthdays without a user_id are shown to every user until migrate_data.py assigns them;
+# set LEGACY_BIRTHDAYS_ENABLED=false once it has run to stop looking for them
+app.config['LEGACY_BIRTHDAYS_ENABLED'] = os.environ.get('LEGACY_BIRTHDAYS_ENABLED', 'true').lower() != 'false'
+
+# Per-worker (legacy data version, rows) of the birthdays without a user_id, the same for every user
+legacy_birthdays = None
+legacy_birthdays_lock = threading.Lock()
+
+def get_legacy_birthday_rows(legacy_version):
+    """
+    Return the birthdays without a user_id as an immutable tuple of BirthdayRow ordered by date,
+    reloading them when legacy_version changed
+    """
+    global legacy_birthdays
+    if not app.config['LEGACY_BIRTHDAYS_ENABLED']:
+        return ()
+    cached = legacy_birthdays
+    if cached is not None and cached[0] == legacy_version:
+        return cached[1]
+    
+    rows = db.session.query(
+        Birthday.id, Birthday.name, Birthday.date, Birthday.notes, Birthday.created_at
+    ).filter(Birthday.user_id.is_(None)).order_by(Birthday.date)
+    rows = tuple(BirthdayRow._make(row) for row in rows)
+    with legacy_birthdays_lock:
+        legacy_birthdays = (legacy_version, rows)
+    return rows
+
+# Per-worker cache of rendered template fragments, keyed by (fragment, user_id, ...)
+app.config.setdefault('FRAGMENT_CACHE_BYTES', int(os.environ.get('FRAGMENT_CACHE_BYTES', 64 * 1024 * 1024)))
+app.config.setdefault('FRAGMENT_CACHE_STATS_INTERVAL', int(os.environ.get('FRAGMENT_CACHE_STATS_INTERVAL', 1000)))
+app.jinja_env.add_extension(FragmentCacheExtension)
+fragment_cache = ByteLRUCache(app.config['FRAGMENT_CACHE_BYTES'])
+app.jinja_env.fragment_cache = fragment_cache if app.config['FRAGMENT_CACHE_BYTES'] else None
+app.jinja_env.fragment_cache_stats_interval = app.config['FRAGMENT_CACHE_STATS_INTERVAL']
+
+def invalidate_fragments(user_id=None):
+    """
+    Drop the cached fragments of a user, or of every user
+    """
+    fragment_cache.delete_where(lambda key: user_id is None or key[1] == user_id)
+
+# Per-worker LRU cache of user_id -> (data version, CalendarIndex)
+app.config.setdefault('CALENDAR_INDEX_CACHE_SIZE', int(os.environ.get('CALENDAR_INDEX_CACHE_SIZE', 1000)))
+calendar_indexes = OrderedDict()
+calendar_indexes_lock = threading.Lock()
+
+def get_calendar_index(user_id):
+    """
+    Return the calendar index of a user's birthdays, rebuilding it when the data version changed
+    """
+    version = get_data_version(user_id)
+    with calendar_indexes_lock:
+        cached = calendar_indexes.get(user_id)
+        if cached is not None and cached[0] == version:
+            calendar_indexes.move_to_end(user_id)
+            return cached[1]
+    
+    index = CalendarIndex(row[:4] for row in query_user_birthday_rows(user_id, version))
+    
+    with calendar_indexes_lock:
+        calendar_indexes[user_id] = (version, index)
+        calendar_indexes.move_to_end(user_id)
+        while len(calendar_indexes) > app.config['CALENDAR_INDEX_CACHE_SIZE']:
+            calendar_indexes.popitem(last=False)
+    return index
+
+def update_calendar_index(user_id, old_version, new_version, update):
+    """
+    Apply an incremental update to a cached calendar index if it was current at old_version,
+    otherwise drop it so the next request rebuilds it
+    """
+    with calendar_indexes_lock:
+        cached = calendar_indexes.get(user_id)
+        if cached is None:
+            return
+        # Any other change in between means the cached index can't be patched
+        expected_version = (old_version[0] + 1, old_version[1])
+        if cached[0] != old_version or new_version != expected_version:
+            del calendar_indexes[user_id]
+            return
+        update(cached[1])
+        calendar_indexes[user_id] = (new_version, cached[1])
+
+# Per-worker LRU cache of (user_id, day, days) -> (data version, [UpcomingBirthday]). Every key changes
+# at midnight: the lists of the default window are then read from the snapshots precompute_upcoming.py
+# published for the day, and concurrent misses of a user are computed once
+app.config.setdefault('UPCOMING_CACHE_SIZE', int(os.environ.get('UPCOMING_CACHE_SIZE', 5000)))
+app.config['UPCOMING_DEFAULT_DAYS'] = 30
+# How long a worker waits before looking again for a day's publication that wasn't there
+app.config['UPCOMING_PUBLICATION_RECHECK_SECONDS'] = int(os.environ.get('UPCOMING_PUBLICATION_RECHECK_SECONDS', 60))
+upcoming_lists = OrderedDict()
+upcoming_lists_lock = threading.Lock()
+upcoming_flights = SingleFlight()
+# day -> (monotonic time checked, published window_days or None)
+upcoming_publications = {}
+
+def published_upcoming_window(day):
+    """
+    Return the window of the upcoming snapshots published for day, None if there are none (yet)
+    """
+    checked = upcoming_publications.get(day)
+    if checked is not None and (checked[1] is not None or time.monotonic() - checked[0] < app.config['UPCOMING_PUBLICATION_RECHECK_SECONDS']):
+        return checked[1]
+    window_days = db.session.query(UpcomingPublication.window_days).filter(UpcomingPublication.day == day).scalar()
+    with upcoming_lists_lock:
+        for old_day in [old_day for old_day in upcoming_publications if old_day < day]:
+            del upcoming_publications[old_day]
+        upcoming_publications[day] = (time.monotonic(), window_days)
+    return window_days
+
+def load_upcoming_snapshot(user_id, day, days, version):
+    """
+    Return a user's precomputed upcoming birthdays, None without a current snapshot
+    """
+    if published_upcoming_window(day) != days:
+        return None
+    row = db.session.query(UpcomingSnapshot.user_version, UpcomingSnapshot.legacy_version, UpcomingSnapshot.birthdays).filter(
+        UpcomingSnapshot.day == day, UpcomingSnapshot.user_id == user_id
+    ).first()
+    if row is None or (row.user_version, row.legacy_version) != tuple(version):
+        return None
+    return load_upcoming(row.birthdays)
+
+def get_upcoming_birthdays(user_id, today, days, version):
+    """
+    Return the UpcomingBirthday of a user's birthdays in the days from today, sorted by days until
+    birthday. version is the user's get_data_version(). The list is shared, don't modify it.
+    """
+    key = (user_id, today, days)
+    with upcoming_lists_lock:
+        cached = upcoming_lists.get(key)
+        if cached is not None and cached[0] == version:
+            upcoming_lists.move_to_end(key)
+            return cached[1]
+    
+    def load():
+        birthdays = load_upcoming_snapshot(user_id, today, days, version)
+        if birthdays is None:
+            birthdays = find_upcoming(query_user_birthday_rows(user_id, version), today, today + timedelta(days=days))
+        with upcoming_lists_lock:
+            upcoming_lists[key] = (version, birthdays)
+            upcoming_lists.move_to_end(key)
+            while len(upcoming_lists) > app.config['UPCOMING_CACHE_SIZE']:
+                upcoming_lists.popitem(last=False)
+        return birthdays
+    
+    return upcoming_flights.do(key + (version,), load)
+
+# Per-worker LRU cache of user_id -> (data version, SearchIndex), built in the background
+app.config.setdefault('SEARCH_INDEX_CACHE_SIZE', int(os.environ.get('SEARCH_INDEX_CACHE_SIZE', 100)))
+search_indexes = OrderedDict()
+search_index_builds = set()
+search_indexes_lock = threading.Lock()
+
+def get_search_index(user_id, version):
+    """
+    Return the cached search index of a user at a data version, or None after starting to build it
+    """
+    with search_indexes_lock:
+        cached = search_indexes.get(user_id)
+        if cached is not None and cached[0] == version:
+            search_indexes.move_to_end(user_id)
+            return cached[1]
+        if user_id in search_index_builds:
+            return None
+        search_index_builds.add(user_id)
+    
+    def build():
+        try:
+            with app.app_context():
+                rows = [row[:4] for row in query_user_birthday_rows(user_id, version)]
+            # Under gevent this thread is a greenlet: build in a native thread so requests keep being served
+            index = run_in_thread(SearchIndex, rows)
+            with search_indexes_lock:
+                search_indexes[user_id] = (version, index)
+                search_indexes.move_to_end(user_id)
+                while len(search_indexes) > app.config['SEARCH_INDEX_CACHE_SIZE']:
+                    search_indexes.popitem(last=False)
+        except Exception:
+            logger.exception(f"Could not build the search index of user {user_id}")
+        finally:
+            with search_indexes_lock:
+                search_index_builds.discard(user_id)
+    
+    threading.Thread(target=build, name=f"search-index-{user_id}", daemon=True).start()
+    return None
+
+def invalidate_search_index(user_id=None):
+    """
+    Drop the cached search index of a user, or of every user
+    """
+    with search_indexes_lock:
+        if user_id is None:
+            search_indexes.clear()
+        else:
+            search_indexes.pop(user_id, None)
+
+def search_birthdays_sql(user_id, query, limit, legacy_version):
+    """
+    Name prefix search on the (user_id, name) index, while the user's search index is being built.
+    Case and accent sensitivity follow the database collation.
+    Returns (number of matches, [(id, name, date, notes)]) ordered by name
+    """
+    matching = db.session.query(Birthday.id, Birthday.name, Birthday.date, Birthday.notes).filter(
+        Birthday.user_id == user_id,
+        Birthday.name.startswith(query, autoescape=True)
+    )
+    total = matching.order_by(None).count()
+    rows = matching.order_by(Birthday.name).limit(limit).all()
+    
+    prefix = normalize_search_text(query)
+    legacy_rows = [row[:4] for row in get_legacy_birthday_rows(legacy_version) if normalize_search_text(row.name).startswith(prefix)]
+    if legacy_rows:
+        total += len(legacy_rows)
+        rows = heapq.nsmallest(limit, list(rows) + legacy_rows, key=lambda row: row[1])
+    return total, rows
+
+def query_user_birthday_rows(user_id, data_version=None):
+    """
+    Return a user's birthdays and any without a user_id (for transition period) as BirthdayRow tuples,
+    ordered by date. data_version is the user's get_data_version(), looked up if not given.
+    """
+    if data_version is None:
+        data_version = get_data_version(user_id)
+    
+    # A plain user_id = ? range on the (user_id, date) index, the shared legacy rows come from the cache
+    rows = db.session.query(
+        Birthday.id, Birthday.name, Birthday.date, Birthday.notes, Birthday.created_at
+    ).filter(Birthday.user_id == user_id).order_by(Birthday.date)
+    rows = [BirthdayRow._make(row) for row in rows]
+    
+    legacy_rows = get_legacy_birthday_rows(data_version[1])
+    if not legacy_rows:
+        return rows
+    return list(heapq.merge(rows, legacy_rows, key=lambda row: row.date))
+
 @app.route('/api/upcoming_birthdays')
 @jwt_required()
+@read_only
 def upcoming_birthdays():
     # Get current user
     current_user_id = int(get_jwt_identity())
     
     # Get query parameters
-    days = request.args.get('days', default=30, type=int)
+    days = request.args.get('days', default=app.config['UPCOMING_DEFAULT_DAYS'], type=int)
     
     today = datetime.now().date()
-    end_date = today + timedelta(days=days)
     
     # Find birthdays in the upcoming days for the current user and any without a user_id
-    birthdays = []
+    birthdays = get_upcoming_birthdays(current_user_id, today, days, get_data_version(current_user_id))
     
-    # Get birthdays belonging to this user and any without a user_id
-    birthday_records = Birthday.query.filter(
-        or_(
-            Birthday.user_id == current_user_id,
-            Birthday.user_id == None
+    if should_stream(len(birthdays)):
+        return stream_json(
+            app, {'total': len(birthdays), 'days_checked': days},
+            'upcoming_birthdays', (birthday.to_json() for birthday in birthdays),
+            app.config['JSON_STREAM_CHUNK_SIZE']
         )
-    ).all()
-    
-    for birthday in birthday_records:
-        # Get this year's birthday
-        this_year_bday = birthday.date.replace(year=today.year)
-        
-        # If birthday already happened this year, look at next year
-        if this_year_bday < today:
-            this_year_bday = this_year_bday.replace(year=today.year + 1)
-        
-        # Check if birthday is within the requested range
-        if today <= this_year_bday <= end_date:
-            days_until = (this_year_bday - today).days
-            age = this_year_bday.year - birthday.date.year
-            
-            birthdays.append({
-                'id': birthday.id,
-                'name': birthday.name,
-                'date': birthday.date.strftime('%Y-%m-%d'),
-                'this_year_date': this_year_bday.strftime('%Y-%m-%d'),
-                'days_until': days_until,
-                'age': age,
-                'notes': birthday.notes
-            })
-    
-    # Sort by days until birthday
-    birthdays.sort(key=lambda x: x['days_until'])
     
     return jsonify({
-        'upcoming_birthdays': birthdays,
+        'upcoming_birthdays': [birthday.to_json() for birthday in birthdays],
         'total': len(birthdays),
         'days_checked': days
     })
 
 @app.route('/')
+@read_only
 def index():
     # Instead of manually checking for the cookie and using try/except,
     # we can use verify_jwt_in_request with optional=True
@@ -185,48 +752,23 @@ def index():
         # User is authenticated, convert string ID to integer
         current_user_id = int(jwt_identity)
         
-        # Get user's birthdays and any without a user_id (for transition period)
-        # Using SQLAlchemy OR condition
-        birthdays = Birthday.query.filter(
-            or_(
-                Birthday.user_id == current_user_id,
-                Birthday.user_id == None  # Birthdays without a user_id
-            )
-        ).order_by(Birthday.date).all()
+        # Get user's birthdays and any without a user_id (for transition period),
+        # only loaded if a fragment has to be rendered
+        data_version = get_data_version(current_user_id)
+        birthdays = LazySequence(lambda: query_user_birthday_rows(current_user_id, data_version))
         
         # Calculate upcoming birthdays (next 30 days)
         today = datetime.now().date()
-        end_date = today + timedelta(days=30)
+        upcoming = LazySequence(lambda: get_upcoming_birthdays(current_user_id, today, app.config['UPCOMING_DEFAULT_DAYS'], data_version))
         
-        upcoming = []
-        
-        for birthday in birthdays:
-            # Get this year's birthday
-            this_year_bday = birthday.date.replace(year=today.year)
-            
-            # If birthday already happened this year, look at next year
-            if this_year_bday < today:
-                this_year_bday = this_year_bday.replace(year=today.year + 1)
-            
-            # Check if birthday is within the next 30 days
-            if today <= this_year_bday <= end_date:
-                days_until = (this_year_bday - today).days
-                age = this_year_bday.year - birthday.date.year
-                
-                upcoming.append({
-                    'id': birthday.id,
-                    'name': birthday.name,
-                    'date': birthday.date,
-                    'this_year_date': this_year_bday,
-                    'days_until': days_until,
-                    'age': age,
-                    'notes': birthday.notes
-                })
-        
-        # Sort by days until birthday
-        upcoming.sort(key=lambda x: x['days_until'])
-        
-        return render_template('index.html', birthdays=birthdays, upcoming=upcoming)
+        return render_template(
+            'index.html',
+            birthdays=birthdays,
+            upcoming=upcoming,
+            today=today,
+            fragment_user_id=current_user_id,
+            data_version=data_version
+        )
     else:
         # User not logged in, show welcome page
         return render_template('welcome.html')
@@ -278,6 +820,14 @@ def login():
             # Create the JWT token with the user ID as a string
             access_token = create_access_token(identity=str(user.id))
             
+            # Logged in users get their upcoming birthdays precomputed for the next days
+            activity = db.session.get(UserActivity, user.id)
+            if activity is None:
+                db.session.add(UserActivity(user_id=user.id))
+            else:
+                activity.last_login_at = datetime.utcnow()
+            db.session.commit()
+            
             # Set the JWT cookies in the response
             response = make_response(redirect(url_for('index')))
             set_access_cookies(response, access_token)
@@ -313,8 +863,18 @@ def add_birthday():
             
             date = parser.parse(date_str).date()
             birthday = Birthday(name=name, date=date, notes=notes, user_id=current_user_id)
+            old_version = get_data_version(current_user_id)
             db.session.add(birthday)
+            db.session.flush()
+            log_birthday_changes(current_user_id, [('add', birthday.id)])
             db.session.commit()
+            stick_to_primary()
+            update_calendar_index(
+                current_user_id, old_version, get_data_version(current_user_id),
+                lambda index: index.add((birthday.id, birthday.name, birthday.date, birthday.notes))
+            )
+            invalidate_fragments(current_user_id)
+            invalidate_search_index(current_user_id)
             flash('Birthday added successfully!', 'success')
             return redirect(url_for('index'))
         except Exception as e:
@@ -325,81 +885,327 @@ def add_birthday():
 @jwt_required()
 def delete_birthday(id):
     current_user_id = int(get_jwt_identity())
-    birthday = Birthday.query.get_or_404(id)
+    status, results = apply_birthday_changes(current_user_id, delete_ids=[id])
+    result = results[0]['status']
     
-    # Check if the birthday belongs to the current user or has no user_id
-    if birthday.user_id is not None and birthday.user_id != current_user_id:
+    if result == 'not_found':
+        abort(404)
+    if result == 'forbidden':
         flash('Not authorized to delete this birthday.', 'danger')
         return redirect(url_for('index'))
     
-    # If birthday has no user_id, assign it to the current user before deleting
-    # This prevents other users from deleting it
-    if birthday.user_id is None:
-        birthday.user_id = current_user_id
-        db.session.commit()
-    
-    db.session.delete(birthday)
-    db.session.commit()
     flash('Birthday deleted successfully!', 'success')
     return redirect(url_for('index'))
 
-# Add this function to fetch upcoming birthdays in the next 2 days
-def get_upcoming_birthdays_next_two_days():
+# Largest number of ids accepted by one batch request
+app.config['BATCH_MAX_SIZE'] = int(os.environ.get('BATCH_MAX_SIZE', 1000))
+
+BATCH_UPDATE_FIELDS = {'name', 'date', 'notes'}
+
+def is_birthday_id(value):
+    # JSON true and false are ints to Python, and would stand for ids 1 and 0
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def parse_birthday_update(item):
     """
-    Fetch all upcoming birthdays in the next 2 days for all users
-    Returns a dictionary with user_id as key and a list of their upcoming birthdays as value
+    Validate one update of a batch, returning (id, values) or raising ValueError
     """
-    today = datetime.now().date()
-    end_date = today + timedelta(days=2)
+    if not isinstance(item, dict) or not is_birthday_id(item.get('id')):
+        raise ValueError('each update needs an integer id')
+    values = {key: value for key, value in item.items() if key != 'id'}
+    if not values:
+        raise ValueError('nothing to update')
+    unknown = set(values) - BATCH_UPDATE_FIELDS
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+    if 'name' in values and (not isinstance(values['name'], str) or not values['name'].strip() or len(values['name']) > 100):
+        raise ValueError('name must be a non-empty string of at most 100 characters')
+    if 'date' in values:
+        if not isinstance(values['date'], str):
+            raise ValueError('date must be a string')
+        try:
+            values['date'] = parser.parse(values['date']).date()
+        except (ValueError, OverflowError):
+            raise ValueError(f"invalid date: {values['date']}")
+    if 'notes' in values and values['notes'] is not None and not isinstance(values['notes'], str):
+        raise ValueError('notes must be a string or null')
+    return item['id'], values
+
+def apply_birthday_changes(user_id, delete_ids=(), updates=()):
+    """
+    Delete and update many birthdays of a user in one transaction, returning (HTTP status, per-id results).
+    
+    updates maps birthday ids to the new column values. Every id is checked for ownership up front:
+    if any belongs to another user nothing is changed. Ids that don't exist are reported as not_found
+    and the rest is applied. Birthdays without a user_id are claimed by the user before being changed,
+    like single deletes always did.
+    """
+    delete_ids = list(dict.fromkeys(delete_ids))
+    updates = dict(updates)
+    ids = delete_ids + [birthday_id for birthday_id in updates if birthday_id not in delete_ids]
     
-    # Dictionary to store user_id -> [upcoming birthdays]
-    user_birthdays = {}
+    # Lock the whole set, so ownership can't change before the statements below run
+    owners = dict(db.session.query(Birthday.id, Birthday.user_id).filter(
+        Birthday.id.in_(ids)
+    ).with_for_update().all()) if ids else {}
     
-    # Get all users
-    users = User.query.all()
+    results = {}
+    for birthday_id in ids:
+        if birthday_id not in owners:
+            results[birthday_id] = 'not_found'
+        elif owners[birthday_id] != user_id and (owners[birthday_id] is not None or not app.config['LEGACY_BIRTHDAYS_ENABLED']):
+            results[birthday_id] = 'forbidden'
     
-    for user in users:
-        # Get birthdays for this user
-        birthdays = Birthday.query.filter_by(user_id=user.id).all()
-        upcoming = []
+    if 'forbidden' in results.values():
+        db.session.rollback()
+        return 403, [{'id': birthday_id, 'status': results.get(birthday_id, 'skipped')} for birthday_id in ids]
+    
+    delete_ids = [birthday_id for birthday_id in delete_ids if birthday_id in owners]
+    update_ids = [birthday_id for birthday_id in updates if birthday_id in owners and birthday_id not in delete_ids]
+    legacy_ids = [birthday_id for birthday_id in delete_ids + update_ids if owners[birthday_id] is None]
+    
+    old_version = get_data_version(user_id)
+    if delete_ids:
+        BirthdayNotification.query.filter(
+            BirthdayNotification.birthday_id.in_(delete_ids)
+        ).delete(synchronize_session=False)
+        Birthday.query.filter(Birthday.id.in_(delete_ids)).delete(synchronize_session=False)
+    if update_ids:
+        db.session.execute(update(Birthday), [
+            dict(updates[birthday_id], id=birthday_id, user_id=user_id) for birthday_id in update_ids
+        ])
+    if delete_ids or update_ids:
+        log_birthday_changes(user_id, [('delete', birthday_id) for birthday_id in delete_ids] + [('update', birthday_id) for birthday_id in update_ids])
+        if legacy_ids:
+            bump_data_version(LEGACY_DATA_VERSION_KEY)
+    db.session.commit()
+    
+    if delete_ids or update_ids:
+        stick_to_primary()
+        updated_rows = db.session.query(Birthday.id, Birthday.name, Birthday.date, Birthday.notes).filter(
+            Birthday.id.in_(update_ids)
+        ).all() if update_ids else []
         
-        for birthday in birthdays:
-            # Get this year's birthday
-            this_year_bday = birthday.date.replace(year=today.year)
-            
-            # If birthday already happened this year, look at next year
-            if this_year_bday < today:
-                this_year_bday = this_year_bday.replace(year=today.year + 1)
-            
-            # Check if birthday is within the next 2 days
-            if today <= this_year_bday <= end_date:
-                days_until = (this_year_bday - today).days
-                age = this_year_bday.year - birthday.date.year
-                
-                upcoming.append({
-                    'id': birthday.id,
-                    'name': birthday.name,
-                    'date': birthday.date,
-                    'this_year_date': this_year_bday,
-                    'days_until': days_until,
-                    'age': age,
-                    'notes': birthday.notes
-                })
+        def patch(index):
+            for birthday_id in delete_ids + update_ids:
+                index.remove(birthday_id)
+            for row in updated_rows:
+                index.add(row)
         
-        # If this user has upcoming birthdays, add to dictionary
-        if upcoming:
-            # Sort by days until birthday
-            upcoming.sort(key=lambda x: x['days_until'])
-            user_birthdays[user.id] = {
-                'user': user,
-                'birthdays': upcoming
-            }
+        update_calendar_index(user_id, old_version, get_data_version(user_id), patch)
+        invalidate_fragments(None if legacy_ids else user_id)
+        invalidate_search_index(None if legacy_ids else user_id)
+    
+    for birthday_id in delete_ids:
+        results[birthday_id] = 'deleted'
+    for birthday_id in update_ids:
+        results[birthday_id] = 'updated'
+    return 200, [{'id': birthday_id, 'status': results[birthday_id]} for birthday_id in ids]
+
+@app.route('/api/birthdays/batch', methods=['POST'])
+@jwt_required()
+def batch_birthdays():
+    """
+    Delete and update many birthdays at once:
+    {"delete": [1, 2], "update": [{"id": 3, "name": "...", "date": "YYYY-MM-DD", "notes": "..."}]}
+    """
+    current_user_id = int(get_jwt_identity())
+    
+    # Cookie-authenticated writes need the CSRF token, sent in the X-CSRFToken header
+    try:
+        if app.config['WTF_CSRF_ENABLED']:
+            csrf.protect()
+    except CSRFError as e:
+        return jsonify({'error': e.description}), 400
+    
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    delete_ids = payload.get('delete', [])
+    update_items = payload.get('update', [])
+    if not isinstance(delete_ids, list) or not isinstance(update_items, list):
+        return jsonify({'error': 'delete and update must be lists'}), 400
+    if not all(is_birthday_id(birthday_id) for birthday_id in delete_ids):
+        return jsonify({'error': 'delete must be a list of integer ids'}), 400
+    if len(delete_ids) + len(update_items) > app.config['BATCH_MAX_SIZE']:
+        return jsonify({'error': f"At most {app.config['BATCH_MAX_SIZE']} ids per batch"}), 400
+    
+    updates = {}
+    errors = []
+    for item in update_items:
+        try:
+            birthday_id, values = parse_birthday_update(item)
+        except ValueError as e:
+            errors.append({'id': item.get('id') if isinstance(item, dict) else None, 'status': 'invalid', 'error': str(e)})
+            continue
+        if birthday_id in updates:
+            errors.append({'id': birthday_id, 'status': 'invalid', 'error': 'updated more than once'})
+            continue
+        updates[birthday_id] = values
+    if errors:
+        return jsonify({'error': 'Invalid updates, nothing was changed', 'results': errors}), 400
     
-    return user_birthdays
+    status, results = apply_birthday_changes(current_user_id, delete_ids=delete_ids, updates=updates)
+    response = {
+        'results': results,
+        'deleted': sum(1 for result in results if result['status'] == 'deleted'),
+        'updated': sum(1 for result in results if result['status'] == 'updated')
+    }
+    if status == 403:
+        response['error'] = 'Not authorized to change some of these birthdays, nothing was changed'
+    return jsonify(response), status
+
+def month_day_keys(start_date, end_date):
+    """
+    Return the month * 100 + day keys of every date between start_date and end_date (inclusive),
+    including Feb 29 whenever the range covers Feb 28 of a non-leap year
+    """
+    keys = set()
+    day = start_date
+    while day <= end_date:
+        keys.add(day.month * 100 + day.day)
+        if day.month == 2 and day.day == 28 and not calendar.isleap(day.year):
+            keys.add(229)
+        day += timedelta(days=1)
+    return keys
+
+# The user fields the notifier needs, selected instead of full User rows
+NotificationUser = namedtuple('NotificationUser', ['id', 'username', 'email', 'cadence'], defaults=['daily'])
+
+# A date range of birthdays to notify the users matching condition about, None matching every user
+NotificationPeriod = namedtuple('NotificationPeriod', ['cadence', 'condition', 'start_date', 'end_date'])
+
+def notification_periods(start_date, run_date, window_days):
+    """
+    Return the NotificationPeriod of each cadence due on a date between start_date and run_date:
+    daily reminders cover the window_days after each date, a weekly digest the 7 days from its
+    weekday and a monthly preview the month starting on its 1st. When several digest days are
+    caught up at once their periods are coalesced, so each user still gets a single email.
+    """
+    cadence = func.coalesce(NotificationPreference.cadence, 'daily')
+    periods = [NotificationPeriod('daily', cadence == 'daily', start_date, run_date + timedelta(days=window_days))]
+    
+    days = [start_date + timedelta(days=n) for n in range((run_date - start_date).days + 1)]
+    for weekday in range(7):
+        digest_days = [day for day in days if day.weekday() == weekday]
+        if digest_days:
+            periods.append(NotificationPeriod(
+                'weekly',
+                and_(cadence == 'weekly', NotificationPreference.digest_weekday == weekday),
+                digest_days[0],
+                digest_days[-1] + timedelta(days=6)
+            ))
+    
+    firsts = [day for day in days if day.day == 1]
+    if firsts:
+        last = firsts[-1]
+        periods.append(NotificationPeriod(
+            'monthly', cadence == 'monthly', firsts[0], last.replace(day=calendar.monthrange(last.year, last.month)[1])
+        ))
+    return periods
+
+def iter_birthdays_between(start_date, end_date, reference_date=None, shard=0, shard_count=1, batch_size=1000):
+    """
+    Stream the birthdays of all users falling between start_date and end_date (inclusive)
+    from a single query. Only users with user_id % shard_count == shard are included.
+    days_until is relative to reference_date (defaults to start_date) and is negative
+    for birthdays that have already passed.
+    Yields (user, [UpcomingBirthday]) per user in user_id order, holding one user in memory at a time
+    """
+    return iter_birthdays_in_periods(
+        [NotificationPeriod('daily', None, start_date, end_date)],
+        reference_date or start_date, shard, shard_count, batch_size
+    )
+
+def iter_birthdays_in_periods(periods, reference_date, shard=0, shard_count=1, batch_size=1000):
+    """
+    Like iter_birthdays_between, with each user's date range given by the NotificationPeriod
+    whose condition they match, all from a single query. The conditions must be exclusive.
+    """
+    month_day = extract('month', Birthday.date) * 100 + extract('day', Birthday.date)
+    conditions = [period.condition for period in periods if period.condition is not None]
+    if conditions:
+        # The period a row was selected for, each user matches a single condition
+        period_index = case(*[(period.condition, i) for i, period in enumerate(periods)])
+    else:
+        period_index = literal(0)
+    
+    query = db.session.query(
+        User.id, User.username, User.email,
+        Birthday.id, Birthday.name, Birthday.date, Birthday.notes,
+        period_index
+    ).join(User, Birthday.user_id == User.id)
+    if conditions:
+        query = query.outerjoin(NotificationPreference, NotificationPreference.user_id == User.id)
+    query = query.filter(or_(*[
+        month_day.in_(month_day_keys(period.start_date, period.end_date))
+        if period.condition is None else
+        and_(period.condition, month_day.in_(month_day_keys(period.start_date, period.end_date)))
+        for period in periods
+    ]))
+    if shard_count > 1:
+        query = query.filter(Birthday.user_id % shard_count == shard)
+    query = query.order_by(Birthday.user_id).execution_options(stream_results=True, yield_per=batch_size)
+
+    user = None
+    birthdays = []
+    rows = iter(query)
+
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+
+        # The ranges can span a year boundary, occurrences_between tries both years for all the rows of a period at once
+        occurrences = [None] * len(batch)
+        for i, period in enumerate(periods):
+            positions = [position for position, row in enumerate(batch) if row[7] == i]
+            if positions:
+                found = occurrences_between([batch[position][5] for position in positions], period.start_date, period.end_date)
+                for position, occurrence in zip(positions, found):
+                    occurrences[position] = occurrence
+
+        for (user_id, username, email, birthday_id, name, birth_date, notes, period), this_year_bday in zip(batch, occurrences):
+            if this_year_bday is None:
+                continue
+
+            if user is None or user.id != user_id:
+                if birthdays:
+                    # Sort by days until birthday
+                    birthdays.sort(key=lambda x: x.days_until)
+                    yield user, birthdays
+                user = NotificationUser(user_id, username, email, periods[period].cadence)
+                birthdays = []
+
+            birthdays.append(upcoming_birthday(birthday_id, name, birth_date, notes, this_year_bday, reference_date))
+
+    if birthdays:
+        birthdays.sort(key=lambda x: x.days_until)
+        yield user, birthdays
+
+def get_birthdays_between(start_date, end_date, reference_date=None, shard=0, shard_count=1):
+    """
+    Fetch the birthdays of all users falling between start_date and end_date (inclusive).
+    Returns a dictionary with user_id as key and the user and their birthdays as value
+    """
+    return {
+        user.id: {'user': user, 'birthdays': birthdays}
+        for user, birthdays in iter_birthdays_between(start_date, end_date, reference_date, shard, shard_count)
+    }
+
+# Add this function to fetch upcoming birthdays in the next 2 days
+def get_upcoming_birthdays_next_two_days():
+    """
+    Fetch all upcoming birthdays in the next 2 days for all users
+    Returns a dictionary with user_id as key and a list of their upcoming birthdays as value
+    """
+    today = datetime.now().date()
+    return get_birthdays_between(today, today + timedelta(days=2))
 
 # Add a route to manually test the upcoming birthdays feature
 @app.route('/api/upcoming_birthdays_two_days')
 @jwt_required()
+@read_only
 def upcoming_birthdays_two_days():
     # Get current user
     current_user_id = int(get_jwt_identity())
@@ -413,42 +1219,255 @@ def upcoming_birthdays_two_days():
         upcoming_birthdays = all_upcoming[current_user_id]['birthdays']
     
     return jsonify({
-        'upcoming_birthdays': upcoming_birthdays,
+        'upcoming_birthdays': [birthday.to_json() for birthday in upcoming_birthdays],
         'total': len(upcoming_birthdays),
         'days_checked': 2
     })
 
+app.config['SEARCH_MAX_RESULTS'] = int(os.environ.get('SEARCH_MAX_RESULTS', 100))
+
+@app.route('/api/birthdays/search')
+@jwt_required()
+@read_only
+def search_birthdays():
+    """
+    Search the current user's birthdays: ?q=text&limit=20. Matches names and notes by substring,
+    ignoring case and accents, best matches first. While the user's search index is being built
+    only name prefixes are matched, from the database; source tells which answered.
+    """
+    current_user_id = int(get_jwt_identity())
+    query = request.args.get('q', '').strip()
+    limit = request.args.get('limit', default=20, type=int)
+    
+    if not query or len(query) > 100:
+        return jsonify({'error': 'q must be 1 to 100 characters'}), 400
+    if not 1 <= limit <= app.config['SEARCH_MAX_RESULTS']:
+        return jsonify({'error': f"limit must be between 1 and {app.config['SEARCH_MAX_RESULTS']}"}), 400
+    
+    version = get_data_version(current_user_id)
+    index = get_search_index(current_user_id, version)
+    if index is not None:
+        total, matches = index.search(query, limit)
+        source = 'index'
+    else:
+        total, matches = search_birthdays_sql(current_user_id, query, limit, version[1])
+        source = 'database'
+    
+    return jsonify({
+        'query': query,
+        'results': [{'id': row[0], 'name': row[1], 'date': row[2], 'notes': row[3]} for row in matches],
+        'total': total,
+        'source': source
+    })
+
+# Most changes returned by /api/birthdays/changes, beyond that the client resyncs
+app.config['SYNC_MAX_CHANGES'] = int(os.environ.get('SYNC_MAX_CHANGES', 1000))
+
+def format_sync_cursor(version):
+    return f"{version[0]}.{version[1]}"
+
+def parse_sync_cursor(cursor):
+    """
+    Return the (user version, legacy version) of a sync cursor, raising ValueError if it's malformed
+    """
+    user_version, _, legacy_version = cursor.partition('.')
+    if not user_version.isdigit() or not legacy_version.isdigit():
+        raise ValueError(f"invalid cursor: {cursor}")
+    return int(user_version), int(legacy_version)
+
+def birthday_changes_since(user_id, since, version):
+    """
+    Return the changes of a user's birthdays between the data versions since and version, one per
+    birthday, oldest first; None if the change feed doesn't have them all and the client must resync
+    """
+    if since == version:
+        return []
+    # Birthdays without a user_id are in every user's list, but their changes aren't logged per user
+    if since[1] != version[1] or since[0] > version[0]:
+        return None
+    entries = db.session.query(BirthdayChange.version, BirthdayChange.op, BirthdayChange.birthday_id).filter(
+        BirthdayChange.user_id == user_id,
+        BirthdayChange.version > since[0],
+        BirthdayChange.version <= version[0]
+    ).order_by(BirthdayChange.version, BirthdayChange.id).limit(app.config['SYNC_MAX_CHANGES'] + 1).all()
+    # Every version has entries unless they were compacted away, or written outside of the feed (migrations)
+    if len(entries) > app.config['SYNC_MAX_CHANGES'] or len({entry.version for entry in entries}) != version[0] - since[0]:
+        return None
+    
+    latest = {}
+    for entry_version, op, birthday_id in entries:
+        previous = latest.pop(birthday_id, None)
+        # Still new to the client
+        if previous is not None and previous[1] == 'add' and op == 'update':
+            op = 'add'
+        latest[birthday_id] = (entry_version, op)
+    
+    ids = [birthday_id for birthday_id, (_, op) in latest.items() if op != 'delete']
+    rows = {row.id: row for row in db.session.query(Birthday.id, Birthday.name, Birthday.date, Birthday.notes).filter(
+        Birthday.id.in_(ids), Birthday.user_id == user_id
+    )} if ids else {}
+    
+    changes = []
+    for birthday_id, (entry_version, op) in latest.items():
+        if op == 'delete':
+            changes.append({'op': op, 'id': birthday_id, 'version': entry_version})
+        elif birthday_id in rows:
+            row = rows[birthday_id]
+            changes.append({'op': op, 'id': birthday_id, 'version': entry_version,
+                            'birthday': {'id': row.id, 'name': row.name, 'date': row.date, 'notes': row.notes}})
+        # Otherwise it was deleted since version was read, the next sync has the delete
+    return changes
+
+@app.route('/api/birthdays/changes')
+@jwt_required()
+@read_only
+def birthday_changes():
+    """
+    Incremental sync: ?since=<cursor> returns the birthdays added, updated and deleted since the cursor,
+    and the cursor to send next time. Without since, or when the changes since it aren't all in the
+    change feed anymore, returns every birthday with resync true: the client replaces its copy.
+    Changes may be sent more than once, clients apply them as upserts and deletes by id.
+    """
+    current_user_id = int(get_jwt_identity())
+    since = request.args.get('since')
+    try:
+        since_version = parse_sync_cursor(since) if since else None
+    except ValueError:
+        return jsonify({'error': 'Invalid since cursor'}), 400
+    
+    # Read first: changes committed after it may be returned now and again with the next cursor
+    version = get_data_version(current_user_id)
+    changes = birthday_changes_since(current_user_id, since_version, version) if since_version is not None else None
+    if changes is not None:
+        return jsonify({'cursor': format_sync_cursor(version), 'resync': False, 'changes': changes})
+    
+    rows = query_user_birthday_rows(current_user_id, version)
+    return jsonify({
+        'cursor': format_sync_cursor(version),
+        'resync': True,
+        'birthdays': [{'id': row.id, 'name': row.name, 'date': row.date, 'notes': row.notes} for row in rows]
+    })
+
+@app.route('/api/calendar')
+@jwt_required()
+@read_only
+def birthday_calendar():
+    # Get current user
+    current_user_id = int(get_jwt_identity())
+    
+    # Get query parameters: a whole year, or one month of it
+    today = datetime.now().date()
+    year = request.args.get('year', default=today.year, type=int)
+    month = request.args.get('month', type=int)
+    
+    if not 1 <= year <= 9999 or (month is not None and not 1 <= month <= 12):
+        return jsonify({'error': 'Invalid year or month'}), 400
+    
+    index = get_calendar_index(current_user_id)
+    occurrences = index.month(year, month) if month else index.year(year)
+    
+    days = []
+    for occurrence, entry in occurrences:
+        if not days or days[-1]['date'] != occurrence:
+            days.append({'date': occurrence, 'birthdays': []})
+        days[-1]['birthdays'].append({
+            'id': entry.id,
+            'name': entry.name,
+            'date': entry.date,
+            'age': occurrence.year - entry.date.year,
+            'notes': entry.notes
+        })
+    
+    return jsonify({
+        'year': year,
+        'month': month,
+        'days': days,
+        'total': sum(len(day['birthdays']) for day in days)
+    })
+
 # Add a route to view notification history
 @app.route('/notification_history')
 @jwt_required()
+@read_only
 def notification_history():
     # Get current user
     current_user_id = int(get_jwt_identity())
     
-    # Get all notifications for this user
-    notifications = BirthdayNotification.query.filter_by(user_id=current_user_id).order_by(
-        BirthdayNotification.notification_date.desc()
-    ).all()
-    
-    # Format for display
-    notification_data = []
-    
-    for notification in notifications:
-        birthday = Birthday.query.get(notification.birthday_id)
-        if birthday:
-            notification_data.append({
-                'id': notification.id,
-                'birthday_name': birthday.name,
-                'notification_date': notification.notification_date.strftime('%Y-%m-%d'),
-                'year_notified': notification.year_notified,
-                'birthday_date': birthday.date.strftime('%Y-%m-%d'),
-            })
+    # Get all notifications for this user, with the birthday they were about
+    query = db.session.query(
+        BirthdayNotification.id,
+        Birthday.name,
+        BirthdayNotification.notification_date,
+        BirthdayNotification.year_notified,
+        Birthday.date
+    ).join(Birthday, Birthday.id == BirthdayNotification.birthday_id).filter(
+        BirthdayNotification.user_id == current_user_id
+    ).order_by(BirthdayNotification.notification_date.desc())
+    
+    def notification_data(rows):
+        for notification_id, birthday_name, notification_date, year_notified, birthday_date in rows:
+            yield {
+                'id': notification_id,
+                'birthday_name': birthday_name,
+                'notification_date': notification_date,
+                'year_notified': year_notified,
+                'birthday_date': birthday_date,
+            }
+    
+    total = None
+    if app.config['JSON_STREAM_MIN_ITEMS']:
+        total = query.order_by(None).count()
+    if total is not None and should_stream(total):
+        rows = query.execution_options(stream_results=True, yield_per=app.config['JSON_STREAM_CHUNK_SIZE'])
+        return stream_json(
+            app, {'total': total}, 'notification_history', notification_data(rows),
+            app.config['JSON_STREAM_CHUNK_SIZE']
+        )
     
+    notifications = list(notification_data(query))
     return jsonify({
-        'notification_history': notification_data,
-        'total': len(notification_data)
+        'notification_history': notifications,
+        'total': len(notifications)
     })
 
+@app.route('/api/notification_preferences', methods=['GET', 'PUT'])
+@jwt_required()
+def notification_preferences():
+    """
+    Get or set the reminder cadence: {"cadence": "daily" | "weekly" | "monthly", "digest_weekday": 0-6}
+    """
+    current_user_id = int(get_jwt_identity())
+    preference = db.session.get(NotificationPreference, current_user_id)
+    if preference is None:
+        preference = NotificationPreference(user_id=current_user_id, cadence='daily', digest_weekday=0)
+    
+    if request.method == 'GET':
+        return jsonify(preference.to_json())
+    
+    # Cookie-authenticated writes need the CSRF token, sent in the X-CSRFToken header
+    try:
+        if app.config['WTF_CSRF_ENABLED']:
+            csrf.protect()
+    except CSRFError as e:
+        return jsonify({'error': e.description}), 400
+    
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    cadence = payload.get('cadence', preference.cadence)
+    digest_weekday = payload.get('digest_weekday', preference.digest_weekday)
+    if cadence not in NOTIFICATION_CADENCES:
+        return jsonify({'error': f"cadence must be one of {', '.join(NOTIFICATION_CADENCES)}"}), 400
+    if not isinstance(digest_weekday, int) or isinstance(digest_weekday, bool) or not 0 <= digest_weekday <= 6:
+        return jsonify({'error': 'digest_weekday must be an integer from 0 (Monday) to 6 (Sunday)'}), 400
+    
+    preference.cadence = cadence
+    preference.digest_weekday = digest_weekday
+    db.session.add(preference)
+    db.session.commit()
+    stick_to_primary()
+    return jsonify(preference.to_json())
+
 if __name__ == '__main__':
     # In production, don't run with debug=True
     if os.environ.get('ENV') == 'production':
@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+"""
+Benchmark Script
+
+Measures latency and allocations of the hot read paths for a large account.
+Creates a temporary benchmark user with many birthdays in the configured database,
+runs the requests through the Flask test client, and removes the user afterwards.
+With --hermetic the configured database is left alone: everything runs on a
+throwaway SQLite database (see sqlite_profile.py), no server needed.
+For development and testing purposes only.
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import secrets
+import argparse
+import tempfile
+import tracemalloc
+from datetime import date, timedelta
+from dotenv import load_dotenv
+
+# Add the current directory to the path so that we can import app modules
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Load environment variables
+load_dotenv()
+
+# The database URI is read when the app is imported, so --hermetic is handled first
+HERMETIC_DIR = tempfile.mkdtemp(prefix='birthday_buddy_bench_') if '--hermetic' in sys.argv else None
+if HERMETIC_DIR:
+    os.environ['DATABASE_SERVICE_URI'] = f"sqlite:///{os.path.join(HERMETIC_DIR, 'benchmark.db')}"
+    os.environ['DATABASE_REPLICA_URIS'] = ''
+    os.environ.setdefault('JWT_SECRET_KEY', secrets.token_hex(32))
+    os.environ.setdefault('SECRET_KEY', secrets.token_hex(32))
+
+# Import app after setting up environment
+from app import app, db, User, Birthday, UserDataVersion, fragment_cache, invalidate_fragments, get_data_version, get_search_index
+import compression
+import json_provider
+import read_models
+import search_index
+import vectorized_birthdays
+from flask_jwt_extended import create_access_token
+
+BENCHMARK_USERNAME = 'benchmark_user'
+
+def create_benchmark_user(birthday_count):
+    """
+    Create the benchmark user with birthday_count random birthdays
+    """
+    delete_benchmark_user()
+
+    user = User(username=BENCHMARK_USERNAME, email='benchmark@example.com', password_hash='!')
+    db.session.add(user)
+    db.session.flush()
+
+    rng = random.Random(42)
+    first_day = date(1940, 1, 1)
+    rows = [
+        {
+            'name': f'Person {i}',
+            'date': first_day + timedelta(days=rng.randrange(30000)),
+            'notes': f'Notes for person {i}' if i % 3 == 0 else None,
+            'user_id': user.id
+        }
+        for i in range(birthday_count)
+    ]
+    db.session.execute(Birthday.__table__.insert(), rows)
+    db.session.commit()
+    return user.id
+
+def delete_benchmark_user():
+    """
+    Remove the benchmark user and its birthdays
+    """
+    user = User.query.filter_by(username=BENCHMARK_USERNAME).first()
+    if user:
+        Birthday.query.filter_by(user_id=user.id).delete()
+        UserDataVersion.query.filter_by(user_id=user.id).delete()
+        db.session.delete(user)
+        db.session.commit()
+
+def measure(func, repeat):
+    """
+    Return (median seconds, peak bytes allocated, blocks still allocated afterwards) of func
+    """
+    func()  # warm up
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    allocations = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    tracemalloc.stop()
+
+    timings.sort()
+    return timings[len(timings) // 2], peak, allocations
+
+def report(name, seconds, peak, allocations):
+    print(f"{name:<40} {seconds * 1000:>9.1f} ms {peak / 1024 / 1024:>9.1f} MiB peak {allocations:>10} live blocks")
+
+def bench_read_paths(user_id, repeat):
+    """
+    Latency and allocations per request of the hot read paths
+    """
+    client = app.test_client()
+    with app.app_context():
+        client.set_cookie('access_token_cookie', create_access_token(identity=str(user_id)))
+
+    for url in ['/', '/api/upcoming_birthdays', '/api/upcoming_birthdays?days=365', '/api/calendar',
+                '/api/calendar?year=9999']:
+        def request():
+            response = client.get(url)
+            assert response.status_code == 200, f"{url} returned {response.status_code}"
+        report(f"GET {url}", *measure(request, repeat))
+
+def bench_date_engine(user_id, repeat, rows=1000000):
+    """
+    Scalar loop vs NumPy engine for next occurrence, days until and age at 1M rows
+    """
+    if not vectorized_birthdays.available():
+        print("NumPy is not installed, skipping")
+        return
+
+    rng = random.Random(42)
+    first_day = date(1940, 1, 1)
+    birthday_rows = [(i, None, first_day + timedelta(days=rng.randrange(30000)), None) for i in range(rows)]
+    today = date.today()
+    end_date = today + timedelta(days=30)
+
+    threshold = read_models.VECTORIZE_MIN_ROWS
+    try:
+        read_models.VECTORIZE_MIN_ROWS = rows + 1
+        report(f"find_upcoming scalar ({rows} rows)", *measure(lambda: read_models.find_upcoming(birthday_rows, today, end_date), repeat))
+        read_models.VECTORIZE_MIN_ROWS = 0
+        report(f"find_upcoming vectorized ({rows} rows)", *measure(lambda: read_models.find_upcoming(birthday_rows, today, end_date), repeat))
+    finally:
+        read_models.VECTORIZE_MIN_ROWS = threshold
+
+    ordinals = vectorized_birthdays.from_dates([row[2] for row in birthday_rows])
+    report(f"next_birthdays on ordinals ({rows} rows)", *measure(lambda: vectorized_birthdays.next_birthdays(ordinals, today), repeat))
+
+def bench_compression(user_id, repeat):
+    """
+    Bytes on the wire per response with and without compression
+    """
+    client = app.test_client()
+    with app.app_context():
+        client.set_cookie('access_token_cookie', create_access_token(identity=str(user_id)))
+
+    encodings = ['identity', 'gzip'] + (['br'] if compression.brotli is not None else [])
+    cache = app.extensions['compression_cache']
+
+    for url in ['/', '/api/upcoming_birthdays?days=365', '/api/calendar']:
+        sizes = {}
+        for encoding in encodings:
+            def request():
+                response = client.get(url, headers={'Accept-Encoding': encoding})
+                assert response.status_code == 200, f"{url} returned {response.status_code}"
+                sizes[encoding] = len(response.data)
+            report(f"GET {url} [{encoding}]", *measure(request, repeat))
+        savings = ', '.join(
+            f"{encoding} {sizes[encoding]} bytes ({100 - 100 * sizes[encoding] / sizes['identity']:.0f}% saved)"
+            for encoding in encodings[1:]
+        )
+        print(f"  {url}: identity {sizes['identity']} bytes, {savings}")
+
+    stats = cache.stats()
+    print(f"  compressed body cache: {stats['hits']} hits, {stats['misses']} misses, {stats['bytes']} bytes")
+
+def bench_fragments(user_id, repeat):
+    """
+    Index page with cold and warm fragment caches
+    """
+    client = app.test_client()
+    with app.app_context():
+        client.set_cookie('access_token_cookie', create_access_token(identity=str(user_id)))
+
+    def cold():
+        invalidate_fragments(user_id)
+        assert client.get('/').status_code == 200
+
+    def warm():
+        assert client.get('/').status_code == 200
+
+    report("GET / (cold fragments)", *measure(cold, repeat))
+    report("GET / (warm fragments)", *measure(warm, repeat))
+    stats = fragment_cache.stats()
+    print(f"  fragment cache: {stats['hit_ratio']:.1%} hit ratio, {stats['entries']} entries, {stats['bytes']} bytes")
+
+def bench_json(user_id, repeat, items=10000):
+    """
+    Serialization time of a 10k-element upcoming birthdays payload per JSON backend
+    """
+    rng = random.Random(42)
+    today = date.today()
+    upcoming = []
+    for i in range(items):
+        birth_date = date(1940, 1, 1) + timedelta(days=rng.randrange(30000))
+        occurrence = read_models.birthday_occurrence(birth_date, today.year)
+        upcoming.append(read_models.upcoming_birthday(i, f'Person {i}', birth_date, None, occurrence, today))
+
+    def preformatted():
+        # What the views did before: strftime every date, then the stdlib encoder
+        return [dict(b.to_json(), date=b.date.strftime('%Y-%m-%d'), this_year_date=b.this_year_date.strftime('%Y-%m-%d')) for b in upcoming]
+
+    provider = app.json
+    backend = json_provider.orjson
+    try:
+        json_provider.orjson = None
+        report(f"strftime + stdlib json ({items} items)", *measure(lambda: provider.dumps_bytes({'upcoming_birthdays': preformatted()}), repeat))
+        report(f"stdlib json ({items} items)", *measure(lambda: provider.dumps_bytes({'upcoming_birthdays': [b.to_json() for b in upcoming]}), repeat))
+        if backend is None:
+            print("orjson is not installed, skipping")
+            return
+        json_provider.orjson = backend
+        report(f"orjson ({items} items)", *measure(lambda: provider.dumps_bytes({'upcoming_birthdays': [b.to_json() for b in upcoming]}), repeat))
+        report(f"orjson streamed ({items} items)", *measure(
+            lambda: b''.join(provider.stream({}, 'upcoming_birthdays', (b.to_json() for b in upcoming))), repeat
+        ))
+    finally:
+        json_provider.orjson = backend
+
+FIRST_NAMES = ['Anna', 'Zoë', 'José', 'Chloé', 'Mohammed', 'Olivia', 'Liam', 'Søren', 'Ingrid', 'Noah', 'Amélie', 'Łukasz', 'Mia', 'Ethan', 'Renée', 'Björn']
+LAST_NAMES = ['Smith', 'García', 'Müller', 'Nguyễn', 'Kowalski', 'Rossi', 'Johansson', 'Dubois', 'O\'Brien', 'Novák', 'Silva', 'Andersen', 'Öztürk', 'Martin']
+
+def latency_percentiles(func, inputs, repeat):
+    """
+    Return the (p50, p99) seconds of func over every input, repeat times
+    """
+    timings = []
+    for _ in range(repeat):
+        for value in inputs:
+            started = time.perf_counter()
+            func(value)
+            timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings[len(timings) // 2], timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+def bench_search(user_id, repeat, contacts=50000):
+    """
+    Birthday search: index build time, and p50/p99 query latency on a 50k-contact index and through the API
+    """
+    rng = random.Random(42)
+    rows = [
+        (i, f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}{'' if i % 4 else f'-{rng.choice(LAST_NAMES)}'}",
+         date(1940, 1, 1) + timedelta(days=rng.randrange(30000)), f'met at conference {i % 97}' if i % 5 == 0 else None)
+        for i in range(contacts)
+    ]
+    queries = ['a', 'zo', 'ren', 'zoe', 'muller', 'nguyen', 'garcia-', 'anna smith', 'conference 42', 'xyz', 'Søren Öz']
+
+    started = time.perf_counter()
+    index = search_index.SearchIndex(rows)
+    print(f"  SearchIndex build over {contacts} contacts: {(time.perf_counter() - started) * 1000:.0f} ms")
+    p50, p99 = latency_percentiles(lambda query: index.search(query, 20), queries, repeat * 10)
+    print(f"  SearchIndex.search: p50 {p50 * 1000:.2f} ms, p99 {p99 * 1000:.2f} ms over {len(queries)} queries")
+
+    client = app.test_client()
+    with app.app_context():
+        client.set_cookie('access_token_cookie', create_access_token(identity=str(user_id)))
+        version = get_data_version(user_id)
+
+    def search(query):
+        response = client.get('/api/birthdays/search', query_string={'q': query})
+        assert response.status_code == 200, f"search returned {response.status_code}"
+        return response.get_json()['source']
+
+    started = time.perf_counter()
+    print(f"  GET /api/birthdays/search cold: answered from the {search('Person 12')} in {(time.perf_counter() - started) * 1000:.1f} ms")
+    started = time.perf_counter()
+    with app.app_context():
+        while get_search_index(user_id, version) is None:
+            time.sleep(0.01)
+    print(f"  search index of the benchmark user built in the background in {(time.perf_counter() - started) * 1000:.0f} ms")
+    api_queries = ['Person 12', 'pers', '99', 'notes for person 3', 'nobody']
+    p50, p99 = latency_percentiles(search, api_queries, repeat * 10)
+    print(f"  GET /api/birthdays/search warm: p50 {p50 * 1000:.2f} ms, p99 {p99 * 1000:.2f} ms")
+
+BENCHMARKS = {
+    'read_paths': bench_read_paths,
+    'date_engine': bench_date_engine,
+    'compression': bench_compression,
+    'fragments': bench_fragments,
+    'json': bench_json,
+    'search': bench_search,
+}
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='Birthday Buddy benchmarks')
+    parser.add_argument('--birthdays', type=int, default=10000,
+                        help='Number of birthdays of the benchmark user (default: 10000)')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='Timed repetitions per measurement (default: 10)')
+    parser.add_argument('--only', choices=sorted(BENCHMARKS), action='append',
+                        help='Only run the given benchmark (can be repeated)')
+    parser.add_argument('--hermetic', action='store_true',
+                        help='Run on a throwaway SQLite database instead of the configured one')
+    return parser.parse_args()
+
+def main():
+    """
+    Main function
+    """
+    args = parse_arguments()
+
+    with app.app_context():
+        if HERMETIC_DIR:
+            print(f"Using a throwaway database: {db.engine.url}")
+            db.create_all()
+        print(f"Creating benchmark user with {args.birthdays} birthdays...")
+        user_id = create_benchmark_user(args.birthdays)
+
+    try:
+        for name in args.only or BENCHMARKS:
+            print(f"\n{name}")
+            BENCHMARKS[name](user_id, args.repeat)
+    finally:
+        with app.app_context():
+            delete_benchmark_user()
+        if HERMETIC_DIR:
+            with app.app_context():
+                db.engine.dispose()
+            shutil.rmtree(HERMETIC_DIR, ignore_errors=True)
+
+    print("\nBenchmark completed.")
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,27 @@ Birthday Notification Script
 
 This script checks for upcoming birthdays in the next 2 days and prepares to send email notifications.
 Can be scheduled via cron or other task scheduler to run daily.
+
+Each run records the last processed date (the high-water mark) per shard and window in the
+notifier_run_state table. A run processes every date from the mark up to today, so a missed
+cron day is caught up on the next run instead of silently dropping its reminders.
+
+Users are streamed through fetch -> dedupe -> render -> send -> record stages with bounded
+queues between them, so the first email goes out while later users are still being fetched.
+
+Users choose a cadence (see NotificationPreference): daily reminders, a weekly digest on a
+chosen weekday or a monthly preview on the 1st. The candidate query selects each user's
+birthdays from the period of their cadence, and each user gets one email per run covering
+it. Every birthday in a digest is recorded in birthday_notification like a daily reminder,
+so it isn't sent again, even if the user changes their cadence.
 """
 
 import os
 import sys
 import argparse
+import json
+import time
+from functools import partial
 from datetime import datetime, timedelta
 import logging
 from dotenv import load_dotenv
@@ -31,8 +47,12 @@ logger = logging.getLogger('birthday_notifier')
 load_dotenv()
 
 # Import app after setting up environment
-from app import app, User, Birthday, db, get_upcoming_birthdays_next_two_days, BirthdayNotification
-from email_notifications import send_birthday_notifications
+from app import app, User, Birthday, db, iter_birthdays_in_periods, notification_periods, BirthdayNotification, NotifierRunState
+from email_notifications import render_birthday_notification, send_birthday_notification, get_email_client
+from pipeline import Stage, run_pipeline
+from db_routing import replica_reads
+from profiling import ProfileStore, StageProfiler, summarize
+from notification_runs import RunTelemetry
 
 def format_birthdays_for_notification(upcoming_birthdays):
     """
@@ -41,65 +61,92 @@ def format_birthdays_for_notification(upcoming_birthdays):
     notifications = []
     
     for user_id, data in upcoming_birthdays.items():
-        user = data['user']
-        birthdays = data['birthdays']
-        
-        # Get already notified birthdays for this user this year
-        current_year = datetime.now().year
-        already_notified = {}
-        
-        with app.app_context():
-            notifications_sent = BirthdayNotification.query.filter_by(
-                user_id=user_id, 
-                year_notified=current_year
-            ).all()
-            
-            # Create a lookup dictionary for quick checks
-            for notification in notifications_sent:
-                already_notified[notification.birthday_id] = True
-        
-        # Filter out birthdays that have already been notified
-        birthdays_to_notify = []
-        
-        for birthday in birthdays:
-            # Skip if already notified this year
-            if birthday['id'] in already_notified:
-                logger.info(f"Skipping notification for birthday ID {birthday['id']} - already notified this year")
-                continue
-                
-            birthdays_to_notify.append(birthday)
+        notification = dedupe_notification(build_user_notification(user_id, data['user'], data['birthdays']))
+        if notification is not None:
+            notifications.append(notification)
+    
+    return notifications
+
+def dedupe_notification(notification):
+    """
+    Drop the birthdays of a user notification that were already notified for the same year
+    Returns None if nothing is left to notify
+    """
+    user_id = notification['user_id']
+    birthdays = notification['birthdays']
+    
+    # Get already notified birthdays for this user for the years covered by the run
+    notified_years = {birthday['year'] for birthday in birthdays}
+    already_notified = {}
+    
+    with app.app_context():
+        notifications_sent = BirthdayNotification.query.filter(
+            BirthdayNotification.user_id == user_id,
+            BirthdayNotification.year_notified.in_(notified_years)
+        ).all()
         
-        # Skip if no birthdays to notify after filtering
-        if not birthdays_to_notify:
-            logger.info(f"No new birthday notifications for user {user.username}")
+        # Create a lookup dictionary for quick checks
+        for notification_sent in notifications_sent:
+            already_notified[(notification_sent.birthday_id, notification_sent.year_notified)] = True
+    
+    # Filter out birthdays that have already been notified
+    birthdays_to_notify = []
+    
+    for birthday in birthdays:
+        # Skip if already notified this year
+        if (birthday['id'], birthday['year']) in already_notified:
+            logger.info(f"Skipping notification for birthday ID {birthday['id']} - already notified this year")
             continue
-        
-        user_notification = {
-            'user_id': user_id,
-            'username': user.username,
-            'email': user.email,
-            'birthdays': []
-        }
-        
-        for birthday in birthdays_to_notify:
-            user_notification['birthdays'].append({
-                'id': birthday['id'],
-                'name': birthday['name'],
-                'date': birthday['this_year_date'].strftime('%Y-%m-%d'),
-                'days_until': birthday['days_until'],
-                'age': birthday['age'],
-                'notes': birthday['notes']
-            })
-        
-        notifications.append(user_notification)
+            
+        birthdays_to_notify.append(birthday)
     
-    return notifications
+    # Skip if no birthdays to notify after filtering
+    if not birthdays_to_notify:
+        logger.info(f"No new birthday notifications for user {notification['username']}")
+        return None
+    
+    return dict(notification, birthdays=birthdays_to_notify)
 
-def record_notifications(notifications):
+def build_user_notification(user_id, user, birthdays):
     """
-    Record which birthday notifications were sent
+    Build the notification payload for one user
+    """
+    user_notification = {
+        'user_id': user_id,
+        'username': user.username,
+        'email': user.email,
+        'cadence': user.cadence,
+        'birthdays': []
+    }
+    
+    for birthday in birthdays:
+        user_notification['birthdays'].append({
+            'id': birthday.id,
+            'name': birthday.name,
+            'date': birthday.this_year_date.strftime('%Y-%m-%d'),
+            'year': birthday.this_year_date.year,
+            'days_until': birthday.days_until,
+            'age': birthday.age,
+            'notes': birthday.notes
+        })
+    
+    return user_notification
+
+def get_run_state(shard, shard_count, window_days):
+    """
+    Return the run state row for a shard and window, or None if it has never run
+    """
+    return NotifierRunState.query.filter_by(
+        shard=shard,
+        shard_count=shard_count,
+        window_days=window_days
+    ).first()
+
+def record_notifications(notifications, run_state=None, processed_date=None):
+    """
+    Record which birthday notifications were sent and advance the run high-water mark
+    in the same transaction
     """
-    current_year = datetime.now().year
     today = datetime.now().date()
     
     with app.app_context():
@@ -114,16 +161,47 @@ def record_notifications(notifications):
                     birthday_id=birthday_id,
                     user_id=user_id,
                     notification_date=today,
-                    year_notified=current_year
+                    year_notified=birthday['year']
                 )
                 
                 db.session.add(notification_record)
+        
+        # Never move the mark backwards, a replay of an old date leaves it unchanged
+        if run_state is not None and processed_date is not None:
+            run_state = db.session.merge(run_state)
+            if run_state.last_processed_date is None or run_state.last_processed_date < processed_date:
+                run_state.last_processed_date = processed_date
             
         # Commit all changes at once
         db.session.commit()
     
     logger.info("Notification records saved to database")
 
+def log_notification(notification):
+    """
+    Log the birthdays of one user notification
+    """
+    user_email = notification['email']
+    username = notification['username']
+    birthdays = notification['birthdays']
+    
+    logger.info(f"User: {username} ({user_email}) has {len(birthdays)} upcoming birthdays")
+    
+    for birthday in birthdays:
+        name = birthday['name']
+        date = birthday['date']
+        days_until = birthday['days_until']
+        age = birthday['age']
+        
+        if days_until < 0:
+            logger.info(f"MISSED: {name}'s birthday was {-days_until} days ago on {date}. They turned {age}.")
+        elif days_until == 0:
+            logger.info(f"TODAY: {name}'s birthday is today! They are turning {age}.")
+        else:
+            logger.info(f"SOON: {name}'s birthday is in {days_until} days on {date}. They will be {age}.")
+    
+    return notification
+
 def process_notifications(notifications):
     """
     Process notifications and log summary
@@ -131,26 +209,98 @@ def process_notifications(notifications):
     logger.info(f"Found {len(notifications)} users with upcoming birthdays")
     
     for notification in notifications:
-        user_email = notification['email']
-        username = notification['username']
-        birthdays = notification['birthdays']
-        
-        logger.info(f"User: {username} ({user_email}) has {len(birthdays)} upcoming birthdays")
-        
-        for birthday in birthdays:
-            name = birthday['name']
-            date = birthday['date']
-            days_until = birthday['days_until']
-            age = birthday['age']
-            
-            if days_until == 0:
-                logger.info(f"TODAY: {name}'s birthday is today! They are turning {age}.")
-            else:
-                logger.info(f"SOON: {name}'s birthday is in {days_until} days on {date}. They will be {age}.")
+        log_notification(notification)
     
     # Return notifications for further processing
     return notifications
 
+def read_from_replicas(items):
+    """
+    Pipeline source: let the candidate scan run on a read replica, when configured
+    """
+    with replica_reads():
+        yield from items
+
+def render_notification(notification):
+    """
+    Pipeline stage: log and render one user notification
+    """
+    log_notification(notification)
+    return render_birthday_notification(notification)
+
+def send_notification(rendered, telemetry=None):
+    """
+    Pipeline stage: send one rendered notification, tagging it with the outcome
+    """
+    started = time.perf_counter()
+    rendered['sent'] = send_birthday_notification(rendered)
+    if telemetry is not None:
+        telemetry.email_sent(time.perf_counter() - started, rendered['sent'])
+    return rendered
+
+def count_candidates(notifications, telemetry):
+    """
+    Pass user notifications through, counting the users and reminders found
+    """
+    for notification in notifications:
+        telemetry.count('users_scanned')
+        telemetry.count('reminders_found', len(notification['birthdays']))
+        yield notification
+
+def counted_dedupe(notification, telemetry):
+    """
+    Pipeline stage: dedupe_notification, counting the reminders skipped as already sent
+    """
+    deduped = dedupe_notification(notification)
+    kept = len(deduped['birthdays']) if deduped is not None else 0
+    telemetry.count('reminders_skipped', len(notification['birthdays']) - kept)
+    return deduped
+
+def save_stage_profiles(profiler, stages, directory, metadata):
+    """
+    Write the profile of each pipeline stage and log its top functions
+    """
+    store = ProfileStore(directory, max_files=100)
+    counters = {stage.name: stage for stage in stages}
+    for name, stats in profiler.stats().items():
+        stage = counters.get(name)
+        stage_metadata = dict(metadata, stage=name)
+        if stage is not None:
+            stage_metadata.update(items=stage.processed, workers=stage.workers, seconds=round(stage.seconds, 3))
+        path = store.save(stats, f"notifier_{name}", stage_metadata)
+        logger.info(f"Profile of stage {name} written to {path}:\n{summarize(stats, limit=10)}")
+
+def parse_date(value):
+    """Parse a YYYY-MM-DD command line date"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid date: {value} (expected YYYY-MM-DD)")
+
+def parse_shard(value):
+    """Parse an INDEX/COUNT command line shard"""
+    try:
+        shard, shard_count = map(int, value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid shard: {value} (expected INDEX/COUNT)")
+    if shard_count < 1 or not 0 <= shard < shard_count:
+        raise argparse.ArgumentTypeError(f"Invalid shard: {value} (expected 0 <= INDEX < COUNT)")
+    return shard, shard_count
+
+# Default worker threads per pipeline stage
+DEFAULT_STAGE_WORKERS = {'dedupe': 2, 'render': 1, 'send': 4}
+
+def parse_stage_workers(value):
+    """Parse a STAGE=N command line worker count"""
+    try:
+        stage, workers = value.split('=')
+        workers = int(workers)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid workers: {value} (expected STAGE=N)")
+    if stage not in DEFAULT_STAGE_WORKERS or workers < 1:
+        raise argparse.ArgumentTypeError(f"Invalid workers: {value} (STAGE is one of {', '.join(DEFAULT_STAGE_WORKERS)}, N >= 1)")
+    return stage, workers
+
 def parse_arguments():
     """Parse command line arguments"""
     parser = argparse.ArgumentParser(description='Birthday notification script')
@@ -158,79 +308,188 @@ def parse_arguments():
                         help='Actually send email notifications (default: just log)')
     parser.add_argument('--force', action='store_true',
                         help='Force sending notifications even if already sent')
+    parser.add_argument('--date', type=parse_date,
+                        help='Process this date instead of today (YYYY-MM-DD), for replay and backfill')
+    parser.add_argument('--window-days', type=int, default=2,
+                        help='Number of days ahead to notify about (default: 2)')
+    parser.add_argument('--shard', type=parse_shard, default=(0, 1),
+                        help='Only process users with user_id %% COUNT == INDEX, as INDEX/COUNT (default: 0/1)')
+    parser.add_argument('--max-catchup-days', type=int, default=7,
+                        help='Maximum number of missed days to catch up on (default: 7)')
+    parser.add_argument('--workers', type=parse_stage_workers, action='append', default=[],
+                        metavar='STAGE=N',
+                        help=f'Worker threads for a pipeline stage, one of {", ".join(DEFAULT_STAGE_WORKERS)} '
+                             f'(default: {" ".join(f"{k}={v}" for k, v in DEFAULT_STAGE_WORKERS.items())})')
+    parser.add_argument('--queue-size', type=int, default=100,
+                        help='Maximum number of users queued between pipeline stages (default: 100)')
+    parser.add_argument('--record-batch-size', type=int, default=100,
+                        help='Number of sent users recorded per database commit (default: 100)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Profile each pipeline stage separately with cProfile')
+    parser.add_argument('--profile-dir', default=os.environ.get('PROFILE_DIR', 'profiles'),
+                        help='Directory the stage profiles are written to with --profile (default: profiles)')
     return parser.parse_args()
 
+def get_processing_range(run_date, run_state, replay, max_catchup_days):
+    """
+    Return the first date to process, or None if run_date has already been processed.
+    Processing starts the day after the high-water mark, bounded by max_catchup_days.
+    A replay always includes run_date itself.
+    """
+    start_date = run_date
+    if run_state is not None:
+        start_date = run_state.last_processed_date + timedelta(days=1)
+        if replay:
+            start_date = min(start_date, run_date)
+        elif start_date > run_date:
+            return None
+    
+    earliest = run_date - timedelta(days=max_catchup_days)
+    if start_date < earliest:
+        logger.warning(f"High-water mark is more than {max_catchup_days} days old, catching up from {earliest} only")
+        start_date = earliest
+    
+    return start_date
+
 def main():
     """
     Main function to run the birthday notification process
     """
     args = parse_arguments()
+    shard, shard_count = args.shard
+    run_date = args.date or datetime.now().date()
     
     logger.info("Starting birthday notification check")
     logger.info(f"Email sending is {'ENABLED' if args.send_emails else 'DISABLED'}")
     
+    # Recorded as a NotificationRun row and printed as a JSON summary on stdout
+    telemetry = RunTelemetry(run_date, shard, shard_count)
+    run_id = telemetry.save()
+    try:
+        status = process_run(args, run_date, shard, shard_count, telemetry)
+    except BaseException:
+        telemetry.finish('error')
+        raise
+    else:
+        telemetry.finish(status)
+    finally:
+        telemetry.save(run_id)
+        print(json.dumps(dict(telemetry.summary(), run_id=run_id)))
+    
+    logger.info("Birthday notification check completed")
+
+def process_run(args, run_date, shard, shard_count, telemetry):
+    """
+    Process the dates since the high-water mark, returning the status of the run
+    """
     with app.app_context():
-        # Get upcoming birthdays for the next 2 days
-        upcoming_birthdays = get_upcoming_birthdays_next_two_days()
+        run_state = get_run_state(shard, shard_count, args.window_days)
+        start_date = get_processing_range(run_date, run_state, args.date is not None, args.max_catchup_days)
         
-        if not upcoming_birthdays:
-            logger.info("No upcoming birthdays in the next 2 days")
-            return
+        if start_date is None:
+            logger.info(f"Shard {shard}/{shard_count} already processed up to {run_state.last_processed_date}, nothing to do")
+            return 'up_to_date'
         
-        # Format birthdays for notification, filtering already notified ones
-        notifications = format_birthdays_for_notification(upcoming_birthdays)
+        if run_state is None:
+            run_state = NotifierRunState(
+                shard=shard,
+                shard_count=shard_count,
+                window_days=args.window_days,
+                last_processed_date=start_date - timedelta(days=1)
+            )
         
-        # If forcing notifications, bypass the filtering
-        if args.force and not notifications:
-            logger.info("Force option enabled - preparing notifications without filtering")
-            notifications = []
-            
-            for user_id, data in upcoming_birthdays.items():
-                user = data['user']
-                birthdays = data['birthdays']
-                
-                user_notification = {
-                    'user_id': user_id,
-                    'username': user.username,
-                    'email': user.email,
-                    'birthdays': []
-                }
-                
-                for birthday in birthdays:
-                    user_notification['birthdays'].append({
-                        'id': birthday['id'],
-                        'name': birthday['name'],
-                        'date': birthday['this_year_date'].strftime('%Y-%m-%d'),
-                        'days_until': birthday['days_until'],
-                        'age': birthday['age'],
-                        'notes': birthday['notes']
-                    })
-                
-                if user_notification['birthdays']:
-                    notifications.append(user_notification)
+        periods = notification_periods(start_date, run_date, args.window_days)
+        logger.info(f"Processing {start_date} to {run_date} for shard {shard}/{shard_count}")
+        for period in periods:
+            logger.info(f"{period.cadence.capitalize()} notifications due cover birthdays from {period.start_date} to {period.end_date}")
         
-        if not notifications:
-            logger.info("No new birthday notifications to send")
-            return
+        # Stream the birthdays due for every date since the high-water mark, for every cadence, from a single query
+        source = telemetry.timed_iterable('candidate', count_candidates(read_from_replicas(
+            build_user_notification(user.id, user, birthdays)
+            for user, birthdays in iter_birthdays_in_periods(
+                periods,
+                reference_date=run_date,
+                shard=shard,
+                shard_count=shard_count
+            )
+        ), telemetry))
         
-        # Process notifications (log info)
-        processed_notifications = process_notifications(notifications)
+        # With --profile every stage, and the candidate query feeding them, gets its own profile
+        profiler = StageProfiler() if args.profile else None
+        profiled = (lambda name, func: profiler.wrap(name, func)) if profiler else (lambda name, func: func)
+        if profiler:
+            source = profiler.wrap_iterable('candidates', source)
+        record = telemetry.timed('record', profiled('record', record_notifications))
         
-        # Send email notifications if enabled
+        workers = dict(DEFAULT_STAGE_WORKERS, **dict(args.workers))
+        stages = []
+        if args.force:
+            logger.info("Force option enabled - preparing notifications without filtering")
+        else:
+            stages.append(Stage('dedupe', profiled('dedupe', partial(counted_dedupe, telemetry=telemetry)), workers['dedupe']))
         if args.send_emails:
-            logger.info("Sending email notifications...")
-            sent = send_birthday_notifications(processed_notifications)
-            if sent:
-                logger.info("Email notifications sent successfully")
-                # Record which notifications were sent
-                record_notifications(processed_notifications)
-            else:
-                logger.error("Failed to send email notifications")
+            stages.append(Stage('render', profiled('render', render_notification), workers['render']))
+            stages.append(Stage('send', profiled('send', partial(send_notification, telemetry=telemetry)), workers['send']))
         else:
+            stages.append(Stage('render', profiled('render', log_notification), workers['render']))
+        
+        users = sent = failed = 0
+        pending = []
+        email_client = get_email_client()
+        bytes_before, spooled_before = email_client.bytes_sent, email_client.spooled
+        if args.send_emails:
+            # Emails spooled by earlier runs go out before the new ones
+            email_client.drain_spool()
+        
+        try:
+            for notification in run_pipeline(source, stages, queue_size=args.queue_size, context=app.app_context):
+                users += 1
+                if not args.send_emails:
+                    continue
+                if not notification['sent']:
+                    failed += 1
+                    continue
+                
+                # Record which notifications were sent in batches
+                sent += 1
+                pending.append(notification)
+                if len(pending) >= args.record_batch_size:
+                    record(pending)
+                    pending = []
+        finally:
+            for stage in stages:
+                telemetry.add_time(stage.name, stage.seconds)
+            telemetry.count('email_bytes_sent', email_client.bytes_sent - bytes_before)
+            telemetry.count('emails_spooled', email_client.spooled - spooled_before)
+        
+        logger.info(f"Found {users} users with upcoming birthdays")
+        
+        if args.send_emails and email_client.spool is not None:
+            email_client.drain_spool()
+            if email_client.spool.pending_bytes():
+                logger.warning(f"{len(email_client.spool)} emails are still spooled in {email_client.spool.path}, the next run sends them")
+        
+        if not args.send_emails:
             logger.info("Email notifications prepared but not sent (email sending is disabled)")
             logger.info("Use --send-emails flag to enable sending")
-    
-    logger.info("Birthday notification check completed")
+            status = 'dry_run'
+        elif failed:
+            # Leave the high-water mark so the next run retries the failed users
+            record(pending)
+            logger.error(f"Failed to send email notifications to {failed} users ({sent} sent)")
+            status = 'failed'
+        else:
+            # Record the last notifications and advance the high-water mark
+            record(pending, run_state, run_date)
+            logger.info(f"Email notifications sent successfully to {sent} users")
+            status = 'success'
+        
+        if profiler:
+            save_stage_profiles(profiler, stages, args.profile_dir, {
+                'run_date': run_date, 'shard': f"{shard}/{shard_count}", 'users': users
+            })
+        
+        return status
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
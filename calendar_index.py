@@ -0,0 +1,99 @@
+"""
+Calendar Index Module
+
+An in-memory index of a user's birthdays bucketed by day of year.
+It's built in one pass from compact (id, name, date, notes) rows and answers
+date window queries in time proportional to the window, so month and year
+calendar views don't have to scan every birthday.
+"""
+
+import calendar
+from collections import namedtuple
+from datetime import date, timedelta
+
+CalendarEntry = namedtuple('CalendarEntry', ['id', 'name', 'date', 'notes'])
+
+# Cumulative day counts of a leap year, so every (month, day) including Feb 29 has its own bucket
+_MONTH_OFFSETS = [0]
+for _month in range(1, 12):
+    _MONTH_OFFSETS.append(_MONTH_OFFSETS[-1] + calendar.monthrange(2000, _month)[1])
+
+FEB_28_BUCKET = _MONTH_OFFSETS[1] + 27
+FEB_29_BUCKET = _MONTH_OFFSETS[1] + 28
+
+def day_of_year_bucket(month, day):
+    """
+    Return the bucket (0-365) of a month and day
+    """
+    return _MONTH_OFFSETS[month - 1] + day - 1
+
+class CalendarIndex:
+    """
+    366 day-of-year buckets of birthdays, with incremental add and remove
+    """
+    __slots__ = ('_buckets', '_bucket_by_id')
+
+    def __init__(self, rows=()):
+        self._buckets = [() for _ in range(366)]
+        self._bucket_by_id = {}
+        grouped = {}
+        for row in rows:
+            entry = CalendarEntry(*row)
+            bucket = day_of_year_bucket(entry.date.month, entry.date.day)
+            grouped.setdefault(bucket, []).append(entry)
+            self._bucket_by_id[entry.id] = bucket
+        for bucket, entries in grouped.items():
+            self._buckets[bucket] = tuple(entries)
+
+    def __len__(self):
+        return len(self._bucket_by_id)
+
+    def add(self, row):
+        """
+        Add (or replace) a birthday
+        """
+        entry = CalendarEntry(*row)
+        self.remove(entry.id)
+        bucket = day_of_year_bucket(entry.date.month, entry.date.day)
+        # Buckets are replaced rather than mutated so concurrent readers see a consistent tuple
+        self._buckets[bucket] = self._buckets[bucket] + (entry,)
+        self._bucket_by_id[entry.id] = bucket
+
+    def remove(self, birthday_id):
+        """
+        Remove a birthday, returning True if it was indexed
+        """
+        bucket = self._bucket_by_id.pop(birthday_id, None)
+        if bucket is None:
+            return False
+        self._buckets[bucket] = tuple(e for e in self._buckets[bucket] if e.id != birthday_id)
+        return True
+
+    def window(self, start_date, end_date):
+        """
+        Yield (occurrence_date, entry) for every birthday between start_date and end_date
+        (inclusive), in date order. The window may wrap around the end of the year.
+        Feb 29 birthdays fall on Feb 28 in non-leap years.
+        """
+        # By offset, so a window ending on date.max never steps past it
+        for offset in range((end_date - start_date).days + 1):
+            day = start_date + timedelta(days=offset)
+            bucket = day_of_year_bucket(day.month, day.day)
+            for entry in self._buckets[bucket]:
+                yield day, entry
+            if bucket == FEB_28_BUCKET and not calendar.isleap(day.year):
+                for entry in self._buckets[FEB_29_BUCKET]:
+                    yield day, entry
+
+    def month(self, year, month):
+        """
+        Yield (occurrence_date, entry) for every birthday in a month
+        """
+        last_day = calendar.monthrange(year, month)[1]
+        return self.window(date(year, month, 1), date(year, month, last_day))
+
+    def year(self, year):
+        """
+        Yield (occurrence_date, entry) for every birthday in a year
+        """
+        return self.window(date(year, 1, 1), date(year, 12, 31))
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Change Feed Compaction Script
+
+Every add, update and delete of a birthday writes a BirthdayChange row, read
+by /api/birthdays/changes for incremental syncs. Clients only need the
+entries since their last sync: this script deletes the entries older than
+--keep-days. A client whose cursor is older than the entries kept gets a full
+resync instead of the deltas, so --keep-days should cover the usual time
+between two syncs of a client.
+
+Entries are deleted in small batches, each in its own short transaction,
+with a pause in between, so it can run alongside the application and be
+stopped and rerun at any point.
+
+    python compact_changes.py --dry-run
+    python compact_changes.py --keep-days 30
+"""
+
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta
+import logging
+from dotenv import load_dotenv
+
+# Add the current directory to the path so that we can import app modules
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('compact_changes')
+
+# Load environment variables
+load_dotenv()
+
+# Import app after setting up environment
+from app import app, db, BirthdayChange
+from sqlalchemy import func, select
+
+def compact_changes(cutoff, batch_size=5000, sleep=0.1, dry_run=False, max_batches=None):
+    """
+    Delete the change feed entries created before cutoff in batches, returning the number deleted
+    """
+    changes = BirthdayChange.__table__
+    pending = db.session.query(func.count(BirthdayChange.id)).filter(BirthdayChange.created_at < cutoff).scalar()
+    db.session.commit()
+    logger.info(f"{pending} change feed entries from before {cutoff:%Y-%m-%d %H:%M} to delete")
+    if dry_run or not pending:
+        return 0
+
+    deleted = batches = 0
+    started = time.monotonic()
+    while max_batches is None or batches < max_batches:
+        # Oldest first over the created_at index, so an interrupted run leaves no holes in the feed
+        ids = db.session.execute(
+            select(changes.c.id).where(changes.c.created_at < cutoff).order_by(changes.c.created_at).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            db.session.commit()
+            break
+        db.session.execute(changes.delete().where(changes.c.id.in_(ids)))
+        db.session.commit()
+
+        deleted += len(ids)
+        batches += 1
+        elapsed = time.monotonic() - started
+        rate = deleted / elapsed if elapsed else 0
+        logger.info(f"Deleted {deleted}/{pending} change feed entries ({rate:.0f} rows/s)")
+        time.sleep(sleep)
+
+    return deleted
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='Delete old birthday change feed entries')
+    parser.add_argument('--keep-days', type=int, default=int(os.environ.get('CHANGE_FEED_KEEP_DAYS', 30)),
+                        help='Days of change feed entries kept (default: 30)')
+    parser.add_argument('--batch-size', type=int, default=5000,
+                        help='Entries deleted per transaction (default: 5000)')
+    parser.add_argument('--sleep', type=float, default=0.1,
+                        help='Seconds to pause between batches (default: 0.1)')
+    parser.add_argument('--max-batches', type=int,
+                        help='Stop after this many batches, the next run continues')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only count the entries that would be deleted')
+    return parser.parse_args()
+
+def main():
+    """
+    Main function
+    """
+    args = parse_arguments()
+
+    with app.app_context():
+        cutoff = datetime.utcnow() - timedelta(days=args.keep_days)
+        deleted = compact_changes(
+            cutoff,
+            batch_size=args.batch_size,
+            sleep=args.sleep,
+            dry_run=args.dry_run,
+            max_batches=args.max_batches
+        )
+        logger.info(f"Compaction completed, {deleted} change feed entries deleted")
+
+if __name__ == "__main__":
+    main()
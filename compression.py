@@ -0,0 +1,91 @@
+"""
+Response Compression Module
+
+Compresses HTML and JSON responses with gzip or brotli, negotiated from the
+request's Accept-Encoding, for deployments where gunicorn is not behind an
+nginx that compresses. Responses carrying an ETag keep their compressed bytes
+in a bounded cache keyed by (ETag, encoding), so repeated hits on an unchanged
+body are not recompressed.
+
+Brotli is optional: it's only offered when the brotli package is installed.
+"""
+
+import gzip
+
+from flask import request
+
+from caching import ByteLRUCache
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+DEFAULT_MIMETYPES = ('text/html', 'application/json', 'text/plain', 'text/css', 'application/javascript')
+
+def compress(data, encoding, level):
+    """
+    Compress bytes with the given content encoding
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+def init_compression(app):
+    """
+    Register response compression on a Flask app, configured by:
+    COMPRESS_MIN_SIZE (bytes), COMPRESS_LEVEL (gzip 1-9), COMPRESS_BROTLI_QUALITY (0-11),
+    COMPRESS_MIMETYPES and COMPRESS_CACHE_BYTES (0 disables the cache)
+
+    Register it before other after_request hooks, since Flask runs them in reverse
+    order and compression has to see the final body.
+    """
+    app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+    app.config.setdefault('COMPRESS_LEVEL', 6)
+    app.config.setdefault('COMPRESS_BROTLI_QUALITY', 4)
+    app.config.setdefault('COMPRESS_MIMETYPES', DEFAULT_MIMETYPES)
+    app.config.setdefault('COMPRESS_CACHE_BYTES', 16 * 1024 * 1024)
+
+    encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+    cache = ByteLRUCache(app.config['COMPRESS_CACHE_BYTES'])
+    app.extensions['compression_cache'] = cache
+
+    @app.after_request
+    def compress_response(response):
+        if (response.direct_passthrough
+                or response.is_streamed
+                or not 200 <= response.status_code < 300
+                or response.status_code == 204
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in app.config['COMPRESS_MIMETYPES']):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(encodings)
+        if encoding is None:
+            return response
+
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+
+        level = app.config['COMPRESS_BROTLI_QUALITY'] if encoding == 'br' else app.config['COMPRESS_LEVEL']
+        etag, weak = response.get_etag()
+        compressed = None
+        if etag and app.config['COMPRESS_CACHE_BYTES']:
+            key = (etag, encoding, level)
+            compressed = cache.get(key)
+            if compressed is None:
+                compressed = compress(data, encoding, level)
+                cache.set(key, compressed)
+        else:
+            compressed = compress(data, encoding, level)
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        if etag:
+            # The compressed body is a different representation of the same resource
+            response.set_etag(etag, weak=True)
+        return response
+
+    return cache
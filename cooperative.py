@@ -0,0 +1,36 @@
+"""
+Cooperative Concurrency Module
+
+With the gevent worker profile (GUNICORN_WORKER_CLASS=gevent, see
+gunicorn_config.py) each request runs in a greenlet, and the standard library
+is monkey patched so that sockets, PyMySQL's included, yield to the other
+greenlets while waiting. A worker then serves as many concurrent requests as
+it has greenlets instead of one per thread, which suits handlers that mostly
+wait on the database.
+
+Greenlets only switch while waiting: CPU-bound work such as password hashing
+holds up every other request of the worker meanwhile. run_in_thread runs it
+in a native thread of gevent's threadpool instead, the greenlet waiting for
+the result like for any other I/O. Without gevent, or when it isn't patched
+in, it just calls the function.
+"""
+
+try:
+    import gevent
+    from gevent import monkey
+except ImportError:
+    gevent = None
+
+def is_cooperative():
+    """
+    Return True if the process runs greenlets on a monkey patched standard library
+    """
+    return gevent is not None and monkey.is_module_patched('socket')
+
+def run_in_thread(func, *args, **kwargs):
+    """
+    Return func(*args, **kwargs), called in a native thread when running cooperatively
+    """
+    if not is_cooperative():
+        return func(*args, **kwargs)
+    return gevent.get_hub().threadpool.apply(func, args, kwargs)
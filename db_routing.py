@@ -0,0 +1,142 @@
+"""
+Database Routing Module
+
+Sends reads to replica databases when they are explicitly allowed, and
+everything else to the primary. Reads are allowed on replicas inside
+replica_reads(); writes, flushes and any read outside of it stay on the primary.
+
+Replicas are picked round-robin, once per replica_reads() block: every read
+of the block goes to the same replica, so data versions and the rows cached
+under them come from the same point in time even when replicas lag
+differently. A replica that raises a connection-level error is ejected for a
+while, then tried again; with every replica ejected, reads fall back to the
+primary.
+"""
+
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+
+logger = logging.getLogger('db_routing')
+
+class _ReplicaBlock:
+    """
+    The replica of a replica_reads() block, chosen on its first read
+    """
+    __slots__ = ('_engine', '_chosen')
+
+    def __init__(self):
+        self._engine = None
+        self._chosen = False
+
+    def engine(self, router):
+        # None (every replica ejected) sticks too: the whole block then reads from the primary
+        if not self._chosen:
+            self._engine = router.choose()
+            self._chosen = True
+        return self._engine
+
+_replica_reads = ContextVar('replica_reads', default=None)
+
+@contextmanager
+def replica_reads(enabled=True):
+    """
+    Allow (or, with enabled=False, forbid) queries in the block to go to a replica, the
+    same one for the whole block. Nested blocks read from the replica of the outer one.
+    """
+    current = _replica_reads.get()
+    token = _replica_reads.set((current or _ReplicaBlock()) if enabled else None)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+def replica_reads_enabled():
+    return _replica_reads.get() is not None
+
+class ReplicaRouter:
+    """
+    Round-robin over replica engines with health-based ejection
+    """
+    def __init__(self):
+        self.engines = []
+        self.eject_seconds = 30
+        self._ejected_until = {}
+        self._cycle = None
+        self._lock = threading.Lock()
+
+    def configure(self, uris, engine_options=None, eject_seconds=30):
+        """
+        Create an engine per replica URI
+        """
+        self.eject_seconds = eject_seconds
+        self.engines = []
+        for uri in uris:
+            engine = create_engine(uri, **(engine_options(uri) if callable(engine_options) else engine_options or {}))
+            event.listen(engine, 'handle_error', self._on_error)
+            self.engines.append(engine)
+        self._ejected_until = {}
+        self._cycle = itertools.cycle(self.engines) if self.engines else None
+        if self.engines:
+            logger.info(f"Routing read-only queries to {len(self.engines)} replicas")
+
+    def _on_error(self, context):
+        engine = context.engine
+        if context.is_disconnect or context.connection is None or _is_operational(context.original_exception):
+            self.eject(engine)
+
+    def eject(self, engine):
+        """
+        Stop routing to a replica for eject_seconds
+        """
+        with self._lock:
+            self._ejected_until[engine] = time.monotonic() + self.eject_seconds
+        logger.warning(f"Ejected replica {engine.url.render_as_string(hide_password=True)} for {self.eject_seconds}s")
+
+    def choose(self):
+        """
+        Return the next healthy replica engine, or None if there is none
+        """
+        if self._cycle is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            for _ in range(len(self.engines)):
+                engine = next(self._cycle)
+                ejected_until = self._ejected_until.get(engine)
+                if ejected_until is None:
+                    return engine
+                if ejected_until <= now:
+                    # Give it another chance, it's ejected again on the next failure
+                    del self._ejected_until[engine]
+                    return engine
+        return None
+
+    def healthy_count(self):
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for engine in self.engines if self._ejected_until.get(engine, 0) <= now)
+
+def _is_operational(exception):
+    # Connection refused, lost or timed out: OperationalError in every DB-API driver
+    return type(exception).__name__ == 'OperationalError'
+
+router = ReplicaRouter()
+
+class RoutingSession(Session):
+    """
+    Flask-SQLAlchemy session sending reads inside replica_reads() to the block's replica
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        block = _replica_reads.get()
+        if bind is None and not self._flushing and block is not None and not self.new and not self.dirty and not self.deleted:
+            engine = block.engine(router)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -4,47 +4,81 @@ Email Notification Module
 This module handles sending email notifications for birthday reminders.
 It's separate from the main application to allow for easy integration
 with the notification script.
+
+Every email is EMAIL_TEMPLATE filled in with per-user variables. When the
+email API supports templates, the template is registered once and each
+message only carries its variables; otherwise the rendered HTML is sent,
+gzip-compressed when the API accepts it. See EmailAPIClient.
+
+Every call has connect and read timeouts. After consecutive failures a
+circuit breaker stops calling the API and emails are appended to an on-disk
+spool instead, which is drained as soon as the API answers again.
 """
 
 import os
+import gzip
+import hashlib
 import logging
+import threading
+from string import Template
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import smtplib
 from datetime import datetime
 import requests
 import json
+from resilience import CircuitBreaker, Spool
 
 logger = logging.getLogger('email_notifications')
 
-def format_birthday_email(username, birthdays):
-    """
-    Format the email content for upcoming birthdays
-    """
-    today = datetime.now().date()
-    today_birthdays = [b for b in birthdays if b['days_until'] == 0]
-    upcoming_birthdays = [b for b in birthdays if b['days_until'] > 0]
-    
-    # Create HTML content for the email
-    html = f"""
+# (title, heading of the upcoming birthdays) of the email of each cadence
+CADENCE_TITLES = {
+    'daily': ('Birthday Reminders', 'Upcoming Birthdays (Next 2 Days)'),
+    'weekly': ('Your Weekly Birthday Digest', 'Coming Up This Week'),
+    'monthly': ('Your Monthly Birthday Preview', 'Coming Up This Month'),
+}
+
+# The HTML shell of every email, with $title, $username and $content placeholders
+EMAIL_TEMPLATE = Template("""
     <html>
     <head>
         <style>
-            body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-            h1 {{ color: #5e72e4; text-align: center; }}
-            .birthday {{ background-color: #f8f9fa; padding: 15px; margin-bottom: 15px; border-radius: 5px; }}
-            .birthday-today {{ background-color: #fff3cd; }}
-            .header {{ font-weight: bold; margin-bottom: 5px; }}
-            .notes {{ font-style: italic; color: #6c757d; }}
-            .footer {{ text-align: center; margin-top: 30px; font-size: 0.8em; color: #6c757d; }}
+            body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
+            .container { max-width: 600px; margin: 0 auto; padding: 20px; }
+            h1 { color: #5e72e4; text-align: center; }
+            .birthday { background-color: #f8f9fa; padding: 15px; margin-bottom: 15px; border-radius: 5px; }
+            .birthday-today { background-color: #fff3cd; }
+            .header { font-weight: bold; margin-bottom: 5px; }
+            .notes { font-style: italic; color: #6c757d; }
+            .footer { text-align: center; margin-top: 30px; font-size: 0.8em; color: #6c757d; }
         </style>
     </head>
     <body>
         <div class="container">
-            <h1>Birthday Reminders</h1>
-            <p>Hello {username},</p>
+            <h1>${title}</h1>
+            <p>Hello ${username},</p>
+    ${content}
+            <div class="footer">
+                <p>This is an automated message from your Birthday Reminder App.</p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """)
+
+# Changes whenever the template does, so a changed template is registered under a new id
+EMAIL_TEMPLATE_ID = 'birthday-reminder-' + hashlib.sha256(EMAIL_TEMPLATE.template.encode('utf-8')).hexdigest()[:12]
+
+def birthday_email_variables(username, birthdays, cadence='daily'):
     """
+    Return the EMAIL_TEMPLATE variables of the email for upcoming birthdays
+    """
+    title, upcoming_heading = CADENCE_TITLES[cadence]
+    missed_birthdays = [b for b in birthdays if b['days_until'] < 0]
+    today_birthdays = [b for b in birthdays if b['days_until'] == 0]
+    upcoming_birthdays = [b for b in birthdays if b['days_until'] > 0]
+    
+    html = ""
     
     if today_birthdays:
         html += f"""
@@ -65,9 +99,27 @@ def format_birthday_email(username, birthdays):
                 
             html += """</div>"""
     
+    if missed_birthdays:
+        html += f"""
+            <h2>Missed Birthdays</h2>
+        """
+        
+        for birthday in missed_birthdays:
+            day_text = "day" if birthday['days_until'] == -1 else "days"
+            html += f"""
+            <div class="birthday">
+                <div class="header">{birthday['name']} (turned {birthday['age']} {-birthday['days_until']} {day_text} ago)</div>
+                <div>Date: {birthday['date']}</div>
+            """
+            
+            if birthday['notes']:
+                html += f"""<div class="notes">Notes: {birthday['notes']}</div>"""
+                
+            html += """</div>"""
+    
     if upcoming_birthdays:
         html += f"""
-            <h2>Upcoming Birthdays (Next 2 Days)</h2>
+            <h2>{upcoming_heading}</h2>
         """
         
         for birthday in upcoming_birthdays:
@@ -83,16 +135,246 @@ def format_birthday_email(username, birthdays):
                 
             html += """</div>"""
     
-    html += """
-            <div class="footer">
-                <p>This is an automated message from your Birthday Reminder App.</p>
-            </div>
-        </div>
-    </body>
-    </html>
+    return {'title': title, 'username': username, 'content': html}
+
+def format_birthday_email(username, birthdays, cadence='daily'):
     """
-    
-    return html
+    Format the email content for upcoming birthdays
+    """
+    return EMAIL_TEMPLATE.substitute(birthday_email_variables(username, birthdays, cadence))
+
+class EmailAPIClient:
+    """
+    Email API client sending each message in the most compact format the API supports,
+    negotiated once from GET /api/v1/capabilities ({"templates": bool, "gzip": bool}):
+    - template: EMAIL_TEMPLATE is registered once, messages only carry their variables
+    - gzip: the rendered HTML in a gzip-compressed request body
+    - plain: the rendered HTML as JSON, for APIs without a capabilities endpoint
+    Template requests are gzip-compressed too when the API accepts it. mode forces one
+    of them instead of 'auto'. Counts the request body bytes it sends.
+
+    deliver() goes through a CircuitBreaker and, when a spool is given, appends the
+    emails it can't send to it; they are sent once the API answers again.
+    timeout is the (connect, read) timeout of every call in seconds.
+    """
+    MODES = ('auto', 'template', 'gzip', 'plain')
+
+    def __init__(self, api_host, mode='auto', gzip_min_bytes=512, timeout=(3.05, 10), breaker=None, spool=None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown email API mode {mode!r}, expected one of {', '.join(self.MODES)}")
+        self.api_host = (api_host or '').rstrip('/')
+        self.mode = mode
+        self.gzip_min_bytes = gzip_min_bytes
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker('email API')
+        self.spool = spool
+        self.session = requests.Session()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.spooled = 0
+        self.drained = 0
+        self._negotiated = None
+        self._gzip = mode in ('template', 'gzip')
+        self._registered = False
+        self._lock = threading.Lock()
+        self._register_lock = threading.Lock()
+
+    def negotiated_mode(self):
+        """
+        Return the request format used with the API, asking for its capabilities the first time
+        """
+        if self.mode != 'auto':
+            return self.mode
+        with self._lock:
+            if self._negotiated is None:
+                try:
+                    response = self.session.get(f"{self.api_host}/api/v1/capabilities", timeout=self.timeout)
+                except requests.RequestException as e:
+                    # Don't remember anything, the next message asks again
+                    logger.warning(f"Could not get the email API capabilities, sending plain JSON: {e}")
+                    return 'plain'
+                capabilities = {}
+                if response.status_code == 200:
+                    try:
+                        capabilities = response.json()
+                    except ValueError:
+                        pass
+                self._gzip = bool(capabilities.get('gzip'))
+                if capabilities.get('templates'):
+                    self._negotiated = 'template'
+                elif capabilities.get('gzip'):
+                    self._negotiated = 'gzip'
+                else:
+                    self._negotiated = 'plain'
+                logger.info(f"Email API at {self.api_host} supports {capabilities or 'no capabilities endpoint'}, sending {self._negotiated} requests")
+            return self._negotiated
+
+    def _request(self, method, path, payload, compress=False):
+        body = json.dumps(payload).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if compress and len(body) >= self.gzip_min_bytes:
+            body = gzip.compress(body, compresslevel=6)
+            headers['Content-Encoding'] = 'gzip'
+        response = self.session.request(method, f"{self.api_host}{path}", data=body, headers=headers, timeout=self.timeout)
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += len(body)
+        return response
+
+    def register_template(self, force=False):
+        """
+        Register EMAIL_TEMPLATE with the API under EMAIL_TEMPLATE_ID, once unless forced
+        """
+        with self._register_lock:
+            if self._registered and not force:
+                return
+            response = self._request('PUT', f"/api/v1/templates/{EMAIL_TEMPLATE_ID}", {
+                'syntax': 'python-string-template',
+                'html_content': EMAIL_TEMPLATE.template
+            }, compress=self._gzip)
+            if response.status_code not in (200, 201, 204):
+                raise requests.HTTPError(f"Template registration returned {response.status_code}, {response.text}", response=response)
+            self._registered = True
+            logger.info(f"Registered email template {EMAIL_TEMPLATE_ID}")
+
+    def send(self, recipient, subject, variables):
+        """
+        Send the email rendered from EMAIL_TEMPLATE and variables, returning the API response
+        """
+        mode = self.negotiated_mode()
+        if mode != 'template':
+            return self.send_html(recipient, subject, EMAIL_TEMPLATE.substitute(variables), compress=mode == 'gzip')
+
+        self.register_template()
+        payload = {'email': recipient, 'subject': subject, 'template_id': EMAIL_TEMPLATE_ID, 'variables': variables}
+        response = self._request('POST', '/api/v1/send-template-email', payload, compress=self._gzip)
+        if response.status_code == 404:
+            # The API lost the template (e.g. it was restarted), register it again once
+            self.register_template(force=True)
+            response = self._request('POST', '/api/v1/send-template-email', payload, compress=self._gzip)
+        return response
+
+    def send_html(self, recipient, subject, html_content, compress=None):
+        """
+        Send an already rendered email, gzip-compressed if the API accepts it, returning the API response
+        """
+        if compress is None:
+            self.negotiated_mode()
+            compress = self._gzip
+        return self._request('POST', '/api/v1/send-custom-email', {
+            'email': recipient,
+            'subject': subject,
+            'html_content': html_content
+        }, compress=compress)
+
+    def _send_message(self, message):
+        if 'variables' in message:
+            return self.send(message['email'], message['subject'], message['variables'])
+        return self.send_html(message['email'], message['subject'], message['html_content'])
+
+    def _attempt(self, message):
+        """
+        Send a message if the breaker allows it, returning the response or None on a failure
+        """
+        if not self.breaker.allow():
+            return None
+        try:
+            response = self._send_message(message)
+        except requests.RequestException as e:
+            logger.error(f"Failed to send email via API: {str(e)}")
+            self.breaker.record_failure()
+            return None
+        if response.status_code >= 500 or response.status_code == 429:
+            logger.error(f"API returned error: {response.status_code}, {response.text}")
+            self.breaker.record_failure()
+            return None
+        self.breaker.record_success()
+        return response
+
+    def deliver(self, message):
+        """
+        Send a message, {'email', 'subject'} with 'variables' or 'html_content', returning
+        'sent', 'spooled' if it was kept to be sent once the API recovers, or 'failed'
+        """
+        response = self._attempt(message)
+        if response is None:
+            if self.spool is None:
+                return 'failed'
+            self.spool.append(message)
+            with self._lock:
+                self.spooled += 1
+            logger.warning(f"Email to {message['email']} spooled to {self.spool.path} (circuit {self.breaker.state})")
+            return 'spooled'
+        
+        # The API answers again, send what was spooled while it didn't
+        if self.spool is not None and self.spool.pending_bytes():
+            self.drain_spool()
+        
+        if response.status_code == 200:
+            logger.info(f"Email successfully sent to {message['email']} via API")
+            return 'sent'
+        logger.error(f"API returned error: {response.status_code}, {response.text}")
+        return 'failed'
+
+    def drain_spool(self):
+        """
+        Send the spooled emails in order while the API accepts them, returning the number sent
+        """
+        if self.spool is None or not self.spool.pending_bytes():
+            return 0
+        sent = 0
+        
+        def send(message):
+            nonlocal sent
+            response = self._attempt(message)
+            if response is None:
+                return False
+            if response.status_code == 200:
+                sent += 1
+            else:
+                # Rejected, e.g. an invalid address: retrying won't help
+                logger.error(f"Dropping spooled email to {message['email']}, API returned {response.status_code}, {response.text}")
+            return True
+        
+        drained = self.spool.drain(send)
+        with self._lock:
+            self.drained += sent
+        if drained:
+            logger.info(f"Drained {drained} emails from {self.spool.path} ({sent} sent), {len(self.spool)} still spooled")
+        return sent
+
+email_client = None
+email_client_lock = threading.Lock()
+
+def get_email_client():
+    """
+    Return the process-wide EmailAPIClient, configured from the environment:
+    API_HOST (API_HOST_PROD in production), EMAIL_API_MODE, EMAIL_GZIP_MIN_BYTES,
+    EMAIL_CONNECT_TIMEOUT, EMAIL_READ_TIMEOUT, EMAIL_BREAKER_FAILURES,
+    EMAIL_BREAKER_RESET_SECONDS and EMAIL_SPOOL_PATH (empty to disable the spool)
+    """
+    global email_client
+    with email_client_lock:
+        if email_client is None:
+            # Get API hostname from environment variable
+            if os.environ.get('ENV') == 'production':
+                api_host = os.environ.get('API_HOST_PROD')
+            else:
+                api_host = os.environ.get('API_HOST')
+            spool_path = os.environ.get('EMAIL_SPOOL_PATH', 'email_spool.jsonl')
+            email_client = EmailAPIClient(
+                api_host,
+                mode=os.environ.get('EMAIL_API_MODE', 'auto'),
+                gzip_min_bytes=int(os.environ.get('EMAIL_GZIP_MIN_BYTES', 512)),
+                timeout=(float(os.environ.get('EMAIL_CONNECT_TIMEOUT', 3.05)), float(os.environ.get('EMAIL_READ_TIMEOUT', 10))),
+                breaker=CircuitBreaker(
+                    'email API',
+                    failure_threshold=int(os.environ.get('EMAIL_BREAKER_FAILURES', 5)),
+                    reset_seconds=float(os.environ.get('EMAIL_BREAKER_RESET_SECONDS', 30))
+                ),
+                spool=Spool(spool_path) if spool_path else None
+            )
+        return email_client
 
 def send_email(recipient, subject, html_content):
     """
@@ -111,74 +393,73 @@ def send_email(recipient, subject, html_content):
     
     logger.info(f"Email content saved to {email_debug_file} for debugging")
     
-    # Use the external API to send the email
-    try:
-        # Get API hostname from environment variable with fallback to localhost
-        if os.environ.get('ENV') == 'production':
-            api_host = os.environ.get('API_HOST_PROD')
-        else:
-            api_host = os.environ.get('API_HOST')
-        api_url = f"{api_host}/api/v1/send-custom-email"
+    # Use the external API to send the email, True if it was sent or spooled to be sent later
+    client = get_email_client()
+    print(f"Sending email to {recipient} via API at {client.api_host}")
+    return client.deliver({'email': recipient, 'subject': subject, 'html_content': html_content}) != 'failed'
 
-        print(f"Sending email to {recipient} via API at {api_url}")
-        
-        # Prepare the payload for the API
-        payload = {
-            'email': recipient,
-            'subject': subject,
-            'html_content': html_content
-        }
-        
-        # Send the request to the API
-        response = requests.post(
-            api_url,
-            json=payload,
-            headers={'Content-Type': 'application/json'}
-        )
-        
-        # Check if the request was successful
-        if response.status_code == 200:
-            logger.info(f"Email successfully sent to {recipient} via API")
-            return True
-        else:
-            logger.error(f"API returned error: {response.status_code}, {response.text}")
-            return False
-            
-    except Exception as e:
-        logger.error(f"Failed to send email via API: {str(e)}")
-        return False
+def send_template_email(recipient, subject, variables):
+    """
+    Send the email rendered from EMAIL_TEMPLATE and variables using external API,
+    only the variables are sent when the API supports templates.
+    Returns True if it was sent or spooled to be sent later
+    """
+    logger.info(f"Sending email to: {recipient}")
+    logger.info(f"Subject: {subject}")
+    
+    return get_email_client().deliver({'email': recipient, 'subject': subject, 'variables': variables}) != 'failed'
+
+def render_birthday_notification(notification):
+    """
+    Render the email for one user's notification
+    Returns the notification with 'subject' and the EMAIL_TEMPLATE 'variables' added, or None if the user has no email
+    """
+    username = notification['username']
+    birthdays = notification['birthdays']
+    
+    # Skip if user has no email
+    if not notification['email']:
+        logger.warning(f"No email address for user {username}, skipping notification")
+        return None
+    
+    # Set subject based on the cadence and whether there are birthdays today
+    cadence = notification.get('cadence', 'daily')
+    today_birthdays = [b for b in birthdays if b['days_until'] == 0]
+    if cadence != 'daily':
+        subject = f"{CADENCE_TITLES[cadence][0]}: {len(birthdays)} birthdays"
+    elif today_birthdays:
+        subject = f"Birthday Reminder: {len(today_birthdays)} birthdays today!"
+    else:
+        subject = "Upcoming Birthday Reminders"
+    
+    return dict(notification, subject=subject, variables=birthday_email_variables(username, birthdays, cadence))
+
+def send_birthday_notification(rendered):
+    """
+    Send one rendered notification
+    Returns True if the email was sent, or spooled to be sent once the email API recovers
+    """
+    email = rendered['email']
+    sent = send_template_email(email, rendered['subject'], rendered['variables'])
+    
+    if sent:
+        logger.info(f"Birthday notification email sent to {email}")
+    else:
+        logger.error(f"Failed to send birthday notification email to {email}")
+    
+    return sent
 
 def send_birthday_notifications(notifications):
     """
     Send email notifications for upcoming birthdays
     """
     for notification in notifications:
-        username = notification['username']
-        email = notification['email']
-        birthdays = notification['birthdays']
-        
-        # Skip if user has no email
-        if not email:
-            logger.warning(f"No email address for user {username}, skipping notification")
+        rendered = render_birthday_notification(notification)
+        if rendered is None:
             continue
         
-        # Format email content
-        html_content = format_birthday_email(username, birthdays)
-        
-        # Set subject based on whether there are birthdays today
-        today_birthdays = [b for b in birthdays if b['days_until'] == 0]
-        if today_birthdays:
-            subject = f"Birthday Reminder: {len(today_birthdays)} birthdays today!"
-        else:
-            subject = "Upcoming Birthday Reminders"
-        
         # Send the email
-        sent = send_email(email, subject, html_content)
-        
-        if sent:
-            logger.info(f"Birthday notification email sent to {email}")
-        else:
-            logger.error(f"Failed to send birthday notification email to {email}")
+        if not send_birthday_notification(rendered):
             return False
     
-    return True 
\ No newline at end of file
+    return True
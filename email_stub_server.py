@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""
+Email API Stub Server
+
+A local stand-in for the email API, for development and testing purposes only.
+It implements the endpoints used by EmailAPIClient and delivers nothing:
+
+    GET  /api/v1/capabilities           {"templates": bool, "gzip": bool}
+    PUT  /api/v1/templates/<id>         register a template
+    POST /api/v1/send-template-email    template_id + variables
+    POST /api/v1/send-custom-email      full html_content, optionally gzip-compressed
+    GET  /api/v1/stats                  requests, emails and request body bytes received
+    POST /api/v1/faults                 change the injected faults, e.g. {"down": true}
+
+--no-templates and --no-gzip emulate older APIs, --legacy one without a
+capabilities endpoint at all. With --out every email is rendered to a file.
+
+Faults are injected into the API endpoints to exercise the client's timeouts,
+circuit breaker and spool: --down answers 503 to everything, --fail-rate a
+fraction of the requests, --hang-rate holds a fraction of them for
+--hang-seconds without answering, and --delay slows every answer down.
+
+    python email_stub_server.py --port 8025 --fail-rate 0.2 --hang-rate 0.01
+    API_HOST=http://127.0.0.1:8025 python birthday_notifier.py --send-emails
+    curl -X POST -d '{"down": false}' http://127.0.0.1:8025/api/v1/faults
+"""
+
+import os
+import re
+import gzip
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from string import Template
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StubState:
+    """
+    Registered templates and traffic counters of a stub server
+    """
+    FAULTS = ('down', 'fail_rate', 'hang_rate', 'hang_seconds', 'delay')
+
+    def __init__(self, templates=True, gzip=True, legacy=False, out_dir=None,
+                 down=False, fail_rate=0.0, hang_rate=0.0, hang_seconds=60.0, delay=0.0):
+        self.capabilities = None if legacy else {'templates': templates, 'gzip': gzip}
+        self.out_dir = out_dir
+        self.templates = {}
+        self.faults = {'down': down, 'fail_rate': fail_rate, 'hang_rate': hang_rate, 'hang_seconds': hang_seconds, 'delay': delay}
+        self.stats = {'requests': 0, 'emails': 0, 'bytes_received': 0, 'bytes_decompressed': 0, 'by_endpoint': {}, 'faults_injected': 0}
+        self.lock = threading.Lock()
+
+    def fault(self):
+        """
+        Return the fault to inject into a request: None, 'fail' or 'hang', after the configured delay
+        """
+        with self.lock:
+            faults = dict(self.faults)
+        if faults['delay']:
+            time.sleep(faults['delay'])
+        roll = random.random()
+        if faults['down'] or roll < faults['fail_rate']:
+            fault = 'fail'
+        elif roll < faults['fail_rate'] + faults['hang_rate']:
+            fault = 'hang'
+        else:
+            return None
+        with self.lock:
+            self.stats['faults_injected'] += 1
+        return fault
+
+    def count(self, endpoint, received, decompressed, emails=0):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['emails'] += emails
+            self.stats['bytes_received'] += received
+            self.stats['bytes_decompressed'] += decompressed
+            by_endpoint = self.stats['by_endpoint'].setdefault(endpoint, {'requests': 0, 'bytes_received': 0})
+            by_endpoint['requests'] += 1
+            by_endpoint['bytes_received'] += received
+
+    def deliver(self, recipient, subject, html_content):
+        if self.out_dir:
+            os.makedirs(self.out_dir, exist_ok=True)
+            name = re.sub(r'[^A-Za-z0-9_.@-]+', '_', recipient or 'unknown')
+            with open(os.path.join(self.out_dir, f"{name}_{uuid.uuid4().hex[:8]}.html"), 'w') as f:
+                f.write(f"<!-- Subject: {subject} -->\n{html_content}")
+
+class StubHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def log_message(self, format, *args):
+        # Keep load runs quiet
+        pass
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        """
+        Return (payload, bytes received, bytes after decompression)
+        """
+        raw = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = raw
+        if self.headers.get('Content-Encoding') == 'gzip':
+            if not self.state.capabilities or not self.state.capabilities['gzip']:
+                raise ValueError('gzip request bodies are not supported')
+            body = gzip.decompress(raw)
+        return json.loads(body), len(raw), len(body)
+
+    def injected_fault(self):
+        """
+        Inject a fault into the request, returning True if it was answered (or dropped)
+        """
+        fault = self.state.fault()
+        if fault == 'fail':
+            self.reply(503, {'error': 'injected failure'})
+        elif fault == 'hang':
+            time.sleep(self.state.faults['hang_seconds'])
+            self.close_connection = True
+        return fault is not None
+
+    def do_GET(self):
+        if self.path == '/api/v1/capabilities' and self.state.capabilities is not None:
+            if self.injected_fault():
+                return
+            self.reply(200, self.state.capabilities)
+        elif self.path == '/api/v1/stats':
+            with self.state.lock:
+                self.reply(200, json.loads(json.dumps(self.state.stats)))
+        else:
+            self.reply(404, {'error': 'not found'})
+
+    def do_PUT(self):
+        match = re.fullmatch(r'/api/v1/templates/([A-Za-z0-9_.-]+)', self.path)
+        if not match or not self.state.capabilities or not self.state.capabilities['templates']:
+            return self.reply(404, {'error': 'not found'})
+        if self.injected_fault():
+            return
+        try:
+            payload, received, decompressed = self.read_json()
+        except ValueError as e:
+            return self.reply(400, {'error': str(e)})
+        self.state.templates[match.group(1)] = Template(payload['html_content'])
+        self.state.count('templates', received, decompressed)
+        self.reply(201, {'template_id': match.group(1)})
+
+    def do_POST(self):
+        try:
+            payload, received, decompressed = self.read_json()
+        except ValueError as e:
+            return self.reply(400, {'error': str(e)})
+
+        if self.path == '/api/v1/faults':
+            with self.state.lock:
+                self.state.faults.update((name, value) for name, value in payload.items() if name in StubState.FAULTS)
+                return self.reply(200, self.state.faults)
+        if self.injected_fault():
+            return
+
+        if self.path == '/api/v1/send-custom-email':
+            html_content = payload['html_content']
+        elif self.path == '/api/v1/send-template-email' and self.state.capabilities and self.state.capabilities['templates']:
+            template = self.state.templates.get(payload['template_id'])
+            if template is None:
+                return self.reply(404, {'error': f"unknown template {payload['template_id']}"})
+            html_content = template.substitute(payload['variables'])
+        else:
+            return self.reply(404, {'error': 'not found'})
+
+        self.state.count(self.path.rsplit('/', 1)[-1], received, decompressed, emails=1)
+        self.state.deliver(payload['email'], payload['subject'], html_content)
+        self.reply(200, {'status': 'sent'})
+
+def start_stub_server(host='127.0.0.1', port=0, **options):
+    """
+    Start a stub server in a background thread, returning it; its URL is server.url
+    and its StubState server.state. options are those of StubState.
+    """
+    handler = type('Handler', (StubHandler,), {'state': StubState(**options)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.state = handler.state
+    server.url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='Local stand-in for the email API')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8025, help='Port to listen on (default: 8025)')
+    parser.add_argument('--no-templates', action='store_true', help='Do not support registered templates')
+    parser.add_argument('--no-gzip', action='store_true', help='Do not accept gzip-compressed request bodies')
+    parser.add_argument('--legacy', action='store_true', help='No capabilities endpoint, plain JSON only')
+    parser.add_argument('--out', help='Directory every received email is rendered to')
+    parser.add_argument('--down', action='store_true', help='Answer 503 to every API request')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Fraction of API requests answered with a 503 (default: 0)')
+    parser.add_argument('--hang-rate', type=float, default=0.0, help='Fraction of API requests never answered (default: 0)')
+    parser.add_argument('--hang-seconds', type=float, default=60.0, help='How long unanswered requests are held (default: 60)')
+    parser.add_argument('--delay', type=float, default=0.0, help='Seconds added to every API answer (default: 0)')
+    return parser.parse_args()
+
+def main():
+    """
+    Main function
+    """
+    args = parse_arguments()
+    server = start_stub_server(
+        args.host, args.port,
+        templates=not args.no_templates, gzip=not args.no_gzip, legacy=args.legacy, out_dir=args.out,
+        down=args.down, fail_rate=args.fail_rate, hang_rate=args.hang_rate, hang_seconds=args.hang_seconds, delay=args.delay
+    )
+    print(f"Email API stub listening on {server.url} (capabilities: {server.state.capabilities}, faults: {server.state.faults}), Ctrl-C to stop")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        print(json.dumps(server.state.stats, indent=2))
+
+if __name__ == "__main__":
+    main()
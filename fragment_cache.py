@@ -0,0 +1,84 @@
+"""
+Fragment Cache Module
+
+A Jinja extension caching rendered template fragments:
+
+    {% cache 'birthdays', user_id, data_version %} ... {% endcache %}
+
+The key parts are the comma-separated expressions after the tag. The body is
+only rendered on a miss, so values it needs can be passed as LazySequence and
+are only loaded when the fragment is actually rendered.
+"""
+
+import logging
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+logger = logging.getLogger('fragment_cache')
+
+class LazySequence:
+    """
+    A sequence loaded by calling loader() on first use
+    """
+    def __init__(self, loader):
+        self._loader = loader
+        self._items = None
+
+    def _load(self):
+        if self._items is None:
+            self._items = list(self._loader())
+        return self._items
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __bool__(self):
+        return bool(self._load())
+
+    def __getitem__(self, index):
+        return self._load()[index]
+
+class FragmentCacheExtension(Extension):
+    """
+    Adds the {% cache key, ... %}{% endcache %} tag, storing fragments in environment.fragment_cache
+    (any object with get(key) and set(key, value)); caching is disabled while it's None
+    """
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None, fragment_cache_stats_interval=0)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key_parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key_parts.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_cached_fragment', [nodes.List(key_parts)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _cached_fragment(self, key_parts, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+
+        key = tuple(key_parts)
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = caller()
+            cache.set(key, fragment)
+
+        interval = self.environment.fragment_cache_stats_interval
+        if interval and (cache.hits + cache.misses) % interval == 0:
+            stats = cache.stats()
+            logger.info(
+                f"Fragment cache: {stats['hit_ratio']:.1%} hit ratio ({stats['hits']} hits, {stats['misses']} misses), "
+                f"{stats['entries']} entries, {stats['bytes']} of {stats['max_bytes']} bytes"
+            )
+        return fragment
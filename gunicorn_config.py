@@ -3,14 +3,31 @@ import os
 
 # Gunicorn configuration file for production deployment
 
+# Worker profile: "sync" (threads) or "gevent" (greenlets, for I/O-bound traffic, needs the gevent package)
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync")
+
+if worker_class == "gevent":
+    # The gevent worker monkey patches the standard library as it starts, see preload_app.
+    # PyMySQL is pure Python over the patched socket module, so queries yield to other greenlets.
+    # The pool is shared by all the greenlets of a worker: size it for the queries running at
+    # once rather than for the requests, and fail a request waiting too long for a connection
+    os.environ.setdefault("DB_POOL_SIZE", "20")
+    os.environ.setdefault("DB_MAX_OVERFLOW", "10")
+    os.environ.setdefault("DB_POOL_TIMEOUT", "10")
+
 # Server socket
 bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
 
 # Worker processes
-# Recommended: (2 x $num_cores) + 1
-workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
-worker_class = "sync"
-threads = int(os.getenv("GUNICORN_THREADS", 2))
+if worker_class == "gevent":
+    # One per core is enough when each serves worker_connections requests at once
+    workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+    worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 100))
+    threads = 1
+else:
+    # Recommended: (2 x $num_cores) + 1
+    workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+    threads = int(os.getenv("GUNICORN_THREADS", 2))
 
 # Logging
 accesslog = "-"
@@ -28,7 +45,29 @@ proc_name = "birthday_buddy"
 timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
 
 # Server mechanics
-preload_app = True
+# Not with gevent: the app, its locks and its database pools must be created after the worker
+# has monkey patched, or they stay blocking. Each worker imports the app itself instead.
+preload_app = worker_class != "gevent"
+
+# Database connections each worker opens right after forking, so its first requests don't pay for them
+db_warm_connections = int(os.getenv("GUNICORN_DB_WARM_CONNECTIONS", 5 if worker_class == "gevent" else threads))
+
+def post_fork(server, worker):
+    # With preload_app the app, and its connection pools, are created in the master:
+    # drop the inherited connections so workers don't share sockets, then warm up fresh ones
+    if not preload_app:
+        return
+    from app import reset_pools_after_fork
+    reset_pools_after_fork(db_warm_connections)
+    server.log.info(f"Worker {worker.pid}: database pools reset, {db_warm_connections} connections warmed")
+
+def post_worker_init(worker):
+    # Without preload_app the worker has just imported the app, once patched: only warm up
+    if preload_app:
+        return
+    from app import reset_pools_after_fork
+    reset_pools_after_fork(db_warm_connections)
+    worker.log.info(f"Worker {worker.pid}: {db_warm_connections} database connections warmed")
 
 # Security
 limit_request_line = 4096
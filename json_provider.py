@@ -0,0 +1,101 @@
+"""
+JSON Provider Module
+
+A Flask JSON provider serializing with orjson when it's installed, and with
+the stdlib json module otherwise. Both write date and datetime values as ISO
+8601 strings, so views can put them in responses as they are instead of
+formatting every field with strftime.
+
+Large arrays can be streamed in chunks with stream_json(), so a response
+doesn't need the whole serialized body in memory at once.
+"""
+
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+def _default(o):
+    if isinstance(o, (date, datetime)):
+        return o.isoformat()
+    if isinstance(o, Decimal):
+        return str(o)
+    return DefaultJSONProvider.default(o)
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider using orjson if available, with dates as YYYY-MM-DD
+    """
+    default = staticmethod(_default)
+
+    @property
+    def backend(self):
+        return 'orjson' if orjson is not None else 'json'
+
+    def dumps_bytes(self, obj, **kwargs):
+        """
+        Serialize obj to compact UTF-8 encoded bytes
+        """
+        if orjson is not None and not kwargs:
+            option = orjson.OPT_NON_STR_KEYS
+            if self.sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            return orjson.dumps(obj, default=self.default, option=option)
+        kwargs.setdefault('separators', (',', ':'))
+        return self.dumps(obj, **kwargs).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return self.dumps_bytes(obj).decode('utf-8')
+        kwargs.setdefault('default', self.default)
+        kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+        kwargs.setdefault('sort_keys', self.sort_keys)
+        return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        # The pretty-printed debug output needs the stdlib encoder
+        if self.compact is False or self.compact is None and self._app.debug:
+            return super().response(obj)
+        return self._app.response_class(self.dumps_bytes(obj) + b'\n', mimetype=self.mimetype)
+
+    def stream(self, fields, key, items, chunk_size=1000):
+        """
+        Yield the JSON object of fields with the items iterable under key, in chunks of chunk_size items
+        """
+        # The fields, then the array as the last member, opened before the items arrive
+        head = self.dumps_bytes(dict(fields))[:-1]
+        yield head + (b',' if fields else b'') + self.dumps_bytes(key) + b':['
+
+        chunk = []
+        first = True
+        for item in items:
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                yield (b'' if first else b',') + self.dumps_bytes(chunk)[1:-1]
+                chunk = []
+                first = False
+        if chunk:
+            yield (b'' if first else b',') + self.dumps_bytes(chunk)[1:-1]
+        yield b']}\n'
+
+def stream_json(app, fields, key, items, chunk_size=1000):
+    """
+    Return a streamed JSON response of fields with the items iterable under key
+    """
+    return Response(
+        stream_with_context(app.json.stream(fields, key, items, chunk_size)),
+        mimetype=app.json.mimetype
+    )
@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+"""
+Load Test Script
+
+Drives a running Birthday Buddy instance with authenticated virtual users and
+reports throughput and p50/p95/p99 latency per route. Uses the standard
+library only: each virtual user is a thread with its own keep-alive connection.
+
+Test users (loadtest_user_N) with birthdays and notification history are
+seeded in the configured database first, and are authenticated either by
+minting JWT cookies directly or through /signup and /login. The mix of
+requests is weighted like real traffic: mostly page and API reads, with some
+adds and logins.
+
+    # Against a running server
+    python loadtest.py --url http://127.0.0.1:5000 --users 50 --duration 30
+
+    # Start gunicorn for each workers x threads setting in turn and compare them
+    python loadtest.py --gunicorn 2x1,2x4,4x2 --duration 30
+
+    # Compare the sync profile with the gevent one (see gunicorn_config.py)
+    python loadtest.py --gunicorn 4x2,4xgevent --users 200 --duration 30
+
+For development and testing purposes only, the seeded users are removed with --cleanup.
+"""
+
+import os
+import sys
+import math
+import time
+import random
+import argparse
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlencode, urlsplit
+from collections import defaultdict
+from datetime import date, timedelta
+from dotenv import load_dotenv
+
+# Add the current directory to the path so that we can import app modules
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Load environment variables
+load_dotenv()
+
+# Import app after setting up environment
+from app import app, db, User, Birthday, BirthdayChange, BirthdayNotification, UserActivity, UserDataVersion
+from flask_jwt_extended import create_access_token
+from passlib.hash import pbkdf2_sha256
+
+USERNAME_PREFIX = 'loadtest_user_'
+PASSWORD = 'loadtest-password'
+
+# (name, weight): how often each route is hit relative to the others
+DEFAULT_MIX = [
+    ('GET /', 30),
+    ('GET /api/upcoming_birthdays', 35),
+    ('GET /notification_history', 15),
+    ('POST /add', 10),
+    ('POST /login', 10),
+]
+
+def seed_users(count, birthdays_per_user, notifications_per_user):
+    """
+    Create the load test users with random birthdays and notifications, returning [(id, username)]
+    """
+    usernames = [f'{USERNAME_PREFIX}{i}' for i in range(count)]
+    existing = {row.username for row in db.session.query(User.username).filter(User.username.in_(usernames))}
+    missing = [username for username in usernames if username not in existing]
+    if missing:
+        # One hash for everybody, login still verifies it at full cost
+        password_hash = pbkdf2_sha256.hash(PASSWORD)
+        db.session.execute(User.__table__.insert(), [
+            {'username': username, 'email': f'{username}@example.com', 'password_hash': password_hash}
+            for username in missing
+        ])
+        db.session.commit()
+
+    users = db.session.query(User.id, User.username).filter(User.username.in_(usernames)).all()
+
+    rng = random.Random(42)
+    today = date.today()
+    for user_id, _ in users:
+        if Birthday.query.filter_by(user_id=user_id).count():
+            continue
+        db.session.execute(Birthday.__table__.insert(), [
+            {
+                'name': f'Friend {i}',
+                'date': date(1950, 1, 1) + timedelta(days=rng.randrange(25000)),
+                'notes': 'Seeded by loadtest.py' if i % 4 == 0 else None,
+                'user_id': user_id
+            }
+            for i in range(birthdays_per_user)
+        ])
+        birthday_ids = [row.id for row in db.session.query(Birthday.id).filter_by(user_id=user_id).limit(notifications_per_user)]
+        if birthday_ids:
+            db.session.execute(BirthdayNotification.__table__.insert(), [
+                {
+                    'birthday_id': birthday_id,
+                    'user_id': user_id,
+                    'notification_date': today - timedelta(days=rng.randrange(365)),
+                    'year_notified': today.year
+                }
+                for birthday_id in birthday_ids
+            ])
+        db.session.commit()
+    return users
+
+def cleanup_users():
+    """
+    Remove the load test users and everything they own
+    """
+    user_ids = [row.id for row in db.session.query(User.id).filter(User.username.like(f'{USERNAME_PREFIX}%'))]
+    if not user_ids:
+        return 0
+    BirthdayNotification.query.filter(BirthdayNotification.user_id.in_(user_ids)).delete(synchronize_session=False)
+    Birthday.query.filter(Birthday.user_id.in_(user_ids)).delete(synchronize_session=False)
+    UserDataVersion.query.filter(UserDataVersion.user_id.in_(user_ids)).delete(synchronize_session=False)
+    BirthdayChange.query.filter(BirthdayChange.user_id.in_(user_ids)).delete(synchronize_session=False)
+    UserActivity.query.filter(UserActivity.user_id.in_(user_ids)).delete(synchronize_session=False)
+    User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+    db.session.commit()
+    return len(user_ids)
+
+class VirtualUser:
+    """
+    One simulated user with its own connection and cookies
+    """
+    def __init__(self, url, username):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.username = username
+        self.cookies = {}
+        self.connection = None
+
+    def request(self, method, path, form=None):
+        """
+        Send a request and read the whole response, returning the status code
+        """
+        headers = {'Accept-Encoding': 'gzip'}
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed the keep-alive connection, reconnect once
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+
+        for header, value in response.getheaders():
+            if header.lower() == 'set-cookie':
+                name, _, rest = value.partition('=')
+                self.cookies[name] = rest.split(';', 1)[0]
+        if response.getheader('Connection', '').lower() == 'close':
+            self.connection.close()
+            self.connection = None
+        return response.status
+
+    def signup(self):
+        return self.request('POST', '/signup', {
+            'username': self.username,
+            'email': f'{self.username}@example.com',
+            'password': PASSWORD,
+            'password_confirm': PASSWORD
+        })
+
+    def login(self):
+        return self.request('POST', '/login', {'username': self.username, 'password': PASSWORD})
+
+    def run(self, name, rng):
+        """
+        Run one request of the mix, returning (status, ok)
+        """
+        if name == 'POST /add':
+            birth_date = date(1950, 1, 1) + timedelta(days=rng.randrange(25000))
+            status = self.request('POST', '/add', {'name': 'Load test friend', 'date': birth_date.isoformat(), 'notes': ''})
+            return status, status == 302
+        if name == 'POST /login':
+            status = self.login()
+            return status, status == 302
+        method, path = name.split(' ', 1)
+        status = self.request(method, path)
+        return status, status == 200
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def run_scenario(url, users, mix, duration, warmup, seed=0):
+    """
+    Run the virtual users against url for duration seconds after warmup seconds,
+    returning (per-route {name: [latencies]}, per-route error counts, measured seconds)
+    """
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    started = time.monotonic()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    def worker(user, index):
+        rng = random.Random(seed * 100003 + index)
+        local_latencies = defaultdict(list)
+        local_errors = defaultdict(int)
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                break
+            name = rng.choices(names, weights)[0]
+            request_started = time.perf_counter()
+            try:
+                _, ok = user.run(name, rng)
+            except (OSError, http.client.HTTPException):
+                ok = False
+            elapsed = time.perf_counter() - request_started
+            if now >= measure_from:
+                local_latencies[name].append(elapsed)
+                if not ok:
+                    local_errors[name] += 1
+        with lock:
+            for name, values in local_latencies.items():
+                latencies[name].extend(values)
+            for name, count in local_errors.items():
+                errors[name] += count
+
+    threads = [threading.Thread(target=worker, args=(user, index), daemon=True) for index, user in enumerate(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, duration
+
+def report(latencies, errors, seconds, label=None):
+    """
+    Print throughput and latency percentiles per route, returning the totals
+    """
+    if label:
+        print(f"\n{label}")
+    print(f"{'route':<32} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    everything = []
+    for name in sorted(latencies):
+        values = sorted(latencies[name])
+        everything.extend(values)
+        print(
+            f"{name:<32} {len(values):>9} {errors[name]:>7} {len(values) / seconds:>8.1f} "
+            f"{percentile(values, 0.50) * 1000:>8.1f} {percentile(values, 0.95) * 1000:>8.1f} "
+            f"{percentile(values, 0.99) * 1000:>8.1f} {values[-1] * 1000:>8.1f}"
+        )
+    everything.sort()
+    total = {
+        'requests': len(everything),
+        'errors': sum(errors.values()),
+        'rps': len(everything) / seconds,
+        'p50': percentile(everything, 0.50),
+        'p95': percentile(everything, 0.95),
+        'p99': percentile(everything, 0.99),
+    }
+    print(
+        f"{'all':<32} {total['requests']:>9} {total['errors']:>7} {total['rps']:>8.1f} "
+        f"{total['p50'] * 1000:>8.1f} {total['p95'] * 1000:>8.1f} {total['p99'] * 1000:>8.1f}"
+    )
+    return total
+
+def start_gunicorn(bind, workers, threads, timeout=60):
+    """
+    Start gunicorn with the repo's configuration and wait until it answers.
+    threads is a number of threads per sync worker, or 'gevent' for the gevent profile.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, GUNICORN_BIND=bind, GUNICORN_WORKERS=str(workers), GUNICORN_LOG_LEVEL='warning')
+    if threads == 'gevent':
+        env['GUNICORN_WORKER_CLASS'] = 'gevent'
+    else:
+        env.update(GUNICORN_WORKER_CLASS='sync', GUNICORN_THREADS=str(threads))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py', '--access-logfile', '/dev/null', 'wsgi:app'],
+        cwd=directory, env=env
+    )
+    host, port = bind.rsplit(':', 1)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+        try:
+            connection = http.client.HTTPConnection(host, int(port), timeout=2)
+            connection.request('GET', '/login')
+            connection.getresponse().read()
+            connection.close()
+            return process
+        except OSError:
+            time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError(f"gunicorn didn't answer on {bind} within {timeout}s")
+
+def stop_gunicorn(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def prepare_users(url, seeded, auth):
+    """
+    Build and authenticate the virtual users
+    """
+    users = [VirtualUser(url, username) for _, username in seeded]
+    if auth == 'mint':
+        with app.app_context():
+            for user, (user_id, _) in zip(users, seeded):
+                user.cookies['access_token_cookie'] = create_access_token(identity=str(user_id))
+    else:
+        for user in users:
+            status = user.login()
+            if status != 302:
+                raise RuntimeError(f"Login of {user.username} failed with status {status}")
+    return users
+
+def parse_gunicorn_settings(value):
+    """
+    Parse WORKERSxTHREADS[,WORKERSxTHREADS...], with THREADS a number or "gevent"
+    """
+    settings = []
+    for item in value.split(','):
+        try:
+            workers, threads = item.lower().split('x')
+            settings.append((int(workers), threads if threads == 'gevent' else int(threads)))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"expected WORKERSxTHREADS or WORKERSxgevent, got {item!r}")
+    return settings
+
+def parse_mix(value):
+    """
+    Parse ROUTE=WEIGHT[,ROUTE=WEIGHT...], e.g. "GET /=3,POST /add=1"
+    """
+    mix = []
+    known = {name for name, _ in DEFAULT_MIX}
+    for item in value.split(','):
+        name, _, weight = item.rpartition('=')
+        if name not in known or not weight.isdigit():
+            raise argparse.ArgumentTypeError(f"expected ROUTE=WEIGHT with ROUTE one of {', '.join(sorted(known))}, got {item!r}")
+        mix.append((name, int(weight)))
+    return mix
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='Birthday Buddy load test')
+    parser.add_argument('--url', default='http://127.0.0.1:5000',
+                        help='Base URL of a running server (default: http://127.0.0.1:5000)')
+    parser.add_argument('--gunicorn', type=parse_gunicorn_settings,
+                        help='Start gunicorn on --url for each WORKERSxTHREADS setting, e.g. 2x1,2x4,4xgevent')
+    parser.add_argument('--users', type=int, default=20,
+                        help='Concurrent virtual users (default: 20)')
+    parser.add_argument('--birthdays', type=int, default=200,
+                        help='Birthdays seeded per user (default: 200)')
+    parser.add_argument('--notifications', type=int, default=20,
+                        help='Notifications seeded per user (default: 20)')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='Measured seconds per run (default: 30)')
+    parser.add_argument('--warmup', type=float, default=5,
+                        help='Unmeasured seconds before each run (default: 5)')
+    parser.add_argument('--auth', choices=['mint', 'login', 'signup'], default='mint',
+                        help='Mint JWT cookies directly, log the seeded users in, or sign up new users (default: mint)')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='Route weights, e.g. "GET /=30,GET /api/upcoming_birthdays=35,POST /add=10"')
+    parser.add_argument('--cleanup', action='store_true',
+                        help='Remove the load test users afterwards')
+    return parser.parse_args()
+
+def main():
+    """
+    Main function
+    """
+    args = parse_arguments()
+
+    with app.app_context():
+        if args.auth == 'signup':
+            # Fresh users created through the app, they get birthdays from the POST /add requests
+            suffix = int(time.time())
+            seeded = [(None, f'{USERNAME_PREFIX}{suffix}_{i}') for i in range(args.users)]
+        else:
+            print(f"Seeding {args.users} users with {args.birthdays} birthdays and {args.notifications} notifications each...")
+            seeded = seed_users(args.users, args.birthdays, args.notifications)
+
+    settings = args.gunicorn or [None]
+    bind = urlsplit(args.url).netloc
+    summary = []
+    try:
+        for index, setting in enumerate(settings):
+            process = start_gunicorn(bind, *setting) if setting else None
+            try:
+                if args.auth == 'signup' and index == 0:
+                    for _, username in seeded:
+                        status = VirtualUser(args.url, username).signup()
+                        if status != 302:
+                            raise RuntimeError(f"Signup of {username} failed with status {status}")
+                users = prepare_users(args.url, seeded, 'login' if args.auth == 'signup' else args.auth)
+                if not setting:
+                    label = args.url
+                elif setting[1] == 'gevent':
+                    label = f"GUNICORN_WORKERS={setting[0]} GUNICORN_WORKER_CLASS=gevent"
+                else:
+                    label = f"GUNICORN_WORKERS={setting[0]} GUNICORN_THREADS={setting[1]}"
+                print(f"\nRunning {args.users} users for {args.duration:.0f}s against {label}...")
+                latencies, errors, seconds = run_scenario(args.url, users, args.mix, args.duration, args.warmup, seed=index)
+                summary.append((label, report(latencies, errors, seconds, label)))
+            finally:
+                if process is not None:
+                    stop_gunicorn(process)
+    finally:
+        if args.cleanup:
+            with app.app_context():
+                print(f"\nRemoved {cleanup_users()} load test users")
+
+    if len(summary) > 1:
+        print(f"\n{'setting':<44} {'req/s':>8} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for label, total in summary:
+            print(
+                f"{label:<44} {total['rps']:>8.1f} {total['errors']:>7} {total['p50'] * 1000:>8.1f} "
+                f"{total['p95'] * 1000:>8.1f} {total['p99'] * 1000:>8.1f}"
+            )
+
+    print("\nLoad test completed.")
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,37 @@
-import pymysql
 import os
-from app import app, db, User, Birthday
-from datetime import datetime
-from passlib.hash import pbkdf2_sha256
+import sys
+import argparse
+import logging
+from app import app, db, MigrationCheckpoint
+from migrations import MIGRATIONS, run_migrations
 from sqlalchemy import inspect
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-print("Starting data migration for MySQL database...")
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-# Get environment variables
-db_name = os.environ.get('DB_NAME')
-host_uri = os.environ.get('DATABASE_URI')
-password = os.environ.get('PASSWORD')
-username = os.environ.get('USERNAME')
-db_port = os.environ.get('DB_PORT', "26323")
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='Run the data migrations in chunks, resuming where the last run stopped')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Show what each migration would change without changing anything')
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                        help='Primary key values per UPDATE (default: 1000)')
+    parser.add_argument('--sleep', type=float, default=0.1,
+                        help='Seconds to pause between chunks (default: 0.1)')
+    parser.add_argument('--only', choices=[migration.name for migration in MIGRATIONS], action='append',
+                        help='Only run the given migration (can be repeated)')
+    parser.add_argument('--status', action='store_true',
+                        help='Show the checkpoint of every migration and exit')
+    parser.add_argument('--restart', choices=[migration.name for migration in MIGRATIONS], action='append',
+                        help='Forget the checkpoint of a migration so it runs from the start again')
+    return parser.parse_args()
 
-# Setup MySQL connection
-connection = pymysql.connect(
-    charset="utf8mb4",
-    connect_timeout=10,
-    cursorclass=pymysql.cursors.DictCursor,
-    db=db_name,
-    host=host_uri,
-    password=password,
-    read_timeout=10,
-    port=db_port,
-    user=username,
-    write_timeout=10,
-)
+args = parse_arguments()
+
+print("Starting data migration...")
 
 with app.app_context():
     # Check if tables exist in the database
@@ -39,44 +40,41 @@ with app.app_context():
     
     if 'user' not in tables or 'birthday' not in tables:
         print("Required tables don't exist yet. Please run the application first to create tables.")
-        exit(0)
+        sys.exit(0)
+    
+    # The checkpoint table may be newer than the database
+    MigrationCheckpoint.__table__.create(db.engine, checkfirst=True)
+    
+    if args.status:
+        for migration in MIGRATIONS:
+            checkpoint = db.session.get(MigrationCheckpoint, migration.name)
+            if checkpoint is not None and checkpoint.completed_at:
+                print(f"{migration.name}: completed on {checkpoint.completed_at}, {checkpoint.rows_changed} changed")
+            elif checkpoint is not None and checkpoint.last_id:
+                print(f"{migration.name}: in progress up to id {checkpoint.last_id}, {checkpoint.rows_changed} changed, {migration.pending()} pending")
+            else:
+                print(f"{migration.name}: {migration.pending()} pending")
+        sys.exit(0)
     
-    # Check if we already have the user table and user_id column in birthday table
+    for name in args.restart or []:
+        MigrationCheckpoint.query.filter_by(name=name).delete()
+        db.session.commit()
+        print(f"Checkpoint of {name} cleared.")
+    
+    migrations = [migration for migration in MIGRATIONS if not args.only or migration.name in args.only]
     try:
-        # Try to count users
-        user_count = User.query.count()
-        print(f"Found {user_count} users in the database.")
-        
-        # Check if there are birthdays without a user_id
-        orphan_birthdays = Birthday.query.filter_by(user_id=None).count()
-        print(f"Found {orphan_birthdays} birthdays without a user_id.")
-        
-        if orphan_birthdays > 0:
-            # Create a default admin user if needed
-            admin_user = User.query.filter_by(username='admin').first()
-            if not admin_user:
-                print("Creating default admin user...")
-                admin_user = User(
-                    username='admin',
-                    email='admin@example.com',
-                    created_at=datetime.utcnow()
-                )
-                admin_user.set_password('password123')  # Default password, should be changed
-                db.session.add(admin_user)
-                db.session.commit()
-                print("Default admin user created with username 'admin' and password 'password123'")
-            
-            # Assign orphaned birthdays to the admin user
-            print(f"Assigning {orphan_birthdays} birthdays to admin user...")
-            for birthday in Birthday.query.filter_by(user_id=None).all():
-                birthday.user_id = admin_user.id
-            
-            db.session.commit()
-            print("Done! All birthdays have been assigned to the admin user.")
-        
+        results = run_migrations(migrations, chunk_size=args.chunk_size, sleep=args.sleep, dry_run=args.dry_run)
     except Exception as e:
+        db.session.rollback()
         print(f"Error during migration: {str(e)}")
-        print("You may need to run reset_db.py to reset the database with the new schema.")
+        print("Completed chunks are checkpointed, run this script again to resume.")
+        sys.exit(1)
+    
+    for name, changed in results.items():
+        print(f"{name}: {changed} changed")
 
-print("\nMigration complete. You can now run the application with the new schema.")
-print("If you created a default admin user, remember to change the password after login!") 
\ No newline at end of file
+if args.dry_run:
+    print("\nDry run complete, nothing was changed.")
+else:
+    print("\nMigration complete. You can now run the application with the new schema.")
+    print("If a default admin user was created, remember to change the password after login!")
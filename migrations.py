@@ -0,0 +1,313 @@
+"""
+Migrations Module
+
+Online data migrations run in bounded chunks instead of one transaction over
+the whole table. A ChunkedUpdate walks the primary key range and runs one
+set-based UPDATE ... WHERE id BETWEEN lo AND hi per chunk, each in its own
+short transaction which also records the last id done in the
+migration_checkpoint table: an interrupted run resumes after the last chunk
+committed. A pause between chunks leaves room for the application's queries.
+
+Schema changes follow the same pattern: CreateColumns and CreateIndexes
+create the columns and indexes declared on the models that are missing from
+the database, one short statement at a time (online DDL on MySQL), and are
+checkpointed too.
+
+Rows inserted after a migration started aren't visited, so the
+application must already write new rows in the migrated shape.
+"""
+
+import time
+import logging
+from datetime import datetime
+
+from sqlalchemy import func, inspect, select, text
+
+from app import db, User, Birthday, MigrationCheckpoint, LEGACY_DATA_VERSION_KEY, bump_data_version
+
+logger = logging.getLogger('migrations')
+
+def get_checkpoint(name):
+    """
+    Return the checkpoint of a migration, creating it if needed (the caller commits)
+    """
+    checkpoint = db.session.get(MigrationCheckpoint, name)
+    if checkpoint is None:
+        checkpoint = MigrationCheckpoint(name=name, last_id=0, rows_changed=0)
+        db.session.add(checkpoint)
+    return checkpoint
+
+def mark_applied(migrations):
+    """
+    Record migrations as completed without running them, for a database created with the current schema
+    """
+    for migration in migrations:
+        checkpoint = get_checkpoint(migration.name)
+        checkpoint.completed_at = datetime.utcnow()
+    db.session.commit()
+
+class Progress:
+    """
+    Logs the progress and ETA of a migration over a known amount of work
+    """
+    def __init__(self, name, total):
+        self.name = name
+        self.total = total
+        self.started = time.monotonic()
+
+    def log(self, done, rows_changed):
+        elapsed = time.monotonic() - self.started
+        fraction = done / self.total if self.total else 1.0
+        eta = elapsed / fraction - elapsed if fraction else 0
+        logger.info(f"{self.name}: {fraction:.1%} done, {rows_changed} rows changed, ETA {eta:.0f}s")
+
+class ChunkedUpdate:
+    """
+    Set-based UPDATE of the rows of a table matching where, in chunks of primary key values.
+    values is a dict of column values, or a callable returning one when the migration starts.
+    after_chunk(values, rows_changed) runs in the transaction of each chunk that changed rows.
+    """
+    def __init__(self, name, table, values, where, description='', after_chunk=None):
+        self.name = name
+        self.table = table
+        self.values = values
+        self.where = where
+        self.description = description
+        self.after_chunk = after_chunk
+
+    def pending(self):
+        """
+        Return the number of rows still matching the migration
+        """
+        return db.session.execute(select(func.count()).select_from(self.table).where(self.where)).scalar()
+
+    def run(self, chunk_size=1000, sleep=0.1, dry_run=False):
+        """
+        Run (or resume) the migration, returning the number of rows changed by this run
+        """
+        checkpoint = get_checkpoint(self.name)
+        if checkpoint.completed_at is not None:
+            logger.info(f"{self.name}: already completed on {checkpoint.completed_at}")
+            db.session.rollback()
+            return 0
+
+        pk = self.table.c.id
+        min_id, max_id = db.session.execute(select(func.min(pk), func.max(pk)).select_from(self.table)).one()
+        start_id = max(checkpoint.last_id + 1, min_id or 0)
+
+        if dry_run:
+            pending = self.pending()
+            chunks = max(0, (max_id or 0) - start_id) // chunk_size + 1 if max_id is not None else 0
+            logger.info(f"{self.name}: would update {pending} rows from id {start_id} to {max_id} in up to {chunks} chunks of {chunk_size} ids")
+            db.session.rollback()
+            return 0
+
+        values = self.values() if callable(self.values) else self.values
+        db.session.commit()
+
+        if max_id is None or start_id > max_id:
+            checkpoint.completed_at = datetime.utcnow()
+            db.session.commit()
+            logger.info(f"{self.name}: nothing to do")
+            return 0
+
+        logger.info(f"{self.name}: {self.description or 'updating'} from id {start_id} to {max_id}, resuming at row {checkpoint.rows_changed}")
+        progress = Progress(self.name, max_id - start_id + 1)
+        changed = 0
+        lo = start_id
+        while lo <= max_id:
+            hi = min(lo + chunk_size - 1, max_id)
+            result = db.session.execute(
+                self.table.update().where(pk.between(lo, hi), self.where).values(**values)
+            )
+            if result.rowcount and self.after_chunk is not None:
+                self.after_chunk(values, result.rowcount)
+            changed += result.rowcount
+            checkpoint.last_id = hi
+            checkpoint.rows_changed += result.rowcount
+            db.session.commit()
+
+            progress.log(hi - start_id + 1, checkpoint.rows_changed)
+            lo = hi + 1
+            if lo <= max_id:
+                time.sleep(sleep)
+
+        checkpoint.completed_at = datetime.utcnow()
+        db.session.commit()
+        return changed
+
+class CreateIndexes:
+    """
+    Create the indexes declared on the given tables that are missing from the database.
+    It's never marked completed: indexes declared later are picked up by the next run.
+    """
+    def __init__(self, name, tables, description=''):
+        self.name = name
+        self.tables = tables
+        self.description = description
+
+    def missing(self):
+        """
+        Return the declared indexes that don't exist in the database
+        """
+        inspector = inspect(db.engine)
+        existing_tables = set(inspector.get_table_names())
+        missing = []
+        for table in self.tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {index['name'] for index in inspector.get_indexes(table.name)}
+            missing.extend(index for index in sorted(table.indexes, key=lambda index: index.name) if index.name not in existing)
+        return missing
+
+    def pending(self):
+        return len(self.missing())
+
+    def run(self, chunk_size=None, sleep=0.1, dry_run=False):
+        """
+        Create each missing index, returning the number created
+        """
+        missing = self.missing()
+        if dry_run:
+            for index in missing:
+                logger.info(f"{self.name}: would create index {index.name} on {index.table.name} ({', '.join(column.name for column in index.columns)})")
+            return 0
+
+        progress = Progress(self.name, len(missing))
+        for count, index in enumerate(missing, 1):
+            if db.engine.dialect.name == 'mysql':
+                # Online DDL: the table stays readable and writable while the index is built
+                columns = ', '.join(f'`{column.name}`' for column in index.columns)
+                db.session.execute(text(
+                    f"ALTER TABLE `{index.table.name}` ADD INDEX `{index.name}` ({columns}), ALGORITHM=INPLACE, LOCK=NONE"
+                ))
+            else:
+                index.create(db.session.connection())
+            db.session.commit()
+            logger.info(f"{self.name}: created index {index.name} on {index.table.name}")
+            progress.log(count, count)
+            if count < len(missing):
+                time.sleep(sleep)
+
+        checkpoint = get_checkpoint(self.name)
+        checkpoint.rows_changed += len(missing)
+        checkpoint.updated_at = datetime.utcnow()
+        db.session.commit()
+        return len(missing)
+
+class CreateColumns:
+    """
+    Add the columns declared on the given tables that are missing from the database.
+    New NOT NULL columns need a server_default to fill the existing rows.
+    It's never marked completed: columns declared later are picked up by the next run.
+    """
+    def __init__(self, name, tables, description=''):
+        self.name = name
+        self.tables = tables
+        self.description = description
+
+    def missing(self):
+        """
+        Return the declared columns that don't exist in the database
+        """
+        inspector = inspect(db.engine)
+        existing_tables = set(inspector.get_table_names())
+        missing = []
+        for table in self.tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            missing.extend(column for column in table.columns if column.name not in existing)
+        return missing
+
+    def pending(self):
+        return len(self.missing())
+
+    def ddl(self, column):
+        dialect = db.engine.dialect
+        preparer = dialect.identifier_preparer
+        definition = f"{preparer.quote(column.name)} {column.type.compile(dialect=dialect)}"
+        if column.server_default is not None:
+            definition += f" DEFAULT {column.server_default.arg}"
+        if not column.nullable:
+            if column.server_default is None:
+                raise ValueError(f"{column.table.name}.{column.name} is NOT NULL without a server_default, it can't be added to existing rows")
+            definition += " NOT NULL"
+        return f"ALTER TABLE {preparer.quote(column.table.name)} ADD COLUMN {definition}"
+
+    def run(self, chunk_size=None, sleep=0.1, dry_run=False):
+        """
+        Add each missing column, returning the number added
+        """
+        missing = self.missing()
+        if dry_run:
+            for column in missing:
+                logger.info(f"{self.name}: would run {self.ddl(column)}")
+            return 0
+
+        progress = Progress(self.name, len(missing))
+        for count, column in enumerate(missing, 1):
+            db.session.execute(text(self.ddl(column)))
+            db.session.commit()
+            logger.info(f"{self.name}: added column {column.name} to {column.table.name}")
+            progress.log(count, count)
+            if count < len(missing):
+                time.sleep(sleep)
+
+        checkpoint = get_checkpoint(self.name)
+        checkpoint.rows_changed += len(missing)
+        checkpoint.updated_at = datetime.utcnow()
+        db.session.commit()
+        return len(missing)
+
+def run_migrations(migrations, chunk_size=1000, sleep=0.1, dry_run=False):
+    """
+    Run migrations in order, returning {name: rows or indexes changed}
+    """
+    results = {}
+    for migration in migrations:
+        started = time.monotonic()
+        results[migration.name] = migration.run(chunk_size=chunk_size, sleep=sleep, dry_run=dry_run)
+        if not dry_run:
+            logger.info(f"{migration.name}: finished in {time.monotonic() - started:.1f}s")
+    return results
+
+def get_admin_user():
+    """
+    Return the admin user, creating it with a default password if needed
+    """
+    admin_user = User.query.filter_by(username='admin').first()
+    if not admin_user:
+        admin_user = User(username='admin', email='admin@example.com', created_at=datetime.utcnow())
+        admin_user.set_password('password123')  # Default password, should be changed
+        db.session.add(admin_user)
+        db.session.commit()
+        logger.warning("Default admin user created with username 'admin' and password 'password123', change it after login!")
+    return admin_user
+
+def bump_orphan_versions(values, rows_changed):
+    # The rows leave every user's view of the legacy birthdays and join the admin's own
+    bump_data_version(LEGACY_DATA_VERSION_KEY)
+    bump_data_version(values['user_id'])
+
+# Every migration, in the order they run
+MIGRATIONS = [
+    CreateColumns(
+        'create_model_columns',
+        db.metadata.sorted_tables,
+        description='adding the columns declared on the models'
+    ),
+    CreateIndexes(
+        'create_model_indexes',
+        db.metadata.sorted_tables,
+        description='creating the indexes declared on the models'
+    ),
+    ChunkedUpdate(
+        'assign_orphan_birthdays',
+        Birthday.__table__,
+        values=lambda: {'user_id': get_admin_user().id},
+        where=Birthday.__table__.c.user_id.is_(None),
+        description='assigning birthdays without a user_id to the admin user',
+        after_chunk=bump_orphan_versions
+    ),
+]
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+"""
+Notification Runs Script
+
+Every notifier run records a NotificationRun row: start and end times, time
+spent per stage (candidate query, dedupe, render, send, record), counts
+(users scanned, reminders found and skipped, emails sent, failed and spooled) and the
+latency distribution and request body bytes of the email API calls. Stage times are busy time summed
+over the stage's worker threads, so they can add up to more than the run's
+duration. The notifier collects them with
+RunTelemetry and prints the same data as a JSON summary on stdout.
+
+This script shows the recent runs and how their cost per user evolves, so
+regressions as data grows are visible:
+
+    python notification_runs.py --limit 30
+    python notification_runs.py --json
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import threading
+from datetime import datetime
+from dotenv import load_dotenv
+
+# Add the current directory to the path so that we can import app modules
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Load environment variables
+load_dotenv()
+
+# Import app after setting up environment
+from app import app, db, NotificationRun
+
+STAGES = ['candidate', 'dedupe', 'render', 'send', 'record']
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list, None if it's empty
+    """
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))]
+
+class RunTelemetry:
+    """
+    Thread-safe counters, stage timers and email latencies of a notifier run
+    """
+    def __init__(self, run_date, shard=0, shard_count=1):
+        self.run_date = run_date
+        self.shard = shard
+        self.shard_count = shard_count
+        self.started_at = datetime.utcnow()
+        self.finished_at = None
+        self.status = 'running'
+        self.counts = dict.fromkeys(['users_scanned', 'reminders_found', 'reminders_skipped', 'emails_sent', 'emails_failed', 'emails_spooled', 'email_bytes_sent'], 0)
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.email_latencies = []
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counts[name] += value
+
+    def add_time(self, stage, seconds):
+        with self._lock:
+            self.seconds[stage] += seconds
+
+    def timed(self, stage, func):
+        """
+        Return func with its calls timed under stage
+        """
+        def timed_call(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add_time(stage, time.perf_counter() - started)
+        return timed_call
+
+    def timed_iterable(self, stage, iterable):
+        """
+        Return an iterator over iterable with the production of each item timed under stage
+        """
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(stage, time.perf_counter() - started)
+                return
+            self.add_time(stage, time.perf_counter() - started)
+            yield item
+
+    def email_sent(self, seconds, ok):
+        """
+        Record one email API call
+        """
+        with self._lock:
+            self.email_latencies.append(seconds)
+            self.counts['emails_sent' if ok else 'emails_failed'] += 1
+
+    def finish(self, status):
+        self.status = status
+        self.finished_at = datetime.utcnow()
+
+    def latency_ms(self):
+        """
+        Return the p50/p95/p99/max email API latencies in milliseconds
+        """
+        with self._lock:
+            latencies = sorted(self.email_latencies)
+        def ms(value):
+            return None if value is None else round(value * 1000, 3)
+        return {
+            'p50': ms(percentile(latencies, 0.50)),
+            'p95': ms(percentile(latencies, 0.95)),
+            'p99': ms(percentile(latencies, 0.99)),
+            'max': ms(latencies[-1] if latencies else None),
+        }
+
+    def summary(self):
+        """
+        Return the run as a JSON-serializable dict
+        """
+        finished_at = self.finished_at or datetime.utcnow()
+        return {
+            'started_at': self.started_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'duration_seconds': round((finished_at - self.started_at).total_seconds(), 3),
+            'status': self.status,
+            'run_date': self.run_date.isoformat(),
+            'shard': f"{self.shard}/{self.shard_count}",
+            'counts': dict(self.counts),
+            'stage_seconds': {stage: round(seconds, 3) for stage, seconds in self.seconds.items()},
+            'email_latency_ms': self.latency_ms(),
+        }
+
+    def save(self, run_id=None):
+        """
+        Insert or update the NotificationRun row of the run, returning its id
+        """
+        latency = self.latency_ms()
+        values = dict(
+            started_at=self.started_at,
+            finished_at=self.finished_at,
+            status=self.status,
+            run_date=self.run_date,
+            shard=self.shard,
+            shard_count=self.shard_count,
+            email_latency_p50_ms=latency['p50'],
+            email_latency_p95_ms=latency['p95'],
+            email_latency_p99_ms=latency['p99'],
+            email_latency_max_ms=latency['max'],
+            **self.counts,
+            **{f'{stage}_seconds': seconds for stage, seconds in self.seconds.items()}
+        )
+        with app.app_context():
+            run = db.session.get(NotificationRun, run_id) if run_id is not None else None
+            if run is None:
+                run = NotificationRun(**values)
+                db.session.add(run)
+            else:
+                for name, value in values.items():
+                    setattr(run, name, value)
+            db.session.commit()
+            return run.id
+
+def run_to_dict(run):
+    duration = (run.finished_at - run.started_at).total_seconds() if run.finished_at else None
+    return {
+        'id': run.id,
+        'started_at': run.started_at.isoformat(),
+        'duration_seconds': duration,
+        'status': run.status,
+        'run_date': run.run_date.isoformat(),
+        'shard': f"{run.shard}/{run.shard_count}",
+        'users_scanned': run.users_scanned,
+        'reminders_found': run.reminders_found,
+        'reminders_skipped': run.reminders_skipped,
+        'emails_sent': run.emails_sent,
+        'emails_failed': run.emails_failed,
+        'emails_spooled': run.emails_spooled,
+        'email_bytes_sent': run.email_bytes_sent,
+        'stage_seconds': {stage: getattr(run, f'{stage}_seconds') for stage in STAGES},
+        'email_latency_ms': {
+            'p50': run.email_latency_p50_ms,
+            'p95': run.email_latency_p95_ms,
+            'p99': run.email_latency_p99_ms,
+            'max': run.email_latency_max_ms,
+        },
+    }
+
+def per_user_ms(runs, stage):
+    """
+    Average milliseconds per scanned user spent in a stage over runs
+    """
+    users = sum(run.users_scanned for run in runs)
+    if not users:
+        return None
+    return sum(getattr(run, f'{stage}_seconds') for run in runs) * 1000 / users
+
+def print_trends(runs):
+    """
+    Print the runs and compare the cost per user of the newer half with the older half
+    """
+    print(f"{'id':>6} {'started (UTC)':<19} {'status':<10} {'shard':>5} {'users':>7} {'found':>7} {'skip':>6} "
+          f"{'sent':>6} {'fail':>5} {'spool':>5} {'B/mail':>7} {'secs':>8} " + ' '.join(f"{stage[:6]:>7}" for stage in STAGES) + f" {'p95 ms':>8}")
+    for run in runs:
+        duration = (run.finished_at - run.started_at).total_seconds() if run.finished_at else float('nan')
+        p95 = run.email_latency_p95_ms
+        mails = run.emails_sent + run.emails_failed
+        bytes_per_mail = run.email_bytes_sent / mails if mails else float('nan')
+        print(
+            f"{run.id:>6} {run.started_at:%Y-%m-%d %H:%M:%S} {run.status:<10} {run.shard}/{run.shard_count:<3} "
+            f"{run.users_scanned:>7} {run.reminders_found:>7} {run.reminders_skipped:>6} {run.emails_sent:>6} "
+            f"{run.emails_failed:>5} {run.emails_spooled:>5} {bytes_per_mail:>7.0f} {duration:>8.1f} "
+            + ' '.join(f"{getattr(run, f'{stage}_seconds'):>7.2f}" for stage in STAGES)
+            + f" {p95 if p95 is not None else float('nan'):>8.1f}"
+        )
+
+    measured = [run for run in runs if run.users_scanned]
+    if len(measured) < 4:
+        return
+    # runs are newest first
+    newer, older = measured[:len(measured) // 2], measured[len(measured) // 2:]
+    print("\nms per scanned user, older half -> newer half of these runs:")
+    for stage in STAGES:
+        before, after = per_user_ms(older, stage), per_user_ms(newer, stage)
+        change = f"{(after - before) / before:+.0%}" if before else 'n/a'
+        print(f"  {stage:<10} {before:>9.3f} -> {after:>9.3f}  ({change})")
+    users_before = sum(run.users_scanned for run in older) / len(older)
+    users_after = sum(run.users_scanned for run in newer) / len(newer)
+    print(f"  {'users/run':<10} {users_before:>9.0f} -> {users_after:>9.0f}")
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='Recent notifier runs and their trends')
+    parser.add_argument('--limit', type=int, default=20,
+                        help='Number of recent runs shown (default: 20)')
+    parser.add_argument('--shard', help='Only show runs of this shard, as INDEX/COUNT')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the runs as JSON instead of a table')
+    return parser.parse_args()
+
+def main():
+    """
+    Main function
+    """
+    args = parse_arguments()
+
+    with app.app_context():
+        NotificationRun.__table__.create(db.engine, checkfirst=True)
+        query = NotificationRun.query
+        if args.shard:
+            shard, _, shard_count = args.shard.partition('/')
+            query = query.filter_by(shard=int(shard), shard_count=int(shard_count or 1))
+        runs = query.order_by(NotificationRun.started_at.desc()).limit(args.limit).all()
+
+        if args.json:
+            print(json.dumps([run_to_dict(run) for run in runs], indent=2))
+        elif not runs:
+            print("No notifier runs recorded yet.")
+        else:
+            print_trends(runs)
+
+if __name__ == "__main__":
+    main()
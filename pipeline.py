@@ -0,0 +1,139 @@
+"""
+Pipeline Module
+
+Runs a chain of stages over a stream of items with bounded queues between them.
+Items reach the last stage while later ones are still being fetched, and memory
+stays proportional to the queue sizes rather than to the number of items.
+"""
+
+import logging
+import queue
+import threading
+import time
+from contextlib import nullcontext
+
+logger = logging.getLogger('pipeline')
+
+# Marks the end of the stream on a queue
+_DONE = object()
+
+class Stage:
+    """
+    A pipeline stage: func(item) returns the item passed to the next stage, or None to drop it
+    """
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.processed = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, item):
+        started = time.perf_counter()
+        try:
+            return self.func(item)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.processed += 1
+                self.seconds += elapsed
+
+class PipelineError(Exception):
+    """Raised when a stage fails, with the original exception as __cause__"""
+
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+def run_pipeline(source, stages, queue_size=100, context=None):
+    """
+    Feed the items of source through the stages and yield the output of the last stage.
+
+    Each stage runs in its own worker threads. context is an optional callable returning
+    a context manager entered by every thread (e.g. app.app_context), since the source
+    and stages may need one of their own.
+    """
+    stop = threading.Event()
+    errors = []
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    threads = []
+
+    def fail(name, exc):
+        logger.error(f"Pipeline stage {name} failed: {exc}")
+        errors.append((name, exc))
+        stop.set()
+
+    def feed():
+        with context() if context else nullcontext():
+            try:
+                for item in source:
+                    if not _put(queues[0], item, stop):
+                        return
+            except Exception as e:
+                fail('source', e)
+                return
+            _put(queues[0], _DONE, stop)
+
+    def work(stage, in_q, out_q, remaining, lock):
+        with context() if context else nullcontext():
+            while True:
+                item = _get(in_q, stop)
+                if item is _DONE:
+                    # Pass the marker on to the sibling workers, the last one out closes the stage
+                    _put(in_q, _DONE, stop)
+                    with lock:
+                        remaining[0] -= 1
+                        last = remaining[0] == 0
+                    if last:
+                        _put(out_q, _DONE, stop)
+                    return
+                try:
+                    result = stage(item)
+                except Exception as e:
+                    fail(stage.name, e)
+                    return
+                if result is not None and not _put(out_q, result, stop):
+                    return
+
+    threads.append(threading.Thread(target=feed, name='pipeline-source', daemon=True))
+    for position, stage in enumerate(stages):
+        remaining, lock = [stage.workers], threading.Lock()
+        for worker in range(stage.workers):
+            threads.append(threading.Thread(
+                target=work,
+                args=(stage, queues[position], queues[position + 1], remaining, lock),
+                name=f'pipeline-{stage.name}-{worker}',
+                daemon=True
+            ))
+
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = _get(queues[-1], stop)
+            if item is _DONE:
+                break
+            yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        name, exc = errors[0]
+        raise PipelineError(f"Pipeline stage {name} failed: {exc}") from exc
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""
+Upcoming Birthdays Precompute Script
+
+Every user's upcoming birthdays change at midnight, so the per-day caches of
+the web workers all go cold at once and the first morning requests would all
+recompute them together. Shortly before midnight this script computes the
+next day's upcoming birthdays of every recently active user (logged in within
+--active-days) in a single set-based pass, and stores them as UpcomingSnapshot
+rows together with the data versions they were read at.
+
+The snapshots of a day are published all at once by committing its
+UpcomingPublication row after the last of them. Workers read them from the
+day they're for: /api/upcoming_birthdays and the home page then load one row
+per user instead of computing. A snapshot whose user changed their birthdays
+since is ignored, as are users without one, and computed as before.
+
+    python precompute_upcoming.py                  # for tomorrow, run at ~23:30
+    python precompute_upcoming.py --day 2025-06-01 --dry-run
+"""
+
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta
+import logging
+from dotenv import load_dotenv
+
+# Add the current directory to the path so that we can import app modules
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('precompute_upcoming')
+
+# Load environment variables
+load_dotenv()
+
+# Import app after setting up environment
+from app import (
+    app, db, User, UserActivity, UserDataVersion, UpcomingSnapshot, UpcomingPublication, NotificationPeriod,
+    LEGACY_DATA_VERSION_KEY, get_legacy_birthday_rows, iter_birthdays_in_periods
+)
+from read_models import dump_upcoming, find_upcoming
+from sqlalchemy import select
+
+def merge_upcoming(birthdays, legacy):
+    """
+    Return a user's upcoming birthdays and the legacy ones in the order find_upcoming gives them:
+    by days until birthday, then by date since it reads the birthdays in date order
+    """
+    return sorted(birthdays + legacy, key=lambda birthday: (birthday.days_until, birthday.date))
+
+def precompute_upcoming(day, window_days=30, active_days=14, batch_size=1000, dry_run=False):
+    """
+    Compute and publish the upcoming birthdays on day of the users active in the last active_days,
+    returning the number of users
+    """
+    active_since = datetime.utcnow() - timedelta(days=active_days)
+    active = select(UserActivity.user_id).where(UserActivity.last_login_at >= active_since)
+    user_ids = db.session.execute(active).scalars().all()
+    logger.info(f"Precomputing the upcoming birthdays of {len(user_ids)} users active since {active_since:%Y-%m-%d} for {day}")
+    if dry_run or not user_ids:
+        db.session.commit()
+        return 0
+
+    started = time.monotonic()
+    # Versions first: anything written after them makes the snapshot stale rather than wrong
+    versions = dict(db.session.query(UserDataVersion.user_id, UserDataVersion.version).filter(
+        UserDataVersion.user_id.in_(active) | (UserDataVersion.user_id == LEGACY_DATA_VERSION_KEY)
+    ).all())
+    legacy_version = versions.get(LEGACY_DATA_VERSION_KEY, 0)
+    end_date = day + timedelta(days=window_days)
+    legacy = find_upcoming(get_legacy_birthday_rows(legacy_version), day, end_date)
+
+    # Unpublished while rewritten: meanwhile workers compute as if there were no snapshots
+    db.session.query(UpcomingPublication).filter(UpcomingPublication.day == day).delete()
+    db.session.query(UpcomingSnapshot).filter(UpcomingSnapshot.day == day).delete()
+    db.session.commit()
+
+    def snapshot(user_id, birthdays):
+        return {
+            'day': day,
+            'user_id': user_id,
+            'user_version': versions.get(user_id, 0),
+            'legacy_version': legacy_version,
+            'birthdays': dump_upcoming(merge_upcoming(birthdays, legacy))
+        }
+
+    rows = []
+    written = 0
+    def flush():
+        nonlocal rows, written
+        if rows:
+            db.session.execute(UpcomingSnapshot.__table__.insert(), rows)
+            db.session.commit()
+            written += len(rows)
+            rows = []
+
+    # One query for every active user's birthdays in the window, see iter_birthdays_in_periods
+    remaining = set(user_ids)
+    period = NotificationPeriod('daily', User.id.in_(active), day, end_date)
+    for user, birthdays in iter_birthdays_in_periods([period], day, batch_size=batch_size):
+        remaining.discard(user.id)
+        rows.append(snapshot(user.id, birthdays))
+        if len(rows) >= batch_size:
+            flush()
+    # Users without birthdays in the window still need their (empty, or legacy only) list
+    for user_id in sorted(remaining):
+        rows.append(snapshot(user_id, []))
+        if len(rows) >= batch_size:
+            flush()
+    flush()
+
+    db.session.add(UpcomingPublication(day=day, window_days=window_days, users=written))
+    db.session.commit()
+    logger.info(f"Published {written} upcoming birthday snapshots for {day} in {time.monotonic() - started:.1f}s")
+
+    # Snapshots of days gone by are never read again
+    today = datetime.now().date()
+    db.session.query(UpcomingPublication).filter(UpcomingPublication.day < today).delete()
+    expired = db.session.query(UpcomingSnapshot).filter(UpcomingSnapshot.day < today).delete()
+    db.session.commit()
+    if expired:
+        logger.info(f"Deleted {expired} snapshots from before {today}")
+    return written
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Precompute the next day's upcoming birthdays of active users")
+    parser.add_argument('--day', type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+                        help='Day to precompute, YYYY-MM-DD (default: tomorrow)')
+    parser.add_argument('--active-days', type=int, default=int(os.environ.get('UPCOMING_ACTIVE_DAYS', 14)),
+                        help='Users who logged in within this many days are precomputed (default: 14)')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='Snapshots written per transaction (default: 1000)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only count the users that would be precomputed')
+    return parser.parse_args()
+
+def main():
+    """
+    Main function
+    """
+    args = parse_arguments()
+
+    with app.app_context():
+        day = args.day or datetime.now().date() + timedelta(days=1)
+        precompute_upcoming(
+            day,
+            window_days=app.config['UPCOMING_DEFAULT_DAYS'],
+            active_days=args.active_days,
+            batch_size=args.batch_size,
+            dry_run=args.dry_run
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Profiling Module
+
+Opt-in cProfile hooks for production debugging.
+
+Web requests are profiled when selected by one of:
+- PROFILE_SAMPLE_RATE: the fraction of requests profiled at random
+- PROFILE_ROUTES: endpoints or paths always profiled (comma-separated)
+- an X-Profile header signed with PROFILE_SECRET, see sign_request()
+
+Each profile is written to PROFILE_DIR as a .prof file (readable with pstats or
+snakeviz) next to a .json file with the route, user_id, status, duration and
+number of SQL queries of the request. Only the newest PROFILE_MAX_FILES
+profiles are kept.
+
+When none of the triggers is configured, init_profiling() registers nothing,
+so requests pay nothing for it.
+
+StageProfiler profiles the stages of a notifier pipeline run separately.
+"""
+
+import cProfile
+import hashlib
+import hmac
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from flask import g, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import event
+
+logger = logging.getLogger('profiling')
+
+PROFILE_HEADER = 'X-Profile'
+
+def sign_request(secret, path, ttl=300, now=None):
+    """
+    Return an X-Profile header value profiling requests to path for ttl seconds
+    """
+    expires = int((now or time.time()) + ttl)
+    return f"{expires}:{_signature(secret, path, expires)}"
+
+def _signature(secret, path, expires):
+    return hmac.new(secret.encode('utf-8'), f"{expires}:{path}".encode('utf-8'), hashlib.sha256).hexdigest()
+
+def verify_signature(secret, path, value, now=None):
+    """
+    Return True if value is an unexpired X-Profile signature of path
+    """
+    expires, _, signature = (value or '').partition(':')
+    if not secret or not expires.isdigit() or int(expires) < (now or time.time()):
+        return False
+    return hmac.compare_digest(signature, _signature(secret, path, int(expires)))
+
+class ProfileStore:
+    """
+    Directory of profiles and their metadata, keeping the newest max_files
+    """
+    def __init__(self, directory, max_files=100):
+        self.directory = directory
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    def save(self, stats_source, name, metadata):
+        """
+        Write the stats of a cProfile.Profile (or pstats.Stats) and its metadata, returning the .prof path
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_') or 'profile'
+        base = os.path.join(self.directory, f"{datetime.utcnow():%Y%m%dT%H%M%S}_{slug}_{uuid.uuid4().hex[:8]}")
+        stats = stats_source if isinstance(stats_source, pstats.Stats) else pstats.Stats(stats_source)
+        stats.dump_stats(base + '.prof')
+        with open(base + '.json', 'w') as f:
+            json.dump(metadata, f, indent=2, default=str)
+        self.prune()
+        return base + '.prof'
+
+    def prune(self):
+        with self._lock:
+            profiles = sorted(name for name in os.listdir(self.directory) if name.endswith('.prof'))
+            for name in profiles[:max(0, len(profiles) - self.max_files)]:
+                for path in (name, name[:-len('.prof')] + '.json'):
+                    try:
+                        os.remove(os.path.join(self.directory, path))
+                    except FileNotFoundError:
+                        pass
+
+def summarize(stats_source, limit=15):
+    """
+    Return the top functions of a profile by cumulative time as text
+    """
+    output = io.StringIO()
+    stats = stats_source if isinstance(stats_source, pstats.Stats) else pstats.Stats(stats_source)
+    stats.stream = output
+    stats.sort_stats('cumulative').print_stats(limit)
+    return output.getvalue()
+
+def init_profiling(app, engine_getter):
+    """
+    Register the request profiling hooks on a Flask app if a trigger is configured:
+    PROFILE_SAMPLE_RATE, PROFILE_ROUTES or PROFILE_SECRET, with PROFILE_DIR and PROFILE_MAX_FILES.
+    engine_getter returns the engines whose queries are counted (called once, in an app context).
+    """
+    app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+    app.config.setdefault('PROFILE_ROUTES', [])
+    app.config.setdefault('PROFILE_SECRET', None)
+    app.config.setdefault('PROFILE_DIR', 'profiles')
+    app.config.setdefault('PROFILE_MAX_FILES', 100)
+
+    sample_rate = app.config['PROFILE_SAMPLE_RATE']
+    routes = set(app.config['PROFILE_ROUTES'])
+    secret = app.config['PROFILE_SECRET']
+    if not sample_rate and not routes and not secret:
+        return None
+
+    store = ProfileStore(app.config['PROFILE_DIR'], app.config['PROFILE_MAX_FILES'])
+    app.extensions['profile_store'] = store
+    # One profiled request at a time per process: newer Pythons only allow one active profiler
+    busy = threading.Lock()
+    local = threading.local()
+
+    def count_query(*args, **kwargs):
+        if getattr(local, 'queries', None) is not None:
+            local.queries += 1
+
+    with app.app_context():
+        for engine in engine_getter():
+            event.listen(engine, 'before_cursor_execute', count_query)
+
+    def trigger():
+        if request.endpoint in routes or request.path in routes:
+            return 'route'
+        if secret and PROFILE_HEADER in request.headers:
+            if verify_signature(secret, request.path, request.headers[PROFILE_HEADER]):
+                return 'header'
+            logger.warning(f"Ignoring invalid {PROFILE_HEADER} header on {request.path}")
+        if sample_rate and random.random() < sample_rate:
+            return 'sample'
+        return None
+
+    @app.before_request
+    def start_profile():
+        reason = trigger()
+        if reason is None or not busy.acquire(blocking=False):
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) is active
+            busy.release()
+            return
+        local.queries = 0
+        g.profile = (profile, reason, time.perf_counter())
+
+    @app.after_request
+    def record_profile_status(response):
+        if 'profile' in g:
+            g.profile_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def stop_profile(exc):
+        started = g.pop('profile', None)
+        if started is None:
+            return
+        profile, reason, start = started
+        try:
+            profile.disable()
+            queries, local.queries = local.queries, None
+            try:
+                user_id = get_jwt_identity()
+            except RuntimeError:
+                # The view doesn't verify a JWT
+                user_id = None
+            metadata = {
+                'route': request.endpoint,
+                'path': request.path,
+                'method': request.method,
+                'user_id': user_id,
+                'status': g.get('profile_status'),
+                'trigger': reason,
+                'query_count': queries,
+                'duration_ms': round((time.perf_counter() - start) * 1000, 3),
+                'error': repr(exc) if exc else None,
+                'pid': os.getpid(),
+                'time': datetime.utcnow().isoformat()
+            }
+            path = store.save(profile, f"{request.method}_{request.endpoint or 'unknown'}", metadata)
+            logger.info(f"Profiled {request.method} {request.path} ({reason}): {metadata['duration_ms']} ms, {queries} queries -> {path}")
+        except Exception as e:
+            logger.error(f"Could not save the profile of {request.path}: {e}")
+        finally:
+            busy.release()
+
+    logger.info(f"Request profiling enabled (sample rate {sample_rate}, routes {sorted(routes)}, signed header {'on' if secret else 'off'})")
+    return store
+
+class StageProfiler:
+    """
+    Profiles the calls of pipeline stage functions, one cProfile.Profile per stage and thread
+    """
+    def __init__(self):
+        self._profiles = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _profile(self, name):
+        profiles = getattr(self._local, 'profiles', None)
+        if profiles is None:
+            profiles = self._local.profiles = {}
+        profile = profiles.get(name)
+        if profile is None:
+            profile = profiles[name] = cProfile.Profile()
+            with self._lock:
+                self._profiles.setdefault(name, []).append(profile)
+        return profile
+
+    def wrap(self, name, func):
+        """
+        Return func profiled under the stage name
+        """
+        def profiled(*args, **kwargs):
+            profile = self._profile(name)
+            try:
+                profile.enable()
+            except ValueError:
+                # Newer Pythons allow one active profiler per process, this call goes unprofiled
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+        return profiled
+
+    def wrap_iterable(self, name, iterable):
+        """
+        Return an iterator over iterable with the production of each item profiled under name
+        """
+        iterator = iter(iterable)
+        next_item = self.wrap(name, next)
+        while True:
+            try:
+                item = next_item(iterator)
+            except StopIteration:
+                return
+            yield item
+
+    def stats(self):
+        """
+        Return {stage name: pstats.Stats} merged over the threads of each stage
+        """
+        merged = {}
+        with self._lock:
+            for name, profiles in self._profiles.items():
+                stats = None
+                for profile in profiles:
+                    try:
+                        stats = pstats.Stats(profile) if stats is None else stats.add(profile)
+                    except TypeError:
+                        # A worker that never got an item has no data
+                        continue
+                if stats is not None:
+                    merged[name] = stats
+        return merged
+
+if __name__ == '__main__':
+    # Print an X-Profile header value for a path: python profiling.py /some/path [ttl seconds]
+    import sys
+    secret = os.environ.get('PROFILE_SECRET')
+    if len(sys.argv) < 2 or not secret:
+        sys.exit(f"Usage: PROFILE_SECRET=... python {sys.argv[0]} PATH [TTL]")
+    print(f"{PROFILE_HEADER}: {sign_request(secret, sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 300)}")
@@ -0,0 +1,152 @@
+"""
+Read Models Module
+
+Lightweight read-only representations of birthdays for the hot read paths.
+Queries select only the columns these types need and map the row tuples
+straight into them, instead of hydrating full ORM instances and copying
+them into dictionaries.
+"""
+
+import json
+import calendar
+from collections import namedtuple
+from datetime import date
+
+import vectorized_birthdays
+
+# Row count from which the NumPy engine beats the scalar loop
+VECTORIZE_MIN_ROWS = 200
+
+# Columns selected for the birthday list: (id, name, date, notes, created_at)
+class BirthdayRow(namedtuple('BirthdayRow', ['id', 'name', 'date', 'notes', 'created_at'])):
+    __slots__ = ()
+
+class UpcomingBirthday(namedtuple('UpcomingBirthday', ['id', 'name', 'date', 'this_year_date', 'days_until', 'age', 'notes'])):
+    __slots__ = ()
+
+    def to_json(self):
+        """
+        Return the JSON API representation, dates are written as YYYY-MM-DD by the JSON provider
+        """
+        return {
+            'id': self.id,
+            'name': self.name,
+            'date': self.date,
+            'this_year_date': self.this_year_date,
+            'days_until': self.days_until,
+            'age': self.age,
+            'notes': self.notes
+        }
+
+def dump_upcoming(birthdays):
+    """
+    Return UpcomingBirthday as compact JSON text, one array of the fields per birthday
+    """
+    return json.dumps([
+        [birthday.id, birthday.name, birthday.date.isoformat(), birthday.this_year_date.isoformat(),
+         birthday.days_until, birthday.age, birthday.notes]
+        for birthday in birthdays
+    ], separators=(',', ':'))
+
+def load_upcoming(text):
+    """
+    Return the UpcomingBirthday of JSON text written by dump_upcoming
+    """
+    return [
+        UpcomingBirthday(birthday_id, name, date.fromisoformat(birth_date), date.fromisoformat(occurrence), days_until, age, notes)
+        for birthday_id, name, birth_date, occurrence, days_until, age, notes in json.loads(text)
+    ]
+
+def birthday_occurrence(birth_date, year):
+    """
+    Return the birthday of birth_date in the given year.
+    Feb 29 birthdays fall on Feb 28 in non-leap years.
+    """
+    if birth_date.month == 2 and birth_date.day == 29 and not calendar.isleap(year):
+        return birth_date.replace(year=year, day=28)
+    return birth_date.replace(year=year)
+
+def upcoming_birthday(birthday_id, name, birth_date, notes, occurrence, reference_date):
+    """
+    Build the UpcomingBirthday of one occurrence of a birthday
+    """
+    return UpcomingBirthday(
+        birthday_id,
+        name,
+        birth_date,
+        occurrence,
+        (occurrence - reference_date).days,
+        occurrence.year - birth_date.year,
+        notes
+    )
+
+def find_upcoming(rows, today, end_date):
+    """
+    Return the UpcomingBirthday of every (id, name, date, notes, ...) row whose next
+    birthday falls between today and end_date (inclusive), sorted by days until birthday
+    """
+    if not isinstance(rows, list):
+        rows = list(rows)
+    if vectorized_birthdays.available() and len(rows) >= VECTORIZE_MIN_ROWS:
+        return _find_upcoming_vectorized(rows, today, end_date)
+
+    upcoming = []
+
+    for row in rows:
+        birthday_id, name, birth_date, notes = row[:4]
+
+        # Get this year's birthday, if it already happened this year look at next year
+        occurrence = birthday_occurrence(birth_date, today.year)
+        if occurrence < today:
+            occurrence = birthday_occurrence(birth_date, today.year + 1)
+
+        if occurrence <= end_date:
+            upcoming.append(upcoming_birthday(birthday_id, name, birth_date, notes, occurrence, today))
+
+    # Sort by days until birthday
+    upcoming.sort(key=lambda x: x.days_until)
+    return upcoming
+
+def _find_upcoming_vectorized(rows, today, end_date):
+    occurrences, days_until, ages = vectorized_birthdays.next_birthdays(
+        vectorized_birthdays.from_dates([row[2] for row in rows]), today
+    )
+    selected = (days_until <= (end_date - today).days).nonzero()[0]
+    # A stable sort keeps the row order between birthdays on the same day, like list.sort
+    selected = selected[days_until[selected].argsort(kind='stable')]
+
+    upcoming = []
+    for i, occurrence, days, age in zip(
+        selected.tolist(),
+        vectorized_birthdays.to_dates(occurrences[selected]),
+        days_until[selected].tolist(),
+        ages[selected].tolist()
+    ):
+        birthday_id, name, birth_date, notes = rows[i][:4]
+        upcoming.append(UpcomingBirthday(birthday_id, name, birth_date, occurrence, days, age, notes))
+    return upcoming
+
+def occurrences_between(birth_dates, start_date, end_date):
+    """
+    Return the occurrence of each birth date between start_date and end_date (inclusive),
+    or None for the ones that don't fall in the range. The range may span a year boundary.
+    """
+    if vectorized_birthdays.available() and len(birth_dates) >= VECTORIZE_MIN_ROWS:
+        occurrences, in_range = vectorized_birthdays.occurrences_between(
+            vectorized_birthdays.from_dates(birth_dates), start_date, end_date
+        )
+        return [
+            date.fromordinal(occurrence) if selected else None
+            for occurrence, selected in zip(occurrences.tolist(), in_range.tolist())
+        ]
+
+    result = []
+    for birth_date in birth_dates:
+        for year in range(start_date.year, end_date.year + 1):
+            occurrence = birthday_occurrence(birth_date, year)
+            if start_date <= occurrence <= end_date:
+                result.append(occurrence)
+                break
+        else:
+            result.append(None)
+    return result
@@ -1,29 +1,15 @@
 import os
-import pymysql
 from app import app, db, User, Birthday
+from migrations import MIGRATIONS, mark_applied
 from sqlalchemy import text
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-print("Resetting database...")
-
-timeout = 10
-
-# Connect to MySQL database
-connection = pymysql.connect(
-    charset="utf8mb4",
-    connect_timeout=timeout,
-    cursorclass=pymysql.cursors.DictCursor,
-    db="birthday_buddy",
-    host=os.environ.get('DATABASE_URI'),
-    password=os.environ.get('PASSWORD'),
-    read_timeout=timeout,
-    port=26323,
-    user="avnadmin",
-    write_timeout=timeout,
-)
+# The database configured for the app: MySQL, or SQLite with a sqlite:// DATABASE_SERVICE_URI
+with app.app_context():
+    print(f"Resetting database {db.engine.url.render_as_string(hide_password=True)}...")
 
 # Create the tables fresh with the new schema
 print("Creating new database with updated schema...")
@@ -38,6 +24,10 @@ with app.app_context():
     # Create all tables
     db.create_all()
     print("Database tables created successfully!")
+    
+    # A fresh schema already has every index and no rows to migrate
+    mark_applied(MIGRATIONS)
+    print("Data migrations marked as applied.")
 
 print("\nDatabase has been reset. You can now run the application with the new schema.")
 print("You'll need to create a new user account to get started.") 
\ No newline at end of file
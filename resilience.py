@@ -0,0 +1,208 @@
+"""
+Resilience Module
+
+Building blocks for calling an external service that may fail or hang:
+
+- CircuitBreaker stops calling a service after consecutive failures, and
+  probes it with a single call (half-open) once a cool-down has passed
+- Spool is an append-only JSON lines file of work to retry later, drained
+  in order once the service is back
+
+Used by the email API client, see email_notifications.py.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: only the threads of one process are synchronized
+    fcntl = None
+
+logger = logging.getLogger('resilience')
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures, failing calls fast for reset_seconds.
+    Then it's half-open: a single probe call is let through, closing the breaker if it
+    succeeds and opening it again if it fails.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, reset_seconds=30, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Return True if a call may be made now
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self._probing = False
+                logger.info(f"{self.name}: circuit half-open, probing")
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        """
+        Record a successful call, returning True if it closed the breaker
+        """
+        with self._lock:
+            self.failures = 0
+            if self.state == self.CLOSED:
+                return False
+            self.state = self.CLOSED
+            self._probing = False
+            logger.info(f"{self.name}: circuit closed, the service has recovered")
+            return True
+
+    def record_failure(self):
+        """
+        Record a failed call, opening the breaker after too many in a row or a failed probe
+        """
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+                self._probing = False
+                logger.warning(f"{self.name}: circuit open after {self.failures} consecutive failures, retrying in {self.reset_seconds}s")
+
+class Spool:
+    """
+    Append-only JSON lines file of items waiting to be retried. Drained items aren't
+    rewritten: the byte offset of the first pending one is kept next to the file in
+    PATH.offset, and the file is truncated once everything is drained. An item whose
+    handling was interrupted before its offset was saved is handled again.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.offset_path = path + '.offset'
+        self._lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+
+    def _locked(self, f, flags=None):
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if flags is None else flags)
+
+    def append(self, item):
+        """
+        Durably add an item at the end of the spool
+        """
+        line = json.dumps(item, separators=(',', ':'), default=str) + '\n'
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                self._locked(f)
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _size(self):
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def _offset(self):
+        try:
+            with open(self.offset_path) as f:
+                offset = int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+        # Past the end when the spool was truncated but the offset not yet reset
+        return offset if offset <= self._size() else 0
+
+    def pending_bytes(self):
+        """
+        Return the size of the items not drained yet, cheap enough to check before every call
+        """
+        return max(0, self._size() - self._offset())
+
+    def __len__(self):
+        return sum(1 for _ in self.items())
+
+    def items(self):
+        """
+        Yield (offset after the item, item) for every pending item, oldest first
+        """
+        offset = self._offset()
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(offset)
+            for line in f:
+                offset += len(line)
+                if not line.endswith(b'\n'):
+                    # Partially written by an append in progress
+                    return
+                yield offset, json.loads(line)
+
+    def _commit(self, offset):
+        temporary = self.offset_path + '.tmp'
+        with open(temporary, 'w') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.offset_path)
+
+    def _truncate_if_drained(self):
+        with self._lock:
+            try:
+                f = open(self.path, 'r+b')
+            except FileNotFoundError:
+                return
+            with f:
+                self._locked(f)
+                if os.fstat(f.fileno()).st_size == self._offset():
+                    f.truncate(0)
+                    self._commit(0)
+
+    def drain(self, handle):
+        """
+        Call handle(item) for the pending items in order, stopping at the first one it returns
+        False for. Returns the number of items drained, 0 if another thread or process is draining.
+        """
+        if not self._drain_lock.acquire(blocking=False):
+            return 0
+        try:
+            with open(self.path + '.lock', 'a') as lock:
+                if fcntl is not None:
+                    try:
+                        self._locked(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        return 0
+                drained = 0
+                for offset, item in self.items():
+                    if not handle(item):
+                        break
+                    self._commit(offset)
+                    drained += 1
+                if drained:
+                    self._truncate_if_drained()
+                return drained
+        finally:
+            self._drain_lock.release()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""
+Notification Retention Script
+
+BirthdayNotification gets a row per reminder sent, forever. Only the current
+and previous year are needed hot: the notifier dedupes against the year of the
+birthday it reminds about. This script reports the size of the table per
+year_notified and moves older years out of it, either into the
+birthday_notification_archive table or into gzipped JSON lines files, one per year.
+
+Rows are moved in small batches, each copied and deleted in its own short
+transaction, with a pause in between, so the archival never holds long locks
+on the hot table and can be stopped and rerun at any point.
+
+    python retention.py report
+    python retention.py archive --to table --dry-run
+    python retention.py archive --to file --archive-dir /var/backups/birthday_buddy
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import argparse
+from datetime import datetime
+import logging
+from dotenv import load_dotenv
+
+# Add the current directory to the path so that we can import app modules
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('retention')
+
+# Load environment variables
+load_dotenv()
+
+# Import app after setting up environment
+from app import app, db, BirthdayNotification, BirthdayNotificationArchive
+from sqlalchemy import bindparam, func, select, text
+
+ARCHIVE_COLUMNS = ['id', 'birthday_id', 'user_id', 'notification_date', 'year_notified', 'created_at']
+
+def table_sizes(table_names):
+    """
+    Return {table: (rows, data bytes, index bytes)}, bytes are None where the database doesn't report them
+    """
+    sizes = {}
+    if db.engine.dialect.name == 'mysql':
+        result = db.session.execute(text(
+            "SELECT table_name, table_rows, data_length, index_length FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_name IN :names"
+        ).bindparams(bindparam('names', expanding=True)), {'names': table_names})
+        for name, _, data_length, index_length in result:
+            sizes[name] = (None, data_length, index_length)
+    for name in table_names:
+        # information_schema row counts are estimates, count exactly
+        rows = db.session.execute(text(f'SELECT COUNT(*) FROM {name}')).scalar()
+        _, data_length, index_length = sizes.get(name, (None, None, None))
+        sizes[name] = (rows, data_length, index_length)
+    return sizes
+
+def rows_per_year(model):
+    """
+    Return [(year_notified, rows)] of a notification table
+    """
+    return db.session.query(model.year_notified, func.count(model.id)).group_by(
+        model.year_notified
+    ).order_by(model.year_notified).all()
+
+def format_bytes(size):
+    if size is None:
+        return 'n/a'
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if size < 1024 or unit == 'GiB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+def report(hot_years):
+    """
+    Print the size of the notification tables and their rows per year
+    """
+    sizes = table_sizes([BirthdayNotification.__tablename__, BirthdayNotificationArchive.__tablename__])
+    print(f"{'table':<32} {'rows':>10} {'data':>12} {'indexes':>12}")
+    for name, (rows, data_length, index_length) in sizes.items():
+        print(f"{name:<32} {rows:>10} {format_bytes(data_length):>12} {format_bytes(index_length):>12}")
+
+    cutoff = archive_cutoff(hot_years)
+    print(f"\nbirthday_notification rows per year (years before {cutoff} are archived):")
+    for year, rows in rows_per_year(BirthdayNotification):
+        print(f"  {year}: {rows}{'' if year >= cutoff else '  (to archive)'}")
+
+    archived = rows_per_year(BirthdayNotificationArchive)
+    if archived:
+        print("\nbirthday_notification_archive rows per year:")
+        for year, rows in archived:
+            print(f"  {year}: {rows}")
+
+def archive_cutoff(hot_years, today=None):
+    """
+    Return the first year_notified kept hot: the current year and hot_years - 1 before it
+    """
+    today = today or datetime.now().date()
+    return today.year - hot_years + 1
+
+class FileArchive:
+    """
+    Appends archived rows to one gzipped JSON lines file per year_notified.
+    Rows are written before their batch is deleted, so a batch interrupted in between
+    may be written twice: readers should dedupe on id.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, year):
+        return os.path.join(self.directory, f'birthday_notification_{year}.jsonl.gz')
+
+    def write(self, rows):
+        by_year = {}
+        for row in rows:
+            by_year.setdefault(row['year_notified'], []).append(row)
+        for year, year_rows in by_year.items():
+            # Each batch is a gzip member of its own, gzip readers concatenate them
+            with gzip.open(self.path(year), 'at', encoding='utf-8') as archive:
+                for row in year_rows:
+                    archive.write(json.dumps(row, default=lambda value: value.isoformat()) + '\n')
+                archive.flush()
+                os.fsync(archive.fileno())
+
+class TableArchive:
+    """
+    Inserts archived rows into birthday_notification_archive, in the transaction deleting them
+    """
+    def write(self, rows):
+        db.session.execute(BirthdayNotificationArchive.__table__.insert(), rows)
+
+def archive_notifications(destination, cutoff_year, batch_size=1000, sleep=0.1, dry_run=False, max_batches=None):
+    """
+    Move the notifications with year_notified before cutoff_year to destination in batches,
+    returning the number of rows moved
+    """
+    hot = BirthdayNotification.__table__
+    pending = db.session.query(func.count(BirthdayNotification.id)).filter(
+        BirthdayNotification.year_notified < cutoff_year
+    ).scalar()
+    db.session.commit()
+    logger.info(f"{pending} notifications from before {cutoff_year} to archive")
+    if dry_run or not pending:
+        return 0
+
+    moved = batches = 0
+    started = time.monotonic()
+    last_id = 0
+    while max_batches is None or batches < max_batches:
+        # Keyset pagination on id over the (year_notified, id) index, each batch only locks the rows it moves
+        rows = db.session.execute(
+            select(*[hot.c[column] for column in ARCHIVE_COLUMNS]).where(
+                hot.c.year_notified < cutoff_year, hot.c.id > last_id
+            ).order_by(hot.c.id).limit(batch_size).with_for_update()
+        ).mappings().all()
+        if not rows:
+            db.session.commit()
+            break
+
+        rows = [dict(row) for row in rows]
+        ids = [row['id'] for row in rows]
+        destination.write(rows)
+        db.session.execute(hot.delete().where(hot.c.id.in_(ids)))
+        db.session.commit()
+
+        moved += len(rows)
+        batches += 1
+        last_id = ids[-1]
+        elapsed = time.monotonic() - started
+        rate = moved / elapsed if elapsed else 0
+        eta = (pending - moved) / rate if rate else 0
+        logger.info(f"Archived {moved}/{pending} notifications ({rate:.0f} rows/s, ETA {eta:.0f}s)")
+        time.sleep(sleep)
+
+    return moved
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='BirthdayNotification retention')
+    parser.add_argument('--hot-years', type=int, default=int(os.environ.get('NOTIFICATION_HOT_YEARS', 2)),
+                        help='Years of notifications kept in the hot table, including the current one (default: 2)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('report', help='Show table sizes and rows per year')
+
+    archive = subparsers.add_parser('archive', help='Move old years out of the hot table')
+    archive.add_argument('--to', choices=['table', 'file'], default='table',
+                         help='Archive into birthday_notification_archive or gzipped JSON lines files (default: table)')
+    archive.add_argument('--archive-dir', default=os.environ.get('NOTIFICATION_ARCHIVE_DIR', 'archive'),
+                         help='Directory of the archive files with --to file (default: archive)')
+    archive.add_argument('--batch-size', type=int, default=1000,
+                         help='Rows moved per transaction (default: 1000)')
+    archive.add_argument('--sleep', type=float, default=0.1,
+                         help='Seconds to pause between batches (default: 0.1)')
+    archive.add_argument('--max-batches', type=int,
+                         help='Stop after this many batches, the next run continues')
+    archive.add_argument('--dry-run', action='store_true',
+                         help='Only count the rows that would be archived')
+    return parser.parse_args()
+
+def main():
+    """
+    Main function
+    """
+    args = parse_arguments()
+
+    with app.app_context():
+        # Tables and indexes added after the database was created
+        BirthdayNotificationArchive.__table__.create(db.engine, checkfirst=True)
+        for index in BirthdayNotification.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+
+        if args.command == 'report':
+            report(args.hot_years)
+            return
+
+        cutoff = archive_cutoff(args.hot_years)
+        destination = FileArchive(args.archive_dir) if args.to == 'file' else TableArchive()
+        moved = archive_notifications(
+            destination, cutoff,
+            batch_size=args.batch_size,
+            sleep=args.sleep,
+            dry_run=args.dry_run,
+            max_batches=args.max_batches
+        )
+        logger.info(f"Archival completed, {moved} notifications moved to the {args.to} archive")
+
+if __name__ == "__main__":
+    main()
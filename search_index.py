@@ -0,0 +1,139 @@
+"""
+Search Index Module
+
+An in-memory index for searching a user's birthdays by name and notes.
+Text is normalized first (accents stripped, case folded), so "zoe" finds
+"Zoë". Every trigram of the normalized names, and of the notes, points to the
+birthdays containing it: a substring query only looks at the birthdays having
+its rarest trigram. Queries shorter than a trigram match the start of words
+instead, from sorted word lists.
+
+Results are ranked: names starting with the query first, then names with a
+word starting with it, then names containing it, then matches in the notes
+only, alphabetically within each group. Entries are kept in name order, so
+each group is ordered by position and only as many as needed are sorted.
+"""
+
+import heapq
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from itertools import chain
+
+SearchEntry = namedtuple('SearchEntry', ['id', 'name', 'date', 'notes'])
+
+TRIGRAM = 3
+
+# Sorts after any text starting with the same prefix
+_PREFIX_END = '\U0010ffff'
+
+def normalize(text):
+    """
+    Return text case folded and without accents
+    """
+    if not text:
+        return ''
+    if text.isascii():
+        return text.lower()
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+class TextField:
+    """
+    Trigram postings and a sorted word list over one normalized text per position.
+    Without first_words the first word of each text isn't listed: callers find the
+    texts starting with a query faster themselves, e.g. when the texts are sorted.
+    """
+    __slots__ = ('texts', '_postings', '_words', '_word_positions')
+
+    def __init__(self, texts, first_words=True):
+        self.texts = texts
+        postings = {}
+        words = []
+        for position, text in enumerate(texts):
+            for gram in {text[i:i + TRIGRAM] for i in range(len(text) - TRIGRAM + 1)}:
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array('I')
+                posting.append(position)
+            for word in set(text.split()[0 if first_words else 1:]):
+                words.append((word, position))
+        self._postings = postings
+        words.sort()
+        self._words = [word for word, _ in words]
+        self._word_positions = array('I', [position for _, position in words])
+
+    def word_prefix(self, query, exclude=frozenset(), skip=range(0)):
+        """
+        Return the set of positions with a word starting with query, except those in exclude or skip
+        """
+        start = bisect_left(self._words, query)
+        end = bisect_left(self._words, query + _PREFIX_END, start)
+        return {position for position in self._word_positions[start:end] if position not in skip and position not in exclude}
+
+    def substring(self, query, exclude=frozenset(), skip=range(0)):
+        """
+        Return the set of positions whose text contains query, of at least TRIGRAM characters,
+        except those in exclude or in the range skip
+        """
+        # Checking the candidates of the rarest trigram is cheaper than intersecting
+        # the postings of the others: both cost per candidate, set operations more
+        rarest = min((self._postings.get(query[i:i + TRIGRAM], ()) for i in range(len(query) - TRIGRAM + 1)), key=len)
+        if skip:
+            # Postings are in position order
+            rarest = chain(rarest[:bisect_left(rarest, skip.start)], rarest[bisect_left(rarest, skip.stop):])
+        if len(query) == TRIGRAM:
+            return set(rarest).difference(exclude)
+        texts = self.texts
+        return {position for position in rarest if position not in exclude and query in texts[position]}
+
+    def matches(self, query, exclude=frozenset(), skip=range(0)):
+        if len(query) < TRIGRAM:
+            return self.word_prefix(query, exclude, skip)
+        return self.substring(query, exclude, skip)
+
+class SearchIndex:
+    """
+    Name and notes TextFields over (id, name, date, notes) rows, kept in name order
+    """
+    __slots__ = ('_entries', '_names', '_name_field', '_notes_field')
+
+    def __init__(self, rows=()):
+        keyed = sorted((normalize(row[1]).strip(), row[0], SearchEntry(*row)) for row in rows)
+        self._entries = [entry for _, _, entry in keyed]
+        self._names = [name for name, _, _ in keyed]
+        # The names whose first word starts with a query are those starting with it
+        self._name_field = TextField(self._names, first_words=False)
+        self._notes_field = TextField([normalize(entry.notes) for entry in self._entries])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def search(self, query, limit=20):
+        """
+        Return (number of matches, the best limit SearchEntry matches)
+        """
+        query = normalize(query).strip()
+        if not query:
+            return 0, []
+
+        # Names starting with the query are a contiguous range of positions, and contain
+        # it: only the other names are checked
+        start = bisect_left(self._names, query)
+        prefixed = range(start, bisect_left(self._names, query + _PREFIX_END, start))
+        name_matches = self._name_field.matches(query, skip=prefixed)
+        notes_matches = self._notes_field.matches(query, exclude=name_matches, skip=prefixed)
+        total = len(prefixed) + len(name_matches) + len(notes_matches)
+
+        best = list(prefixed[:limit])
+        if len(best) < limit and len(query) >= TRIGRAM:
+            word_matches = self._name_field.word_prefix(query, skip=prefixed)
+            best.extend(heapq.nsmallest(limit - len(best), word_matches))
+            name_matches.difference_update(word_matches)
+        if len(best) < limit:
+            best.extend(heapq.nsmallest(limit - len(best), name_matches))
+        if len(best) < limit:
+            best.extend(heapq.nsmallest(limit - len(best), notes_matches))
+
+        return total, [self._entries[position] for position in best]
@@ -3,7 +3,8 @@
 Setup Script for Scheduling Birthday Notifications
 
 This script automatically sets up a cron job to run the birthday notification script
-daily on Linux systems without requiring user input.
+daily on Linux systems without requiring user input. In auto mode it also schedules
+precompute_upcoming.py shortly before midnight (--precompute-time=HH:MM, default 23:30).
 """
 
 import os
@@ -26,23 +27,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger("setup_notification")
 
-def get_script_path():
-    """Get the absolute path to the birthday_notifier.py script"""
+def get_script_path(script_name='birthday_notifier.py'):
+    """Get the absolute path to the birthday_notifier.py script, or another script of the app"""
     current_dir = os.path.dirname(os.path.abspath(__file__))
-    script_path = os.path.join(current_dir, 'birthday_notifier.py')
+    script_path = os.path.join(current_dir, script_name)
     return os.path.normpath(script_path)
 
-def setup_linux_cron(run_time="08:00", force=True):
+def setup_linux_cron(run_time="08:00", force=True, script_name='birthday_notifier.py'):
     """Set up a Linux cron job to run daily at the specified time
     
     Args:
         run_time (str): Time to run in HH:MM format (24-hour)
         force (bool): If True, override existing cron jobs without asking
+        script_name (str): Script of the app to run
     
     Returns:
         bool: True if successful, False otherwise
     """
-    script_path = get_script_path()
+    script_path = get_script_path(script_name)
     python_path = sys.executable
     script_dir = os.path.dirname(script_path)
     
@@ -55,7 +57,7 @@ def setup_linux_cron(run_time="08:00", force=True):
         logger.warning(f"Invalid time format: {run_time}. Using default (08:00).")
         hour, minute = 8, 0
     
-    logger.info(f"Setting up Linux Cron Job to run at {hour:02d}:{minute:02d}")
+    logger.info(f"Setting up Linux Cron Job for {script_name} to run at {hour:02d}:{minute:02d}")
     
     # Create the cron job entry
     cron_job = f"{minute} {hour} * * * cd {script_dir} && {python_path} {script_path} >> {script_dir}/cron.log 2>&1\n"
@@ -77,7 +79,7 @@ def setup_linux_cron(run_time="08:00", force=True):
     
     # Check if the job already exists
     if script_path in current_crontab:
-        logger.info("A cron job for birthday notifications already exists.")
+        logger.info(f"A cron job for {script_name} already exists.")
         if not force:
             logger.info("Keeping existing cron job unchanged.")
             return True
@@ -167,17 +169,22 @@ def main():
         # Automatically set up without prompting during deployment
         logger.info("Running in auto-deployment mode")
         run_time = "08:00"  # Default to 8 AM
+        # Shortly before midnight, so the next day's upcoming birthdays are ready at rollover
+        precompute_time = "23:30"
         
-        # Look for time setting in command line args
+        # Look for time settings in command line args
         for arg in sys.argv:
             if arg.startswith('--time='):
                 run_time = arg.split('=')[1]
+            elif arg.startswith('--precompute-time='):
+                precompute_time = arg.split('=')[1]
         
-        # Set up cron job automatically
+        # Set up cron jobs automatically
         if setup_linux_cron(run_time, force=True):
             # Run a silent test
             test_notification(silent=True)
-            logger.info("Auto-deployment setup completed successfully.")
+            if setup_linux_cron(precompute_time, force=True, script_name='precompute_upcoming.py'):
+                logger.info("Auto-deployment setup completed successfully.")
     else:
         # Interactive mode for manual setup
         logger.info("Running in interactive mode")
@@ -0,0 +1,111 @@
+"""
+SQLite Profile Module
+
+Birthday Buddy runs on an embedded SQLite database when DATABASE_SERVICE_URI
+is a sqlite:// URI, e.g. sqlite:////var/lib/birthday_buddy/app.db: small
+single-node installs need no database server, and benchmarks run hermetically.
+
+Every connection is tuned on connect:
+- journal_mode=WAL: readers don't block the writer nor each other
+- synchronous=NORMAL: WAL is synced at checkpoints rather than at every commit,
+  a power loss may lose the last commits but never corrupts the database
+- mmap_size: pages are read through the OS page cache, shared by every
+  connection and worker process, instead of copied into each connection
+- cache_size: the page cache of each connection, on top of the mmap
+- busy_timeout: a writer waits for another one instead of failing at once
+
+Connections are pooled with one per thread in mind: SQLite connections are
+cheap to open but their page cache and prepared statements are per
+connection, so the pool keeps SQLITE_POOL_SIZE of them open, enough for each
+gunicorn thread plus the background index builds. In-memory databases share
+a single connection instead, since each connection would get its own database,
+and so do the greenlets of a gevent worker, see engine_options.
+
+The indexes are the ones declared on the models, as on MySQL, including those
+on foreign key columns which MySQL creates implicitly and SQLite doesn't.
+"""
+
+import logging
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool, StaticPool
+
+logger = logging.getLogger('sqlite_profile')
+
+def is_sqlite(uri):
+    return bool(uri) and uri.startswith('sqlite')
+
+def is_memory(uri):
+    """
+    Return True if a sqlite URI is an in-memory database
+    """
+    path = uri.split('://', 1)[1] if '://' in uri else ''
+    return path in ('', '/', '/:memory:') or 'mode=memory' in path
+
+def engine_options(uri, pool_size=8, busy_timeout_ms=5000, cooperative=False):
+    """
+    SQLAlchemy engine options for a sqlite URI. With cooperative (gevent) concurrency
+    the greenlets of a worker share a single connection.
+    """
+    # Pooled connections are handed from thread to thread, never used by two at once
+    connect_args = {'check_same_thread': False, 'timeout': busy_timeout_ms / 1000}
+    if is_memory(uri):
+        return {'poolclass': StaticPool, 'connect_args': connect_args}
+    if cooperative:
+        # A greenlet waiting on a lock held by another one of the same worker would block the
+        # whole worker in SQLite's busy handler, and the holder with it: they wait in the pool instead
+        return {'poolclass': QueuePool, 'pool_size': 1, 'max_overflow': 0, 'connect_args': connect_args}
+    # No server to drop connections, so no pre-ping nor recycling. Overflow connections
+    # are closed on checkin, losing their cache: size the pool for the threads instead
+    return {'poolclass': QueuePool, 'pool_size': pool_size, 'max_overflow': pool_size, 'connect_args': connect_args}
+
+def pragmas(config):
+    """
+    Return the PRAGMA statements run on every new connection, from SQLITE_* settings
+    """
+    return [
+        'PRAGMA journal_mode=WAL',
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+        # Negative sizes are in KiB rather than pages
+        f"PRAGMA cache_size=-{int(config['SQLITE_CACHE_SIZE_KB'])}",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        'PRAGMA temp_store=MEMORY',
+    ]
+
+def init_sqlite(app, engine_getter):
+    """
+    Tune the connections of the SQLite engines among engine_getter() (called once, in an
+    app context) with SQLITE_SYNCHRONOUS, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE_KB and
+    SQLITE_BUSY_TIMEOUT_MS. Returns the number of engines tuned.
+    """
+    app.config.setdefault('SQLITE_SYNCHRONOUS', 'NORMAL')
+    app.config.setdefault('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+    app.config.setdefault('SQLITE_CACHE_SIZE_KB', 16 * 1024)
+    app.config.setdefault('SQLITE_BUSY_TIMEOUT_MS', 5000)
+    statements = pragmas(app.config)
+
+    def tune(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+    tuned = 0
+    with app.app_context():
+        for engine in engine_getter():
+            if engine.dialect.name != 'sqlite':
+                continue
+            event.listen(engine, 'connect', tune)
+            tuned += 1
+            logger.info(f"SQLite profile on {engine.url.render_as_string(hide_password=True)}: {'; '.join(statements)}")
+    return tuned
+
+def describe(connection):
+    """
+    Return the effective settings of a SQLite connection, for diagnostics
+    """
+    names = ['journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'busy_timeout', 'page_size']
+    return {name: connection.exec_driver_sql(f'PRAGMA {name}').scalar() for name in names}
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Test Batch API Script
+
+Checks the validation of /api/birthdays/batch through the Flask test client,
+on a throwaway SQLite database (see sqlite_profile.py), so the configured
+database is left alone. Runs with pytest or directly.
+For development and testing purposes only.
+"""
+
+import os
+import sys
+import shutil
+import secrets
+import tempfile
+from datetime import date
+
+# Add the current directory to the path so that we can import app modules
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# The database URI is read when the app is imported, so the throwaway database is set up first
+TEST_DIR = tempfile.mkdtemp(prefix='birthday_buddy_test_')
+os.environ['DATABASE_SERVICE_URI'] = f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}"
+os.environ['DATABASE_REPLICA_URIS'] = ''
+os.environ.setdefault('JWT_SECRET_KEY', secrets.token_hex(32))
+os.environ.setdefault('SECRET_KEY', secrets.token_hex(32))
+
+# Import app after setting up environment
+from app import app, db, User, Birthday
+from flask_jwt_extended import create_access_token
+
+def make_client():
+    """
+    Return (test client logged in as a new user, id of one of their birthdays)
+    """
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        db.create_all()
+        user = User(username=f'test_user_{secrets.token_hex(4)}', email=f'{secrets.token_hex(4)}@example.com', password_hash='-')
+        db.session.add(user)
+        db.session.flush()
+        birthday = Birthday(name='Ada', date=date(1990, 12, 10), notes='', user_id=user.id)
+        db.session.add(birthday)
+        db.session.commit()
+        client = app.test_client()
+        client.set_cookie('access_token_cookie', create_access_token(identity=str(user.id)))
+        return client, birthday.id
+
+def birthday_name(birthday_id):
+    with app.app_context():
+        birthday = db.session.get(Birthday, birthday_id)
+        return birthday.name if birthday else None
+
+def test_bool_update_id_is_rejected():
+    client, birthday_id = make_client()
+    # true would stand for id 1, the first birthday of the database
+    response = client.post('/api/birthdays/batch', json={'update': [{'id': True, 'name': 'Changed'}]})
+    assert response.status_code == 400, response.get_json()
+    assert birthday_name(1) != 'Changed' and birthday_name(birthday_id) == 'Ada'
+
+def test_bool_delete_id_is_rejected():
+    client, birthday_id = make_client()
+    response = client.post('/api/birthdays/batch', json={'delete': [True]})
+    assert response.status_code == 400, response.get_json()
+    assert birthday_name(1) is not None
+
+def test_integer_ids_are_accepted():
+    client, birthday_id = make_client()
+    response = client.post('/api/birthdays/batch', json={'update': [{'id': birthday_id, 'name': 'Grace'}]})
+    assert response.status_code == 200, response.get_json()
+    assert birthday_name(birthday_id) == 'Grace'
+
+def teardown_module(module=None):
+    with app.app_context():
+        db.engine.dispose()
+    shutil.rmtree(TEST_DIR, ignore_errors=True)
+
+if __name__ == "__main__":
+    try:
+        for name, test in list(globals().items()):
+            if name.startswith('test_') and callable(test):
+                test()
+                print(f"{name}: ok")
+    finally:
+        teardown_module()
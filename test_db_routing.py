@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Test Database Routing Script
+
+Checks that the reads of a replica_reads() block all go to the same replica,
+on throwaway in-memory SQLite databases standing in for the primary and two
+replicas. Runs with pytest or directly.
+For development and testing purposes only.
+"""
+
+import os
+import sys
+
+# Add the current directory to the path so that we can import app modules
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, text
+from sqlalchemy.pool import StaticPool
+
+from db_routing import RoutingSession, replica_reads, router
+
+def make_app(replicas=2):
+    """
+    Return (app, db, engines used per statement), with router set up on replicas engines
+    """
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+    router.configure(['sqlite://'] * replicas, engine_options={'poolclass': StaticPool})
+    used = []
+    with app.app_context():
+        for engine in [db.engine] + router.engines:
+            event.listen(engine, 'before_cursor_execute', lambda conn, *args: used.append(conn.engine))
+    return app, db, used
+
+def read(db, statements=5):
+    for _ in range(statements):
+        db.session.execute(text('SELECT 1')).scalar()
+
+def test_block_reads_from_one_replica():
+    app, db, used = make_app()
+    try:
+        with app.app_context():
+            with replica_reads():
+                read(db)
+            first = list(used)
+            db.session.rollback()
+            used.clear()
+            with replica_reads():
+                read(db)
+            second = list(used)
+
+            assert len(set(first)) == 1 and first[0] in router.engines
+            assert len(set(second)) == 1 and second[0] in router.engines
+            # Round-robin between blocks, not between the statements of a block
+            assert first[0] is not second[0]
+    finally:
+        router.configure([])
+
+def test_nested_block_keeps_the_replica():
+    app, db, used = make_app()
+    try:
+        with app.app_context():
+            with replica_reads():
+                read(db, 2)
+                with replica_reads():
+                    read(db, 2)
+                read(db, 2)
+            assert len(set(used)) == 1 and used[0] in router.engines
+    finally:
+        router.configure([])
+
+def test_every_replica_ejected_reads_from_primary():
+    app, db, used = make_app()
+    try:
+        with app.app_context():
+            for engine in router.engines:
+                router.eject(engine)
+            with replica_reads():
+                read(db)
+            assert set(used) == {db.engine}
+    finally:
+        router.configure([])
+
+def test_forbidden_block_reads_from_primary():
+    app, db, used = make_app()
+    try:
+        with app.app_context():
+            with replica_reads():
+                with replica_reads(False):
+                    read(db)
+            assert set(used) == {db.engine}
+    finally:
+        router.configure([])
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f"{name}: ok")
@@ -1,5 +1,6 @@
-import pymysql
 from app import app, db, User, Birthday
+from sqlite_profile import describe
+from sqlalchemy.engine import make_url
 import os
 from dotenv import load_dotenv
 
@@ -7,33 +8,46 @@ from dotenv import load_dotenv
 load_dotenv()
 
 def test_connection():
-    """Test the MySQL connection and database configuration"""
-    print("Testing MySQL connection...")
+    """Test the database connection and configuration: MySQL, or SQLite with a sqlite:// URI"""
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    print(f"Testing connection to {url.render_as_string(hide_password=True)}...")
     
     timeout = 10
     
-    # Try direct connection
-    try:
-        connection = pymysql.connect(
-            charset="utf8mb4",
-            connect_timeout=timeout,
-            cursorclass=pymysql.cursors.DictCursor,
-            db="birthday_buddy",
-            host=os.environ.get('DATABASE_URI'),
-            password=os.environ.get('PASSWORD'),
-            read_timeout=timeout,
-            port=26323,
-            user="avnadmin",
-            write_timeout=timeout,
-        )
-        
-        cursor = connection.cursor()
-        cursor.execute("SELECT 1")
-        result = cursor.fetchone()
-        print("Direct connection successful!")
-        connection.close()
-    except Exception as e:
-        print(f"Direct connection error: {e}")
+    if url.get_backend_name() == 'sqlite':
+        # No server: show the settings the SQLite profile applied instead
+        with app.app_context():
+            try:
+                with db.engine.connect() as connection:
+                    for name, value in describe(connection).items():
+                        print(f"  {name} = {value}")
+                print("SQLite connection successful!")
+            except Exception as e:
+                print(f"SQLite connection error: {e}")
+    else:
+        # Try direct connection, with the host and port of the configured URI
+        try:
+            import pymysql
+            connection = pymysql.connect(
+                charset="utf8mb4",
+                connect_timeout=timeout,
+                cursorclass=pymysql.cursors.DictCursor,
+                db=url.database,
+                host=url.host,
+                password=url.password,
+                read_timeout=timeout,
+                port=url.port or 3306,
+                user=url.username,
+                write_timeout=timeout,
+            )
+            
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            result = cursor.fetchone()
+            print("Direct connection successful!")
+            connection.close()
+        except Exception as e:
+            print(f"Direct connection error: {e}")
     
     # Try SQLAlchemy connection via the Flask app
     print("\nTesting SQLAlchemy connection through Flask...")
@@ -0,0 +1,110 @@
+"""
+Vectorized Birthday Module
+
+Computes next occurrences, days until and ages for whole arrays of birth dates
+at once with NumPy, instead of a Python loop of date.replace calls per birthday.
+Dates are handled as date.toordinal() integers throughout, and Feb 29 birthdays
+fall on Feb 28 in non-leap years, like the scalar path.
+
+NumPy is optional: available() is False when it isn't installed and callers
+fall back to the scalar path in read_models.
+"""
+
+import calendar
+from datetime import date
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None
+
+# date(1970, 1, 1).toordinal() - the civil calendar arithmetic below counts days from 1970-01-01
+_UNIX_EPOCH_ORDINAL = 719163
+
+def available():
+    """
+    Return True if NumPy is installed
+    """
+    return np is not None
+
+def from_dates(birth_dates):
+    """
+    Convert a sequence of datetime.date objects to an array of ordinals
+    """
+    return np.fromiter((d.toordinal() for d in birth_dates), dtype=np.int64, count=len(birth_dates))
+
+def to_dates(ordinals):
+    """
+    Convert an array of ordinals back to a list of datetime.date objects
+    """
+    return [date.fromordinal(ordinal) for ordinal in ordinals.tolist()]
+
+def split(ordinals):
+    """
+    Return the (years, months, days) arrays of an array of ordinals
+    """
+    # Howard Hinnant's civil_from_days, on eras of 400 years starting on March 1st
+    z = np.asarray(ordinals, dtype=np.int64) - _UNIX_EPOCH_ORDINAL + 719468
+    era = z // 146097
+    day_of_era = z - era * 146097
+    year_of_era = (day_of_era - day_of_era // 1460 + day_of_era // 36524 - day_of_era // 146096) // 365
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 - year_of_era // 100)
+    shifted_month = (5 * day_of_year + 2) // 153
+    days = day_of_year - (153 * shifted_month + 2) // 5 + 1
+    months = np.where(shifted_month < 10, shifted_month + 3, shifted_month - 9)
+    years = year_of_era + era * 400 + (months <= 2)
+    return years, months, days
+
+def occurrences_in_year(months, days, year):
+    """
+    Return the ordinals of the birthdays of (month, day) arrays in the given year
+    """
+    months = np.asarray(months, dtype=np.int64)
+    days = np.asarray(days, dtype=np.int64)
+    if not calendar.isleap(year):
+        days = np.where((months == 2) & (days == 29), 28, days)
+    month_starts = np.array([date(year, month, 1).toordinal() for month in range(1, 13)], dtype=np.int64)
+    return month_starts[months - 1] + days - 1
+
+def next_occurrences(months, days, today):
+    """
+    Return (occurrences, years, days_until) of the next birthday on or after today
+    for (month, day) arrays, with occurrences as ordinals
+    """
+    today_ordinal = today.toordinal()
+    occurrences = occurrences_in_year(months, days, today.year)
+    passed = occurrences < today_ordinal
+    years = np.full(occurrences.shape, today.year, dtype=np.int64)
+    if passed.any():
+        occurrences = np.where(passed, occurrences_in_year(months, days, today.year + 1), occurrences)
+        years += passed
+    return occurrences, years, occurrences - today_ordinal
+
+def next_birthdays(ordinals, today):
+    """
+    Return (occurrences, days_until, ages) of the next birthday on or after today
+    for an array of birth date ordinals
+    """
+    birth_years, months, days = split(ordinals)
+    occurrences, years, days_until = next_occurrences(months, days, today)
+    return occurrences, days_until, years - birth_years
+
+def occurrences_between(ordinals, start_date, end_date):
+    """
+    Return (occurrences, in_range) for an array of birth date ordinals, where in_range
+    marks the birthdays falling between start_date and end_date (inclusive).
+    The range may span a year boundary.
+    """
+    _, months, days = split(ordinals)
+    start = start_date.toordinal()
+    end = end_date.toordinal()
+
+    occurrences = occurrences_in_year(months, days, start_date.year)
+    in_range = (occurrences >= start) & (occurrences <= end)
+    for year in range(start_date.year + 1, end_date.year + 1):
+        later = occurrences_in_year(months, days, year)
+        later_in_range = ~in_range & (later >= start) & (later <= end)
+        occurrences = np.where(later_in_range, later, occurrences)
+        in_range |= later_in_range
+
+    return occurrences, in_range